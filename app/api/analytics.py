@@ -2,6 +2,7 @@ from fastapi import APIRouter, HTTPException, Depends
 from app.database import get_nosql_db
 from pymongo.database import Database
 from app.utils.analytics import calculate_avg_completion_time, calculate_completion_time
+from app.schemas.todo_storage import decode_todo, decode_todos, todo_elem_match
 from typing import Optional
 
 router = APIRouter()
@@ -11,7 +12,8 @@ async def get_average_completion_time(user_id: str, db: Database = Depends(get_n
     """
     Retrieves the average completion time of todos for a specific user. If the average completion time
     is already calculated and no new todos are added, it returns the stored average. Otherwise, it
-    recalculates the average completion time based on the user's todos.
+    recalculates the average completion time based on the user's todos. The stored average is kept
+    current by the outbox worker, so this route does not write.
 
     Parameters:
     - user_id (str): The unique identifier for the user.
@@ -27,7 +29,7 @@ async def get_average_completion_time(user_id: str, db: Database = Depends(get_n
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    todos = user.get('todos', [])
+    todos = decode_todos(user.get('todos'))
     if not todos:  
      
         return user.get('average_completion_time')
@@ -37,8 +39,6 @@ async def get_average_completion_time(user_id: str, db: Database = Depends(get_n
     if avg_time_hours is None:
         return user.get('average_completion_time')
 
-    await db.users.update_one({"id": user_id}, {"$set": {"average_completion_time": avg_time_hours}})
-
     return avg_time_hours
 
 
@@ -60,11 +60,11 @@ async def get_todo_completion_time(user_id: str, todo_id: str, db: Database = De
     Raises:
     - HTTPException: If the todo or user is not found.
     """
-    user = await db.users.find_one({"id": user_id, "todos.id": todo_id}, {"todos.$": 1})
+    user = await db.users.find_one({"id": user_id}, todo_elem_match(todo_id))
     if not user or not user.get('todos'):
         raise HTTPException(status_code=404, detail="Todo not found")
 
-    todo = user['todos'][0]  
+    todo = decode_todo(user['todos'][0])
     completion_time_hours = calculate_completion_time(todo)
     
     if completion_time_hours is None:
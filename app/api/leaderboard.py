@@ -0,0 +1,56 @@
+from fastapi import APIRouter, HTTPException, Depends, Query
+from app.database import get_shard_router
+from app.schemas.leaderboard import LeaderboardResponse
+from app.utils.leaderboard import LEADERBOARD_SIZE, fetch_entries, leaderboard, ranked
+from app.utils.outbox import subscribe
+from app.utils.sharding import ShardRouter
+from typing import Optional
+
+router = APIRouter()
+
+subscribe(leaderboard.observe)
+
+
+@router.get("/leaderboard", response_model=LeaderboardResponse)
+async def get_leaderboard(scope: str = Query("global", pattern="^(global|friends)$"), user_id: Optional[str] = None,
+                          limit: int = Query(10, ge=1, le=LEADERBOARD_SIZE),
+                          shard_router: ShardRouter = Depends(get_shard_router)):
+    """
+    Ranks users by completed todos, globally or among a user's friends.
+
+    The global top and a user's global rank come from an in-memory cache of the top users and of
+    the number of users per `completed_todos` value, kept current from outbox worker updates, so
+    neither scans or counts users.
+
+    Parameters:
+    - scope (str): "global" or "friends".
+    - user_id (str, optional): The user to rank. Required for the friends scope, which ranks
+      the user among their friends.
+    - limit (int): Number of entries to return, at most LEADERBOARD_SIZE.
+    - shard_router: A dependency that injects the shard router, provided by get_shard_router.
+
+    Returns:
+    - LeaderboardResponse: The top entries and, if a user was given, that user's entry.
+
+    Raises:
+    - HTTPException: If the friends scope is requested without a user, or the user is not found.
+    """
+    user = None
+    if user_id:
+        db = await shard_router.locate(user_id)
+        user = await db.users.find_one({"id": user_id}, {"_id": 0, "id": 1, "username": 1, "name": 1,
+                                                         "completed_todos": 1, "trees": 1, "friends": 1})
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+
+    if scope == "friends":
+        if user is None:
+            raise HTTPException(status_code=400, detail="user_id is required for the friends leaderboard")
+        friend_ids = [str(friend_id) for friend_id in user.get("friends") or []]
+        entries = ranked(await fetch_entries(shard_router, [user_id, *friend_ids]))
+        own = next((entry for entry in entries if entry["id"] == user_id), None)
+        return {"scope": scope, "entries": entries[:limit], "user": own}
+
+    entries = await leaderboard.top(shard_router, limit)
+    own = await leaderboard.rank(shard_router, user) if user else None
+    return {"scope": scope, "entries": entries, "user": own}
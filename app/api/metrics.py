@@ -0,0 +1,41 @@
+from fastapi import APIRouter
+from app.utils.admission import admission_stats
+from app.utils.loader import coalescing_stats
+from app.utils.outbox import outbox_stats
+
+router = APIRouter()
+
+
+@router.get("/metrics/admission")
+async def get_admission_metrics():
+    """
+    Reports the state and counters of every admission limiter that has been used.
+
+    Returns:
+    - dict: Per route class concurrency limits, queue depth, admitted and shed request counts
+      and queue wait times.
+    """
+    return admission_stats()
+
+
+@router.get("/metrics/reads")
+async def get_read_metrics():
+    """
+    Reports how many `find_one` reads were served from the per-request memo or shared with
+    an identical in-flight read instead of going to Mongo.
+
+    Returns:
+    - dict: Read counters and the coalescing rate.
+    """
+    return coalescing_stats()
+
+
+@router.get("/metrics/outbox")
+async def get_outbox_metrics():
+    """
+    Reports how the outbox worker in this process is doing.
+
+    Returns:
+    - dict: The worker mode and counts of applied events, retried conflicts, failed events and batches.
+    """
+    return outbox_stats()
@@ -1,9 +1,14 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query, Response
 from app.database import get_nosql_db
-from app.schemas.todo import TodoCreate, TodoDisplay, TodoUpdate, PyObjectId
+from app.schemas.todo import TodoCreate, TodoDisplay, TodoUpdate
 from bson import ObjectId
-from typing import List
-from datetime import datetime, date
+from typing import List, Optional
+from datetime import datetime
+from app.schemas.todo_storage import decode_todo, decode_todos
+from app.utils.dates import as_utc_datetime, normalize_weekday, utcnow
+from app.utils import outbox
+from app.utils.todo_query import SORT_FIELDS, build_todo_page_pipeline
+from app.utils.todo_storage import resolve_todo_storage
 import logging
 
 router = APIRouter()
@@ -11,24 +16,68 @@ logging.basicConfig(level=logging.INFO)
 
 
 @router.get("/users/{user_id}/todos", response_model=List[TodoDisplay])
-async def get_all_todos(user_id: str, db=Depends(get_nosql_db)):
+async def get_all_todos(
+    user_id: str,
+    response: Response,
+    completed: Optional[bool] = None,
+    day: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    completed_after: Optional[datetime] = None,
+    completed_before: Optional[datetime] = None,
+    sort: Optional[str] = Query(None, pattern=f"^-?({'|'.join(SORT_FIELDS)})$"),
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    db=Depends(get_nosql_db),
+):
     '''
-    Get all todos for a user
+    Get all todos for a user, optionally filtered, sorted and paged.
+
+    Filtering, sorting and paging run in the database, so only the requested page is
+    transferred and validated. The number of todos matching the filters is returned in
+    the X-Total-Count header.
 
     Parameters:
     user_id (str): The user id
+    completed (bool, optional): Only completed (true) or open (false) todos
+    day (str, optional): Only todos active on this weekday
+    created_after, created_before (datetime, optional): Created date range [after, before)
+    completed_after, completed_before (datetime, optional): Completed date range [after, before)
+    sort (str, optional): created_date, completed_date or title; prefix with "-" for descending
+    offset (int): Number of matching todos to skip
+    limit (int, optional): Maximum number of todos to return
 
     Returns:
     List[TodoDisplay]: A list of TodoDisplay objects
     '''
-    user = await db.users.find_one({"id": user_id})
-    
-    if not user:
+    filters = (completed, day, created_after, created_before, completed_after, completed_before, sort, limit)
+    if offset == 0 and all(value is None for value in filters):
+        user = await db.users.find_one({"id": user_id}, {"todos": 1})
+
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        todos = user.get('todos') or []
+        response.headers["X-Total-Count"] = str(len(todos))
+        return [TodoDisplay(**decode_todo(todo)) for todo in todos]
+
+    if day is not None:
+        try:
+            day = normalize_weekday(day)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+
+    pipeline = build_todo_page_pipeline(
+        user_id, completed=completed, day=day,
+        created_after=created_after, created_before=created_before,
+        completed_after=completed_after, completed_before=completed_before,
+        sort=sort, offset=offset, limit=limit,
+    )
+    result = await db.users.aggregate(pipeline).to_list(1)
+    if not result:
         raise HTTPException(status_code=404, detail="User not found")
-    if 'todos' not in user:
-        return [] 
 
-    return [TodoDisplay(**todo) for todo in user['todos']]
+    response.headers["X-Total-Count"] = str(result[0]["total"])
+    return [TodoDisplay(**decode_todo(todo)) for todo in result[0]["todos"]]
 
 
 @router.post("/users/{user_id}/todos", response_model=TodoDisplay)
@@ -45,15 +94,21 @@ async def add_todo_to_user(user_id: str, todo_data: TodoCreate, db=Depends(get_n
     '''
     todo_dict = todo_data.dict()
     todo_dict['id'] = str(ObjectId())
-    todo_dict['created_date'] = datetime.now()
+    todo_dict['created_date'] = utcnow()
+
+    storage = await resolve_todo_storage(db, user_id)
+    if storage is None:
+        raise HTTPException(status_code=404, detail="User not found or todo not added")
 
     try:
-        result = await db.users.update_one(
-            {"id": user_id},
-            {"$push": {"todos": todo_dict}}
-        )
+        update = {"$push": {"todos": storage.encode(todo_dict)}, "$inc": {"version": 1}}
+        if todo_dict['completed']:
+            outbox.record(update, outbox.completion_event(todo_dict['id'], True, todo_dict['completed_date']))
+        result = await db.users.update_one({"id": user_id}, update)
         if result.modified_count == 0:
             raise HTTPException(status_code=404, detail="User not found or todo not added")
+        if todo_dict['completed']:
+            outbox.notify()
         
         return TodoDisplay(**todo_dict)
     except Exception as e:
@@ -83,24 +138,32 @@ async def update_todo(user_id: str, todo_id: str, todo_update_data: TodoUpdate,
     if not update_data:
         raise HTTPException(status_code=400, detail="No update data provided")
     
+    storage = await resolve_todo_storage(db, user_id)
+    if storage is None:
+        raise HTTPException(status_code=404, detail="Todo not found or no update needed")
+
     try:
-        result = await db.users.update_one(
-            {"id": user_id, "todos.id": todo_id},
-            {"$set": {f"todos.$.{k}": v for k, v in update_data.items()}}
-        )
+        update = {"$set": storage.set_fields(update_data), "$inc": {"version": 1}}
+        changes_completion = "completed" in update_data or "completed_date" in update_data
+        if changes_completion:
+            outbox.record(update, outbox.completion_event(
+                todo_id, update_data.get("completed"), update_data.get("completed_date")))
+        result = await db.users.update_one({"id": user_id, **storage.match(todo_id)}, update)
         
         if result.modified_count == 0:
             raise HTTPException(status_code=404, detail="Todo not found or no update needed")
+        if changes_completion:
+            outbox.notify()
         
         updated_user = await db.users.find_one(
-            {"id": user_id, "todos.id": todo_id},
+            {"id": user_id, **storage.match(todo_id)},
             {"todos.$": 1}
         )
         
         if not updated_user:
             raise HTTPException(status_code=404, detail="Todo not found after update")
         
-        updated_todo = updated_user["todos"][0]  
+        updated_todo = decode_todo(updated_user["todos"][0])
         return TodoDisplay(**updated_todo)
 
     except Exception as e:
@@ -122,14 +185,20 @@ async def delete_todo(user_id: str, todo_id: str, db=Depends(get_nosql_db)):
     Raises:
     - HTTPException: If the todo is not found or if a database operation fails.
     """
+    storage = await resolve_todo_storage(db, user_id)
+    if storage is None:
+        raise HTTPException(status_code=404, detail="Todo not found")
+
     try:
         result = await db.users.update_one(
-            {"id": user_id},
-            {"$pull": {"todos": {"id": todo_id}}}
+            {"id": user_id, **storage.match(todo_id)},
+            outbox.record({"$pull": {"todos": storage.element(todo_id)}, "$inc": {"version": 1}},
+                          outbox.make_event(outbox.TODO_DELETED, todo_id))
         )
         
         if result.modified_count == 0:
             raise HTTPException(status_code=404, detail="Todo not found")
+        outbox.notify()
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -154,46 +223,51 @@ async def complete_todo(user_id: str, todo_id: str, db=Depends(get_nosql_db)):
     Raises:
     - HTTPException: If the user or todo is not found, or if the update fails.
     """
-    user = await db.users.find_one({"id": user_id, "todos.id": todo_id})
+    user = await db.users.find_one({"id": user_id})
     if not user:
         raise HTTPException(status_code=404, detail="User or Todo not found")
 
-    todo = next((item for item in user['todos'] if item['id'] == todo_id), None)
+    todo = next((item for item in decode_todos(user.get('todos')) if item['id'] == todo_id), None)
     if not todo:
         raise HTTPException(status_code=404, detail="Todo not found")
 
+    storage = await resolve_todo_storage(db, user_id, user)
+
     if todo.get('completed'):
         new_completed = False
         new_completed_date = None  
+        event = outbox.make_event(outbox.TODO_REOPENED, todo_id, as_utc_datetime(todo.get('completed_date')))
     else:
         new_completed = True
-        new_completed_date = datetime.now()
+        now = utcnow()
+        # BSON datetimes have millisecond precision
+        new_completed_date = now.replace(microsecond=now.microsecond // 1000 * 1000)
+        event = outbox.make_event(outbox.TODO_COMPLETED, todo_id, new_completed_date)
 
     result = await db.users.update_one(
-        {"id": user_id, "todos.id": todo_id},
-        {"$set": {
-            "todos.$.completed": new_completed,
-            "todos.$.completed_date": new_completed_date
-        }}
+        {"id": user_id, **storage.match(todo_id)},
+        outbox.record({"$set": storage.set_fields({
+            "completed": new_completed,
+            "completed_date": new_completed_date
+        }), "$inc": {"version": 1}}, event)
     )
 
     if result.modified_count == 0:
         raise HTTPException(status_code=500, detail="Failed to update the todo item")
+    outbox.notify()
 
-    updated_todo = await db.users.find_one(
-        {"id": user_id, "todos.id": todo_id},
-        {"todos.$": 1}
-    )
-    if not updated_todo:
-        raise HTTPException(status_code=404, detail="Todo not found after update")
-
-    return TodoDisplay(**updated_todo['todos'][0])  
+    # The update only touched these two fields, so the stored todo is known without re-reading it.
+    todo['completed'] = new_completed
+    todo['completed_date'] = new_completed_date
+    return TodoDisplay(**todo)
 
 @router.get("/users/{user_id}/todos/check_reset", response_model=List[TodoDisplay])
 async def check_and_reset_todos(user_id: str, db=Depends(get_nosql_db)):
     """
     Checks and resets the completed status of todos based on the date they were completed. 
     Todos that were completed before today's date will have their completion status reset.
+    Each reset records an event from which the outbox worker updates `completed_todos` and
+    the tree stage.
 
     Parameters:
     - user_id (str): The unique identifier for the user.
@@ -205,7 +279,7 @@ async def check_and_reset_todos(user_id: str, db=Depends(get_nosql_db)):
     Raises:
     - HTTPException: If the user is not found or no todos need processing.
     """
-    current_time = datetime.now()
+    current_time = utcnow()
     logging.info(f"Current time: {current_time}")
 
     user = await db.users.find_one({"id": user_id})
@@ -218,46 +292,36 @@ async def check_and_reset_todos(user_id: str, db=Depends(get_nosql_db)):
         return []  
 
     updated_todos = []
-    completions_needed_reset = 0
+    storage = await resolve_todo_storage(db, user_id, user)
 
-    for todo in user['todos']:
+    for todo in decode_todos(user['todos']):
         should_reset = False
         logging.info(f"Checking todo: {todo['id']}, Completed: {todo.get('completed')}, Completed Date: {todo.get('completed_date')}")
         
         if todo.get('completed'):
-            completed_date = todo.get('completed_date')
+            completed_date = as_utc_datetime(todo.get('completed_date'))
             if completed_date and completed_date.date() < current_time.date():
                 should_reset = True
 
         if should_reset:
             logging.info(f"Resetting todo: {todo['id']}")
-            todo['completed'] = False
-            todo['completed_date'] = None
-            completions_needed_reset += 1
-            updated_todos.append(todo)
+            event = outbox.make_event(outbox.TODO_RESET, todo['id'], completed_date)
 
+            # Only a todo that is still completed is reset, so concurrent checks record one event.
             result = await db.users.update_one(
-                {"id": user_id, "todos.id": todo['id']},
-                {"$set": {
-                    "todos.$.completed": False,
-                    "todos.$.completed_date": None
-                }}
+                {"id": user_id, "todos": {"$elemMatch": {**storage.element(todo['id']), storage.key("completed"): True}}},
+                outbox.record({"$set": storage.set_fields({
+                    "completed": False,
+                    "completed_date": None
+                }), "$inc": {"version": 1}}, event)
             )
             logging.info(f"Update result for todo {todo['id']}: {result.modified_count}")
+            if result.modified_count:
+                todo['completed'] = False
+                todo['completed_date'] = None
+                updated_todos.append(todo)
 
-    if completions_needed_reset > 0:
-        new_count = user.get('completed_todos', 0) + completions_needed_reset
-        logging.info(f"Updating completed todos count: {new_count}")
-        tree_index = next((index for index, tree in enumerate(user['trees']) if tree['name'] == 'Uncaria'), None)
-
-        if tree_index is not None:
-            new_stage = user['trees'][tree_index]['stage'] + (new_count // 4) - (user.get('completed_todos', 0) // 4)
-            await db.users.update_one(
-                {"id": user_id},
-                {"$set": {
-                    "completed_todos": new_count,
-                    f"trees.{tree_index}.stage": new_stage
-                }}
-            )
+    if updated_todos:
+        outbox.notify()
 
     return [TodoDisplay(**todo) for todo in updated_todos]
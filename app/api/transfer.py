@@ -0,0 +1,84 @@
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile
+from fastapi.responses import StreamingResponse
+from app.database import get_nosql_db, get_shard_router
+from app.utils.auth import require_admin, require_owner_or_admin
+from app.utils.transfer import export_all_cursor, export_lines, export_user_cursor, import_lines, iter_upload_lines
+
+router = APIRouter()
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def _export_response(cursor, fmt: str, filename: str) -> StreamingResponse:
+    return StreamingResponse(
+        export_lines(cursor, fmt),
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'},
+    )
+
+
+@router.get("/users/{user_id}/export", dependencies=[Depends(require_owner_or_admin)])
+async def export_user(user_id: str, format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+                      db=Depends(get_nosql_db)):
+    """
+    Streams a user's data as NDJSON (the user record followed by one record per todo) or
+    as CSV (one row per todo). Only the user themselves or an admin may export it.
+
+    Parameters:
+    - user_id (str): The unique identifier of the user.
+    - format (str): "ndjson" or "csv".
+    - db: A dependency that injects the database session, provided by get_nosql_db.
+
+    Returns:
+    - StreamingResponse: The exported records.
+
+    Raises:
+    - HTTPException: If the caller is not authorized or the user is not found.
+    """
+    if not await db.users.find_one({"id": user_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="User not found")
+    return _export_response(export_user_cursor(db, user_id), format, f"user-{user_id}")
+
+
+@router.get("/admin/export", dependencies=[Depends(require_admin)])
+async def export_all_users(format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+                           include_credentials: bool = False, shard_router=Depends(get_shard_router)):
+    """
+    Streams every user and todo in the same formats as the per-user export, reading users
+    from a cursor on each shard so memory use does not grow with the number of users.
+    Admins only.
+
+    Parameters:
+    - format (str): "ndjson" or "csv".
+    - include_credentials (bool): Include password hashes.
+    - shard_router: A dependency that injects the shard router, provided by get_shard_router.
+
+    Returns:
+    - StreamingResponse: The exported records.
+
+    Raises:
+    - HTTPException: If the caller is not an admin.
+    """
+    return _export_response(export_all_cursor(shard_router, include_credentials), format, "users")
+
+
+@router.post("/admin/import", dependencies=[Depends(require_admin)])
+async def import_users(file: UploadFile = File(...), batch_size: int = Query(1000, ge=1, le=10000),
+                       shard_router=Depends(get_shard_router)):
+    """
+    Imports an NDJSON export. The upload is parsed line by line and written in unordered
+    batches of `batch_size`; invalid or conflicting records are reported and skipped.
+    Admins only.
+
+    Parameters:
+    - file (UploadFile): The NDJSON file.
+    - batch_size (int): Number of users or todos written per round trip.
+    - shard_router: A dependency that injects the shard router, provided by get_shard_router.
+
+    Returns:
+    - dict: Line, insert and error counts, and up to 1000 per-line errors.
+
+    Raises:
+    - HTTPException: If the caller is not an admin.
+    """
+    return await import_lines(shard_router, iter_upload_lines(file), batch_size=batch_size)
@@ -1,41 +1,95 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from app.schemas.user import UserCreate, UserDisplay, UserModel, PyObjectId, UserUpdate, UserResponse, TokenResponse
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from fastapi.security import OAuth2PasswordRequestForm
+from starlette.concurrency import run_in_threadpool
+from app.schemas.user import UserCreate, UserDisplay, UserModel, PyObjectId, UserUpdate, UserResponse, TokenResponse, PatchOperation
 from app.utils.user_utils import get_password_hash, authenticate_user, create_access_token
 from datetime import timedelta
-from app.database import get_nosql_db
+from typing import List, Optional
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure
+from app.database import get_nosql_db, get_shard_router
+from app.utils.sharding import ShardRouter
+from app.utils import outbox
+from app.utils.admission import admission
+from app.schemas.todo_storage import COMPACT, COMPACT_ENABLED, LEGACY, decode_todos, decode_user
+from app.utils.json_patch import PatchError, parse_pointer, translate_patch
+from app.utils.leaderboard import MAX_FRIENDS
+from app.utils.todo_storage import resolve_todo_storage
 from bson import ObjectId
+import asyncio
 import logging
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 router = APIRouter()
 
 logging.basicConfig(level=logging.INFO)
 
+async def _claim_unique_fields(shard_router: ShardRouter, user_id: str, changes: dict) -> list:
+    """
+    Reserves new usernames and emails in the shard directory, releasing them again if any is taken.
+
+    Returns:
+    - list: The (field, value) pairs that were claimed.
+
+    Raises:
+    - HTTPException: If a value already belongs to another user.
+    """
+    claimed = []
+    for field, value in changes.items():
+        if not await shard_router.claim(field, value, user_id):
+            for claimed_field, claimed_value in claimed:
+                await shard_router.release(claimed_field, claimed_value, user_id)
+            detail = "Email already registered" if field == "email" else "Username already taken"
+            raise HTTPException(status_code=400, detail=detail)
+        claimed.append((field, value))
+    return claimed
+
+
+async def _release_unique_fields(shard_router: ShardRouter, user_id: str, values: list):
+    for field, value in values:
+        await shard_router.release(field, value, user_id)
+
+
+async def _claim_renames(shard_router: ShardRouter, db, user_filter: dict, user_id: str, changes: dict):
+    """
+    Claims changed usernames and emails in the shard directory before an update.
+
+    Returns:
+    - tuple: The claimed new values and the previous values to release once the update succeeds.
+    """
+    changes = {field: value for field, value in changes.items() if value is not None}
+    if not shard_router.sharded or not changes:
+        return [], []
+    current = await db['users'].find_one(user_filter, {"username": 1, "email": 1}) or {}
+    changes = {field: value for field, value in changes.items() if current.get(field) != value}
+    claimed = await _claim_unique_fields(shard_router, user_id, changes)
+    return claimed, [(field, current[field]) for field, _ in claimed if current.get(field)]
+
+
 @router.get("/users/", response_model=list[UserDisplay])
-async def get_users(db=Depends(get_nosql_db)):
+async def get_users(shard_router: ShardRouter = Depends(get_shard_router)):
     """
-    Retrieves a list of all users from the database.
+    Retrieves a list of all users from the database, querying every shard concurrently.
 
     Parameters:
-    - db: A dependency that injects the database session, provided by get_nosql_db.
+    - shard_router: A dependency that injects the shard router, provided by get_shard_router.
 
     Returns:
     - list[UserDisplay]: A list of users formatted according to the UserDisplay schema.
     """
-    users = await db['users'].find({}).to_list(1000)
-    return users
+    results = await asyncio.gather(*(db['users'].find({}).to_list(1000) for db in shard_router.databases()))
+    users = [user for shard_users in results for user in shard_users][:1000]
+    return [decode_user(user) for user in users]
 
 
-@router.post("/users/", response_model=UserDisplay)
-async def create_user(user: UserCreate, db=Depends(get_nosql_db)):
+@router.post("/users/", response_model=UserDisplay, dependencies=[Depends(admission("expensive"))])
+async def create_user(user: UserCreate, shard_router: ShardRouter = Depends(get_shard_router)):
     """
     Creates a new user with the provided user data after performing validation checks
     for existing email and username.
 
     Parameters:
     - user (UserCreate): The user data required to create a new user.
-    - db: A dependency that injects the database session, provided by get_nosql_db.
+    - shard_router: A dependency that injects the shard router, provided by get_shard_router.
 
     Returns:
     - UserDisplay: The created user's data formatted according to the UserDisplay schema.
@@ -43,31 +97,46 @@ async def create_user(user: UserCreate, db=Depends(get_nosql_db)):
     Raises:
     - HTTPException: If the email or username is already registered or if there is a failure in user creation.
     """
-    existing_user = await db['users'].find_one({"email": user.email})
-    if existing_user:
-        raise HTTPException(status_code=400, detail="Email already registered")
-
-    existing_username = await db['users'].find_one({"username": user.username})
-    if existing_username:
-        raise HTTPException(status_code=400, detail="Username already taken")
-
-    hashed_password = get_password_hash(user.password)
-    new_user_data = user.dict()
-    new_user_data['hashed_password'] = hashed_password
-    del new_user_data['password']
-
-    new_user_data['id'] = str(ObjectId())
-
-    new_user = UserModel(**new_user_data)
+    new_user_id = str(ObjectId())
+    db = shard_router.database_for(new_user_id)
+    claimed = []
+    if shard_router.sharded:
+        claimed = await _claim_unique_fields(
+            shard_router, new_user_id, {"username": user.username, "email": user.email})
+    else:
+        existing_user = await db['users'].find_one({"email": user.email})
+        if existing_user:
+            raise HTTPException(status_code=400, detail="Email already registered")
+
+        existing_username = await db['users'].find_one({"username": user.username})
+        if existing_username:
+            raise HTTPException(status_code=400, detail="Username already taken")
+
+    inserted = False
     try:
-        result = await db['users'].insert_one(new_user.dict(by_alias=True))
-        new_user_data['id'] = result.inserted_id
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Failed to create user: {str(e)}")
+        hashed_password = await run_in_threadpool(get_password_hash, user.password)
+        new_user_data = user.dict()
+        new_user_data['hashed_password'] = hashed_password
+        del new_user_data['password']
+
+        new_user_data['id'] = new_user_id
+        new_user_data['schema_version'] = (COMPACT if COMPACT_ENABLED else LEGACY).schema_version
+
+        new_user = UserModel(**new_user_data)
+        try:
+            result = await db['users'].insert_one(new_user.dict(by_alias=True))
+            new_user_data['id'] = result.inserted_id
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Failed to create user: {str(e)}")
+        inserted = True
+    finally:
+        # Also runs when the request is cancelled; an interrupted insert may still have landed.
+        if claimed and not inserted and not await db['users'].find_one({"id": new_user_id}, {"_id": 1}):
+            await _release_unique_fields(shard_router, new_user_id, claimed)
     return new_user.dict(by_alias=True)
 
 @router.get("/users/{user_id}", response_model=UserDisplay)
-async def get_user(user_id: str, db=Depends(get_nosql_db)):
+async def get_user(user_id: str, response: Response, db=Depends(get_nosql_db)):
     """
     Retrieves a specific user by their unique identifier.
 
@@ -76,7 +145,8 @@ async def get_user(user_id: str, db=Depends(get_nosql_db)):
     - db: A dependency that injects the database session, provided by get_nosql_db.
 
     Returns:
-    - UserDisplay: The user's data formatted according to the UserDisplay schema.
+    - UserDisplay: The user's data formatted according to the UserDisplay schema. The ETag
+      header holds the user's version, to send as If-Match when patching the user.
 
     Raises:
     - HTTPException: If the user is not found.
@@ -84,17 +154,19 @@ async def get_user(user_id: str, db=Depends(get_nosql_db)):
     user = await db['users'].find_one({"id": PyObjectId(user_id)})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    return user
+    response.headers["ETag"] = f'"{user.get("version", 0)}"'
+    return decode_user(user)
 
 
-@router.post("/token", response_model=TokenResponse)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db=Depends(get_nosql_db)):
+@router.post("/token", response_model=TokenResponse, dependencies=[Depends(admission("expensive"))])
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(),
+                                 shard_router: ShardRouter = Depends(get_shard_router)):
     """
     Authenticates a user and issues a JWT token upon successful authentication.
 
     Parameters:
     - form_data (OAuth2PasswordRequestForm): The form data containing the username and password.
-    - db: A dependency that injects the database session, provided by get_nosql_db.
+    - shard_router: A dependency that injects the shard router, provided by get_shard_router.
 
     Returns:
     - TokenResponse: The response containing the JWT token and user's information.
@@ -102,14 +174,15 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     Raises:
     - HTTPException: If the username or password is incorrect.
     """
-    user = await authenticate_user(db, form_data.username, form_data.password)
+    db = await shard_router.locate_username(form_data.username)
+    user = await authenticate_user(db, form_data.username, form_data.password) if db is not None else None
     if not user:
         raise HTTPException(
             status_code=401,
             detail="Incorrect username or password"
         )
     access_token_expires = timedelta(minutes=15)
-    access_token = create_access_token(data={"sub": user['username']}, expires_delta=access_token_expires)
+    access_token = create_access_token(data={"sub": user['username'], "uid": str(user['id'])}, expires_delta=access_token_expires)
     
     user_response = UserResponse(
         id=user['id'],  
@@ -127,8 +200,27 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
         user=user_response
     )
 
+def _completion_events(current: list, todos: list) -> list:
+    """
+    Outbox events for the completion changes made by replacing a user's todos with `todos`,
+    including the removal of completed todos.
+    """
+    previous = {str(todo['id']): todo for todo in current}
+    events = []
+    for todo in todos:
+        old = previous.pop(str(todo['id']), {})
+        if bool(old.get('completed')) != bool(todo.get('completed')) or \
+                (todo.get('completed') and old.get('completed_date') != todo.get('completed_date')):
+            events.append(outbox.completion_event(str(todo['id']), bool(todo.get('completed')),
+                                                  todo.get('completed_date')))
+    events.extend(outbox.make_event(outbox.TODO_DELETED, todo_id)
+                  for todo_id, todo in previous.items() if todo.get('completed'))
+    return events
+
+
 @router.put("/users/{user_id}", response_model=UserDisplay)
-async def update_user(user_id: str, update_data: UserUpdate, db=Depends(get_nosql_db)):
+async def update_user(user_id: str, update_data: UserUpdate, db=Depends(get_nosql_db),
+                      shard_router: ShardRouter = Depends(get_shard_router)):
     """
     Updates the specified user with the provided update data.
 
@@ -136,6 +228,7 @@ async def update_user(user_id: str, update_data: UserUpdate, db=Depends(get_nosq
     - user_id (str): The unique identifier of the user.
     - update_data (UserUpdate): The data used to update the user.
     - db: A dependency that injects the database session, provided by get_nosql_db.
+    - shard_router: A dependency that injects the shard router, provided by get_shard_router.
 
     Returns:
     - UserDisplay: The updated user's data formatted according to the UserDisplay schema.
@@ -144,15 +237,188 @@ async def update_user(user_id: str, update_data: UserUpdate, db=Depends(get_nosq
     - HTTPException: If the user is not found, no update is needed, or the update fails.
     """
     update_json = update_data.dict(exclude_unset=True, by_alias=True)
-
-    result = await db['users'].update_one({"id": PyObjectId(user_id)}, {"$set": update_json})
+    events = []
+    if update_json.get('todos') is not None:
+        current = await db['users'].find_one({"id": PyObjectId(user_id)}, {"todos": 1}) or {}
+        events = _completion_events(decode_todos(current.get('todos')), update_json['todos'])
+        storage = COMPACT if COMPACT_ENABLED else LEGACY
+        update_json['todos'] = [storage.encode(todo) for todo in update_json['todos']]
+        update_json['schema_version'] = storage.schema_version
+
+    claimed, previous = await _claim_renames(
+        shard_router, db, {"id": PyObjectId(user_id)}, user_id,
+        {field: update_json.get(field) for field in ("username", "email")})
+
+    update = {"$set": update_json, "$inc": {"version": 1}}
+    if events:
+        outbox.record(update, *events)
+    result = await db['users'].update_one({"id": PyObjectId(user_id)}, update)
     if result.modified_count == 0:
+        await _release_unique_fields(shard_router, user_id, claimed)
         raise HTTPException(status_code=404, detail="User not found or no update needed")
+    await _release_unique_fields(shard_router, user_id, previous)
+    if events:
+        outbox.notify()
 
     updated_user = await db['users'].find_one({"id": PyObjectId(user_id)})
     if not updated_user:
         raise HTTPException(status_code=404, detail="User not found after update")
 
-    return updated_user
+    return decode_user(updated_user)
+
+
+def _parse_if_match(if_match: str) -> int:
+    value = if_match.strip()
+    if value.startswith("W/"):
+        value = value[2:]
+    try:
+        return int(value.strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="If-Match must be a user version")
+
+
+@router.patch("/users/{user_id}", response_model=UserDisplay)
+async def patch_user(user_id: str, operations: List[PatchOperation], response: Response,
+                     if_match: Optional[str] = Header(default=None), db=Depends(get_nosql_db),
+                     shard_router: ShardRouter = Depends(get_shard_router)):
+    """
+    Applies a JSON Patch (RFC 6902) to the specified user as one targeted update, so the write
+    only touches the changed fields instead of replacing the todos or trees arrays.
+
+    Parameters:
+    - user_id (str): The unique identifier of the user.
+    - operations (List[PatchOperation]): The patch operations, applied in order.
+    - if_match (str, optional): The user version the patch is based on, as returned in the ETag header.
+    - db: A dependency that injects the database session, provided by get_nosql_db.
+    - shard_router: A dependency that injects the shard router, provided by get_shard_router.
+
+    Returns:
+    - UserDisplay: The updated user. The ETag header holds the new version.
+
+    Raises:
+    - HTTPException: 400 if the patch is invalid or its operations conflict, 404 if the user is not
+      found, 409 if a test operation fails or a target todo does not exist, 412 if If-Match does
+      not match the current version.
+    """
+    try:
+        touches_todos = any(parse_pointer(operation.path)[0] == "todos" for operation in operations)
+    except PatchError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    expected_version = _parse_if_match(if_match) if if_match else None
+    storage = LEGACY
+    if touches_todos:
+        storage = await resolve_todo_storage(db, user_id, convert=expected_version is None)
+        if storage is None:
+            raise HTTPException(status_code=404, detail="User not found")
+
+    try:
+        translation = translate_patch(operations, storage)
+    except PatchError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    conditions = list(translation.conditions)
+    if expected_version is not None:
+        conditions.append({"version": expected_version} if expected_version else {"version": {"$in": [0, None]}})
+    query = {"id": user_id}
+    if conditions:
+        query["$and"] = conditions
+
+    claimed, previous = await _claim_renames(
+        shard_router, db, {"id": user_id}, user_id,
+        {field: translation.set.get(field) for field in ("username", "email")})
+
+    update = translation.update()
+    try:
+        updated_user = await db['users'].find_one_and_update(
+            query,
+            update,
+            array_filters=translation.array_filters or None,
+            return_document=ReturnDocument.AFTER,
+        )
+    except OperationFailure as e:
+        await _release_unique_fields(shard_router, user_id, claimed)
+        raise HTTPException(status_code=400, detail=f"Patch could not be applied: {e.details.get('errmsg', str(e)) if e.details else str(e)}")
 
+    if not updated_user:
+        await _release_unique_fields(shard_router, user_id, claimed)
+        current = await db['users'].find_one({"id": user_id}, {"version": 1})
+        if not current:
+            raise HTTPException(status_code=404, detail="User not found")
+        if expected_version is not None and current.get("version", 0) != expected_version:
+            raise HTTPException(status_code=412, detail="User was modified; reload and retry",
+                                headers={"ETag": f'"{current.get("version", 0)}"'})
+        raise HTTPException(status_code=409, detail="Patch test failed or target todo not found")
+
+    await _release_unique_fields(shard_router, user_id, previous)
+    if "outbox" in update.get("$push", {}):
+        outbox.notify()
+    response.headers["ETag"] = f'"{updated_user.get("version", 0)}"'
+    return decode_user(updated_user)
+
+
+
+@router.put("/users/{user_id}/friends/{friend_id}", response_model=List[str])
+async def add_friend(user_id: str, friend_id: str, db=Depends(get_nosql_db),
+                     shard_router: ShardRouter = Depends(get_shard_router)):
+    """
+    Adds a user to another user's friends, whose ranks the friends leaderboard compares. A user
+    can have at most MAX_FRIENDS friends.
+
+    Parameters:
+    - user_id (str): The unique identifier of the user.
+    - friend_id (str): The unique identifier of the user to add as a friend.
+    - db: A dependency that injects the database session, provided by get_nosql_db.
+    - shard_router: A dependency that injects the shard router, provided by get_shard_router.
+
+    Returns:
+    - List[str]: The user's friend ids.
 
+    Raises:
+    - HTTPException: If either user is not found, a user adds themselves, or the user already
+      has MAX_FRIENDS friends.
+    """
+    if friend_id == user_id:
+        raise HTTPException(status_code=400, detail="Users cannot befriend themselves")
+    friend_db = await shard_router.locate(friend_id)
+    if not await friend_db['users'].find_one({"id": friend_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Friend not found")
+
+    user = await db['users'].find_one_and_update(
+        {"id": user_id, "$or": [{f"friends.{MAX_FRIENDS - 1}": {"$exists": False}}, {"friends": friend_id}]},
+        {"$addToSet": {"friends": friend_id}, "$inc": {"version": 1}},
+        projection={"friends": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not user:
+        if await db['users'].find_one({"id": user_id}, {"_id": 1}):
+            raise HTTPException(status_code=400, detail=f"Users can have at most {MAX_FRIENDS} friends")
+        raise HTTPException(status_code=404, detail="User not found")
+    return user.get("friends", [])
+
+
+@router.delete("/users/{user_id}/friends/{friend_id}", response_model=List[str])
+async def remove_friend(user_id: str, friend_id: str, db=Depends(get_nosql_db)):
+    """
+    Removes a user from another user's friends.
+
+    Parameters:
+    - user_id (str): The unique identifier of the user.
+    - friend_id (str): The unique identifier of the friend to remove.
+    - db: A dependency that injects the database session, provided by get_nosql_db.
+
+    Returns:
+    - List[str]: The user's remaining friend ids.
+
+    Raises:
+    - HTTPException: If the user is not found.
+    """
+    user = await db['users'].find_one_and_update(
+        {"id": user_id},
+        {"$pull": {"friends": friend_id}, "$inc": {"version": 1}},
+        projection={"friends": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user.get("friends", [])
@@ -1,28 +1,61 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
-from fastapi import Depends
+from fastapi import Depends, Request
+from app.utils.loader import request_database
+from app.utils.sharding import ShardRouter, parse_shards
 
 
 MONGODB_URL = os.getenv("MONGODB_URL") 
+# Optional: "name=mongodb://host:port/db;name2=..." to spread users over several databases,
+# and the shard names in place before the current rebalance, e.g. "s0;s1".
+MONGODB_SHARDS = os.getenv("MONGODB_SHARDS")
+MONGODB_SHARDS_PREVIOUS = os.getenv("MONGODB_SHARDS_PREVIOUS")
 client: AsyncIOMotorClient = None
+clients = {}
 
 
 database = None
+router: ShardRouter = None
 
 def get_database() -> AsyncIOMotorClient:
     return database
 
+def get_router() -> ShardRouter:
+    return router
+
 async def connect_to_mongo():
-    global client, database
-    client = AsyncIOMotorClient(MONGODB_URL)
-    database = client['todo_list_db']
+    global client, database, router
+    shards = {}
+    if MONGODB_SHARDS:
+        for name, url, database_name in parse_shards(MONGODB_SHARDS):
+            if url not in clients:
+                clients[url] = AsyncIOMotorClient(url, tz_aware=True)
+            shards[name] = clients[url][database_name]
+    else:
+        clients[MONGODB_URL] = AsyncIOMotorClient(MONGODB_URL, tz_aware=True)
+        shards["default"] = clients[MONGODB_URL]['todo_list_db']
+    previous = [name.strip() for name in MONGODB_SHARDS_PREVIOUS.split(";")] if MONGODB_SHARDS_PREVIOUS else None
+    router = ShardRouter(shards, previous=previous)
+    client = next(iter(clients.values()))
+    database = router.default
 
 async def close_mongo_connection():
-    client.close()
+    for shard_client in clients.values():
+        shard_client.close()
+    clients.clear()
+
+
+async def get_shard_router():
+    return get_router()
 
 
-async def get_nosql_db():
-    db = get_database()
+async def get_nosql_db(request: Request, shard_router: ShardRouter = Depends(get_shard_router)):
+    user_id = request.path_params.get("user_id")
+    if shard_router is None:
+        db = None
+    else:
+        db = await shard_router.locate(user_id) if user_id else shard_router.default
+    db = request_database(db)
     try:
         yield db
     finally:
@@ -0,0 +1,5 @@
+import asyncio
+
+from app.loadtest.runner import main, parse_args
+
+asyncio.run(main(parse_args()))
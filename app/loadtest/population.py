@@ -0,0 +1,116 @@
+"""
+Synthetic users and todos shaped like `UserModel` and `TodoDisplay`, for load testing.
+"""
+import math
+import random
+from dataclasses import dataclass
+from datetime import timedelta
+
+from bson import ObjectId
+
+from app.schemas.todo_storage import COMPACT, COMPACT_ENABLED, LEGACY
+from app.utils.dates import WEEKDAYS, utcnow
+from app.utils.user_utils import get_password_hash
+
+PASSWORD = "loadtest-password"
+
+
+@dataclass
+class PopulationConfig:
+    users: int = 1000
+    todos_mean: float = 20.0
+    todos_sigma: float = 0.8
+    todos_max: int = 500
+    completion_ratio: float = 0.4
+    date_spread_days: int = 60
+    seed: int = 1
+
+
+def _todo_count(rng: random.Random, config: PopulationConfig) -> int:
+    """Log-normal todo counts: most users have a few, some have many."""
+    if config.todos_mean <= 0:
+        return 0
+    mu = math.log(config.todos_mean) - config.todos_sigma ** 2 / 2
+    return min(config.todos_max, int(rng.lognormvariate(mu, config.todos_sigma)))
+
+
+def make_todo(rng: random.Random, config: PopulationConfig, now) -> dict:
+    created = now - timedelta(seconds=rng.uniform(0, config.date_spread_days * 86400))
+    completed = rng.random() < config.completion_ratio
+    completed_date = None
+    if completed:
+        completed_date = min(now, created + timedelta(hours=rng.expovariate(1 / 24)))
+    return {
+        "id": str(ObjectId()),
+        "title": f"Todo {rng.randrange(10 ** 6)}",
+        "description": rng.choice([None, "Synthetic todo used for load testing"]),
+        "days_active": sorted(rng.sample(WEEKDAYS, rng.randint(0, 7)), key=WEEKDAYS.index),
+        "created_date": created,
+        "completed": completed,
+        "completed_date": completed_date,
+    }
+
+
+def generate_users(config: PopulationConfig):
+    """
+    Yield user documents ready to insert, encoded in the configured todo storage layout.
+
+    All users share one password (`PASSWORD`) hashed once, so seeding is not bcrypt bound.
+    """
+    rng = random.Random(config.seed)
+    storage = COMPACT if COMPACT_ENABLED else LEGACY
+    hashed_password = get_password_hash(PASSWORD)
+    now = utcnow()
+    for index in range(config.users):
+        todos = [make_todo(rng, config, now) for _ in range(_todo_count(rng, config))]
+        completed_todos = rng.randint(0, 200)
+        yield {
+            "id": str(ObjectId()),
+            "username": f"loadtest-{index}",
+            "email": f"loadtest-{index}@example.com",
+            "hashed_password": hashed_password,
+            "name": f"Load Test {index}",
+            "todos": [storage.encode(todo) for todo in todos],
+            "completed_todos": completed_todos,
+            "trees": [{"name": "Uncaria", "stage": 1 + completed_todos // 4}],
+            "average_completion_time": None,
+            "schema_version": storage.schema_version,
+        }
+
+
+def is_loadtest_database(name: str) -> bool:
+    return "loadtest" in name.lower()
+
+
+async def seed(db, config: PopulationConfig, batch_size: int = 500, reset: bool = False) -> list:
+    """
+    Replace the users collection with a synthetic population.
+
+    Parameters:
+    - db: The database to seed; its users are deleted first.
+    - config (PopulationConfig): The shape of the population.
+    - batch_size (int): Users inserted per round trip.
+    - reset (bool): Allow deleting the users of a database whose name does not contain
+      "loadtest".
+
+    Returns:
+    - list: (id, username, todo ids) for every seeded user, used to build requests.
+
+    Raises:
+    - ValueError: If the database does not look like a load test database and `reset` is False.
+    """
+    if not reset and not is_loadtest_database(db.name):
+        raise ValueError(f"Refusing to replace the users of {db.name!r}: the name does not contain "
+                         f"'loadtest'; pass --reset to seed it anyway")
+    await db.users.delete_many({})
+    index, batch = [], []
+    for user in generate_users(config):
+        todo_ids = [str(todo.get("id", todo.get("_i"))) for todo in user["todos"]]
+        index.append((user["id"], user["username"], todo_ids))
+        batch.append(user)
+        if len(batch) >= batch_size:
+            await db.users.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        await db.users.insert_many(batch, ordered=False)
+    return index
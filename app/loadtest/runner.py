@@ -0,0 +1,235 @@
+"""
+Replays a weighted mix of the real routes against the ASGI app in-process and reports
+throughput, latency percentiles and Mongo round trips per route.
+
+Usage:
+    python -m app.loadtest [--users 1000] [--concurrency 50] [--requests 5000]
+                           [--mix login=1,list=10,complete=4,reset=2,analytics=3]
+                           [--mongodb-url mongodb://localhost:27017 --database loadtest_db [--reset]]
+
+Without `--mongodb-url` the population is seeded into the in-memory stand-in.
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import math
+import random
+import time
+from collections import defaultdict
+
+import httpx
+
+from app.database import get_shard_router
+from app.loadtest.population import PASSWORD, PopulationConfig, is_loadtest_database, seed
+from app.utils.outbox import OutboxWorker
+from app.utils.sharding import ShardRouter
+
+DEFAULT_MIX = {"login": 1, "list": 10, "complete": 4, "reset": 2, "analytics": 3}
+
+# Methods that cost one round trip to Mongo; cursors are counted once when opened.
+ROUND_TRIP_METHODS = {
+    "find", "find_one", "aggregate", "insert_one", "insert_many", "update_one", "update_many",
+    "delete_one", "delete_many", "bulk_write", "count_documents", "find_one_and_update",
+    "distinct", "replace_one",
+}
+
+_round_trips = contextvars.ContextVar("round_trips", default=None)
+
+
+class _CountingCollection:
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if name not in ROUND_TRIP_METHODS:
+            return attribute
+
+        def call(*args, **kwargs):
+            counter = _round_trips.get()
+            if counter is not None:
+                counter[0] += 1
+            return attribute(*args, **kwargs)
+
+        return call
+
+
+class CountingDatabase:
+    """
+    Wraps a database and counts Mongo calls made on behalf of the current request.
+    """
+
+    def __init__(self, database):
+        self._database = database
+
+    def __getattr__(self, name):
+        return _CountingCollection(getattr(self._database, name))
+
+    def __getitem__(self, name):
+        return _CountingCollection(self._database[name])
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # Nearest rank: the smallest value with at least `fraction` of the values at or below it.
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def build_request(route: str, rng: random.Random, population: list):
+    user_id, username, todo_ids = rng.choice(population)
+    if route == "login":
+        return "POST", "/token", {"data": {"username": username, "password": PASSWORD}}
+    if route == "list":
+        return "GET", f"/users/{user_id}/todos", {}
+    if route == "complete":
+        if not todo_ids:
+            return "GET", f"/users/{user_id}/todos", {}
+        return "PATCH", f"/users/{user_id}/todos/{rng.choice(todo_ids)}/complete", {}
+    if route == "reset":
+        return "GET", f"/users/{user_id}/todos/check_reset", {}
+    if route == "analytics":
+        return "GET", f"/users/{user_id}/average-completion-time", {}
+    raise ValueError(f"Unknown route: {route}")
+
+
+async def run(app, population: list, mix: dict, concurrency: int, total_requests: int, seed_value: int = 1) -> dict:
+    """
+    Send `total_requests` requests drawn from `mix` using `concurrency` workers.
+
+    Returns:
+    - dict: Overall throughput and, per route, request and error counts, status codes,
+      latency percentiles in milliseconds and average Mongo round trips.
+    """
+    routes = list(mix)
+    weights = [mix[route] for route in routes]
+    results = defaultdict(lambda: {"latencies": [], "round_trips": 0, "statuses": defaultdict(int)})
+    remaining = [total_requests]
+
+    async def worker(client, rng):
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            route = rng.choices(routes, weights)[0]
+            method, url, kwargs = build_request(route, rng, population)
+            counter = [0]
+            token = _round_trips.set(counter)
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+                status = response.status_code
+            except Exception:
+                status = "exception"
+            finally:
+                _round_trips.reset(token)
+            result = results[route]
+            result["latencies"].append(time.perf_counter() - start)
+            result["round_trips"] += counter[0]
+            result["statuses"][status] += 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client, random.Random(seed_value + index)) for index in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    report = {"requests": total_requests, "elapsed_seconds": elapsed,
+              "throughput_rps": total_requests / elapsed if elapsed else 0.0, "routes": {}}
+    for route, result in sorted(results.items()):
+        latencies = sorted(result["latencies"])
+        count = len(latencies)
+        report["routes"][route] = {
+            "requests": count,
+            "errors": sum(n for status, n in result["statuses"].items() if status == "exception" or status >= 500),
+            "statuses": {str(status): n for status, n in result["statuses"].items()},
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p90_ms": percentile(latencies, 0.90) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "max_ms": latencies[-1] * 1000 if latencies else 0.0,
+            "mongo_round_trips_per_request": result["round_trips"] / count if count else 0.0,
+        }
+    return report
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        f"{report['requests']} requests in {report['elapsed_seconds']:.2f}s "
+        f"({report['throughput_rps']:.1f} req/s)",
+        f"{'route':<10} {'reqs':>6} {'errs':>5} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} {'mongo/req':>9}",
+    ]
+    for route, stats in report["routes"].items():
+        lines.append(
+            f"{route:<10} {stats['requests']:>6} {stats['errors']:>5} {stats['p50_ms']:>8.1f} {stats['p90_ms']:>8.1f} "
+            f"{stats['p99_ms']:>8.1f} {stats['max_ms']:>8.1f} {stats['mongo_round_trips_per_request']:>9.2f}"
+        )
+    return "\n".join(lines)
+
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for part in value.split(","):
+        route, _, weight = part.partition("=")
+        mix[route.strip()] = float(weight)
+    return mix
+
+
+async def main(args):
+    from app.main import app
+
+    if not args.reset and not is_loadtest_database(args.database):
+        raise SystemExit(f"Refusing to replace the users of {args.database!r}: the name does not "
+                         f"contain 'loadtest'; pass --reset to seed it anyway")
+
+    client = None
+    if args.mongodb_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        client = AsyncIOMotorClient(args.mongodb_url, tz_aware=True)
+        database = client[args.database]
+    else:
+        from app.loadtest.stand_in import StandInDatabase
+
+        database = StandInDatabase(args.database)
+
+    config = PopulationConfig(
+        users=args.users, todos_mean=args.todos_mean, completion_ratio=args.completion_ratio,
+        date_spread_days=args.date_spread_days, seed=args.seed,
+    )
+    population = await seed(database, config, reset=args.reset)
+
+    shard_router = ShardRouter({"loadtest": CountingDatabase(database)})
+
+    async def get_loadtest_router():
+        return shard_router
+
+    app.dependency_overrides[get_shard_router] = get_loadtest_router
+    outbox_worker = OutboxWorker(shard_router)
+    outbox_worker.start()
+    try:
+        report = await run(app, population, args.mix, args.concurrency, args.requests, args.seed)
+    finally:
+        await outbox_worker.stop()
+        app.dependency_overrides.pop(get_shard_router, None)
+        if client is not None:
+            client.close()
+
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the API against a synthetic population")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--todos-mean", type=float, default=20.0)
+    parser.add_argument("--completion-ratio", type=float, default=0.4)
+    parser.add_argument("--date-spread-days", type=int, default=60)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--mongodb-url", default=None, help="Seed and test a real Mongo instead of the stand-in")
+    parser.add_argument("--database", default="loadtest_db")
+    parser.add_argument("--reset", action="store_true",
+                        help="Replace the users of a database whose name does not contain 'loadtest'")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    return parser.parse_args(argv)
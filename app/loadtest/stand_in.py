@@ -0,0 +1,172 @@
+"""
+An in-memory stand-in for the Motor database, built on mongomock.
+
+It covers the subset of the Motor API the routers use: awaitable collection methods,
+cursors with `sort`/`skip`/`limit`/`to_list`/`async for`, positional (`field.$`)
+projections, array filters in `find_one_and_update` and `bulk_write`, which mongomock
+lacks or implements differently.
+It is meant for load-test dry runs and local development, not for measuring Mongo itself;
+test modules that need a database build their own instances rather than sharing fixtures.
+"""
+try:
+    import mongomock
+except ImportError:  # pragma: no cover - dev dependency
+    mongomock = None
+
+from pymongo import DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from pymongo.results import BulkWriteResult
+
+
+class StandInCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def sort(self, *args, **kwargs):
+        self._cursor = self._cursor.sort(*args, **kwargs)
+        return self
+
+    def skip(self, count):
+        self._cursor = self._cursor.skip(count)
+        return self
+
+    def limit(self, count):
+        self._cursor = self._cursor.limit(count)
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    async def to_list(self, length=None):
+        documents = list(self._cursor)
+        return documents[:length] if length else documents
+
+    def __aiter__(self):
+        self._iterator = iter(self._cursor)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class StandInCollection:
+    def __init__(self, collection):
+        self._collection = collection
+
+    def find(self, *args, **kwargs):
+        return StandInCursor(self._collection.find(*args, **kwargs))
+
+    def aggregate(self, pipeline, **kwargs):
+        return StandInCursor(iter(self._collection.aggregate(pipeline)))
+
+    async def find_one(self, filter=None, projection=None, **kwargs):
+        positional = [key[:-2] for key in (projection or {}) if key.endswith(".$")]
+        if not positional:
+            return self._collection.find_one(filter, projection, **kwargs)
+
+        # Only equality conditions on the array's subfields are emulated.
+        array = positional[0]
+        document = self._collection.find_one(filter)
+        if not document:
+            return None
+        prefix = array + "."
+        conditions = {key[len(prefix):]: value for key, value in filter.items() if key.startswith(prefix)}
+        element = next((item for item in document.get(array, [])
+                        if all(item.get(key) == value for key, value in conditions.items())), None)
+        return {"_id": document["_id"], array: [element]} if element is not None else None
+
+    def _update_with_array_filters(self, document_id, update, array_filters):
+        """
+        mongomock lacks array filters, so `$[name]` placeholders are expanded into the indices
+        of the matching elements. Only equality conditions are emulated.
+        """
+        document = self._collection.find_one({"_id": document_id})
+        filters = {}
+        for array_filter in array_filters:
+            for key, value in array_filter.items():
+                name, _, field = key.partition(".")
+                filters.setdefault(name, {})[field] = value
+
+        expanded = {}
+        for operator, fields in update.items():
+            expanded[operator] = {}
+            for path, value in fields.items():
+                paths = [path]
+                for name, conditions in filters.items():
+                    placeholder = f".$[{name}]"
+                    resolved = []
+                    for candidate in paths:
+                        if placeholder not in candidate:
+                            resolved.append(candidate)
+                            continue
+                        array = candidate.split(placeholder)[0]
+                        elements = document.get(array, [])
+                        resolved.extend(candidate.replace(placeholder, f".{index}")
+                                        for index, element in enumerate(elements)
+                                        if all(element.get(k) == v for k, v in conditions.items()))
+                    paths = resolved
+                for resolved_path in paths:
+                    expanded[operator][resolved_path] = value
+        self._collection.update_one({"_id": document_id}, expanded)
+
+    async def find_one_and_update(self, filter, update, projection=None, array_filters=None,
+                                  return_document=False, **kwargs):
+        if not array_filters:
+            return self._collection.find_one_and_update(filter, update, projection,
+                                                        return_document=return_document, **kwargs)
+        document = self._collection.find_one(filter, {"_id": 1})
+        if document is None:
+            return None
+        before = self._collection.find_one({"_id": document["_id"]}, projection)
+        self._update_with_array_filters(document["_id"], update, array_filters)
+        return self._collection.find_one({"_id": document["_id"]}, projection) if return_document else before
+
+    async def bulk_write(self, requests, ordered=True, **kwargs):
+        counts = {"nInserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "nUpserted": 0, "upserted": []}
+        for request in requests:
+            if isinstance(request, InsertOne):
+                self._collection.insert_one(request._doc)
+                counts["nInserted"] += 1
+            elif isinstance(request, DeleteOne):
+                counts["nRemoved"] += self._collection.delete_one(request._filter).deleted_count
+            elif isinstance(request, ReplaceOne):
+                result = self._collection.replace_one(request._filter, request._doc, upsert=request._upsert)
+                counts["nMatched"] += result.matched_count
+                counts["nModified"] += result.modified_count
+                if result.upserted_id is not None:
+                    counts["nUpserted"] += 1
+            elif isinstance(request, (UpdateOne, UpdateMany)):
+                update = self._collection.update_many if isinstance(request, UpdateMany) else self._collection.update_one
+                result = update(request._filter, request._doc, upsert=request._upsert,
+                                array_filters=request._array_filters)
+                counts["nMatched"] += result.matched_count
+                counts["nModified"] += result.modified_count
+                if result.upserted_id is not None:
+                    counts["nUpserted"] += 1
+            else:
+                raise NotImplementedError(f"{type(request).__name__} is not supported by the stand-in")
+        return BulkWriteResult(counts, True)
+
+    def __getattr__(self, name):
+        method = getattr(self._collection, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+
+        return call
+
+
+class StandInDatabase:
+    def __init__(self, name: str = "todo_list_db"):
+        if mongomock is None:
+            raise RuntimeError("The in-memory stand-in requires mongomock (a dev dependency)")
+        self.name = name
+        self._database = mongomock.MongoClient(tz_aware=True)[name]
+
+    def __getattr__(self, name):
+        return StandInCollection(self._database[name])
+
+    def __getitem__(self, name):
+        return StandInCollection(self._database[name])
@@ -1,8 +1,13 @@
 from fastapi import FastAPI
 from .api import todos
 from .api import users
-from app.database import connect_to_mongo, close_mongo_connection
+from app.database import connect_to_mongo, close_mongo_connection, get_router
+from app.utils.leaderboard import ensure_indexes as ensure_leaderboard_indexes
+from app.utils.outbox import start_worker, stop_worker
 from .api import analytics
+from .api import metrics
+from .api import transfer
+from .api import leaderboard
 from fastapi.middleware.cors import CORSMiddleware
 
 app = FastAPI()
@@ -12,10 +17,14 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Total-Count"],
 )
 app.include_router(todos.router)
 app.include_router(users.router)
 app.include_router(analytics.router)
+app.include_router(metrics.router)
+app.include_router(transfer.router)
+app.include_router(leaderboard.router)
 
 @app.get("/")
 def read_root():
@@ -24,7 +33,10 @@ def read_root():
 @app.on_event("startup")
 async def startup_event():
     await connect_to_mongo()
+    await ensure_leaderboard_indexes(get_router())
+    start_worker(get_router())
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    await stop_worker()
     await close_mongo_connection()
@@ -0,0 +1,149 @@
+"""
+Converts users' embedded todos to the compact storage layout (schema_version 2) in the
+background, and reports how much document size and decode time it saves.
+
+Users are processed in `_id` order in batches and the last processed `_id` is recorded in
+the `migrations` collection, so an interrupted run resumes where it stopped. With
+`--dry-run` nothing is written and only the measurements are reported.
+
+Usage:
+    python -m app.migrations.compact_todos [--batch-size 500] [--restart] [--dry-run]
+"""
+import argparse
+import asyncio
+import logging
+import time
+
+import bson
+from pymongo import UpdateOne
+
+from app.schemas.todo import TodoDisplay
+from app.schemas.todo_storage import SCHEMA_VERSION, decode_todos, encode_todo
+
+MIGRATION_ID = "compact_todos"
+
+
+def _parse(todos: list) -> list:
+    return [TodoDisplay(**todo) for todo in decode_todos(todos)]
+
+
+def measure_todos(todos: list, encoded: list) -> dict:
+    """
+    Compare the BSON size and decode time of a todo array in both layouts. Decoding is timed
+    the way the API reads todos: converted to the API shape and validated as `TodoDisplay`.
+
+    Parameters:
+    - todos (list): The todos in the legacy layout.
+    - encoded (list): The same todos in the compact layout.
+
+    Returns:
+    - dict: Sizes in bytes and decode times in seconds for each layout.
+    """
+    legacy_bytes = len(bson.encode({"todos": todos}))
+    compact_bytes = len(bson.encode({"todos": encoded}))
+
+    start = time.perf_counter()
+    _parse(todos)
+    legacy_decode = time.perf_counter() - start
+    start = time.perf_counter()
+    _parse(encoded)
+    compact_decode = time.perf_counter() - start
+
+    return {
+        "legacy_bytes": legacy_bytes,
+        "compact_bytes": compact_bytes,
+        "legacy_decode_seconds": legacy_decode,
+        "compact_decode_seconds": compact_decode,
+    }
+
+
+async def migrate(db, batch_size: int = 500, restart: bool = False, dry_run: bool = False) -> dict:
+    """
+    Runs the conversion in batches of `batch_size` users.
+
+    Parameters:
+    - db: The Motor database.
+    - batch_size (int): Number of users read and written per round trip.
+    - restart (bool): Ignore the saved checkpoint and start from the first user.
+    - dry_run (bool): Only measure, do not write.
+
+    Returns:
+    - dict: Counts of scanned, converted and skipped users, and the summed measurements.
+    """
+    checkpoint = None if restart or dry_run else await db.migrations.find_one({"_id": MIGRATION_ID})
+    last_id = checkpoint.get("last_id") if checkpoint else None
+    report = {"scanned": 0, "converted": 0, "skipped": 0, "legacy_bytes": 0, "compact_bytes": 0,
+              "legacy_decode_seconds": 0.0, "compact_decode_seconds": 0.0}
+
+    while True:
+        query = {"schema_version": {"$ne": SCHEMA_VERSION}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        users = await db.users.find(query, {"id": 1, "todos": 1}).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not users:
+            break
+
+        operations = []
+        for user in users:
+            todos = user.get("todos") or []
+            try:
+                encoded = [encode_todo(todo) for todo in decode_todos(todos)]
+                # Measuring validates the todos as the API reads them, which also rejects e.g. bad ids.
+                measured = measure_todos(todos, encoded)
+            except ValueError as e:
+                logging.info(f"{MIGRATION_ID}: skipping user {user.get('id')}: {e}")
+                report["skipped"] += 1
+                continue
+
+            for key, value in measured.items():
+                report[key] += value
+            operations.append(UpdateOne(
+                {"_id": user["_id"], "schema_version": {"$ne": SCHEMA_VERSION}, "todos": user.get("todos")},
+                {"$set": {"todos": encoded, "schema_version": SCHEMA_VERSION}, "$inc": {"version": 1}},
+            ))
+
+        if operations and not dry_run:
+            result = await db.users.bulk_write(operations, ordered=False)
+            report["converted"] += result.modified_count
+
+        report["scanned"] += len(users)
+        last_id = users[-1]["_id"]
+        if not dry_run:
+            await db.migrations.update_one(
+                {"_id": MIGRATION_ID},
+                {"$set": {"last_id": last_id, "scanned": report["scanned"]}},
+                upsert=True,
+            )
+        logging.info(f"{MIGRATION_ID}: {report}")
+
+    if not dry_run:
+        await db.migrations.update_one({"_id": MIGRATION_ID}, {"$set": {"completed": True}}, upsert=True)
+    return report
+
+
+async def main(batch_size: int, restart: bool, dry_run: bool):
+    from app import database
+
+    await database.connect_to_mongo()
+    try:
+        report = {}
+        for db in database.get_router().databases():
+            shard_report = await migrate(db, batch_size=batch_size, restart=restart, dry_run=dry_run)
+            for key, value in shard_report.items():
+                report[key] = report.get(key, 0) + value
+        if report["legacy_bytes"]:
+            saved = 1 - report["compact_bytes"] / report["legacy_bytes"]
+            logging.info(f"{MIGRATION_ID}: todo arrays {saved:.0%} smaller")
+        logging.info(f"{MIGRATION_ID}: done {report}")
+    finally:
+        await database.close_mongo_connection()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--restart", action="store_true")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size, args.restart, args.dry_run))
@@ -0,0 +1,71 @@
+"""
+Rebuilds the leaderboard histogram, the number of users per `completed_todos` value that
+global ranks are computed from, by counting the users on every shard.
+
+Run it once before serving ranks from a database that already has users, and again to repair
+the histogram if it drifted, e.g. after users were written by hand. The outbox worker updates
+the histogram as it goes, so run it while no worker is running (`OUTBOX_WORKER=off`) or
+changes made during the run may be counted twice or not at all.
+
+Usage:
+    python -m app.migrations.leaderboard_counts [--dry-run]
+"""
+import argparse
+import asyncio
+import logging
+from collections import Counter
+
+from pymongo import ReplaceOne
+
+from app.utils.leaderboard import score_counts
+from app.utils.sharding import ShardRouter
+
+MIGRATION_ID = "leaderboard_counts"
+
+
+async def rebuild(shard_router: ShardRouter, dry_run: bool = False) -> dict:
+    """
+    Replaces the histogram with counts of the users on every shard.
+
+    Parameters:
+    - shard_router (ShardRouter): The shards to count; the histogram lives on the first one.
+    - dry_run (bool): Only count, do not write.
+
+    Returns:
+    - dict: The number of counted users and of distinct `completed_todos` values.
+    """
+    counts = Counter()
+    pipeline = [
+        {"$match": {"completed_todos": {"$gt": 0}}},
+        {"$group": {"_id": "$completed_todos", "count": {"$sum": 1}}},
+    ]
+    for db in shard_router.databases():
+        async for group in db.users.aggregate(pipeline):
+            counts[group["_id"]] += group["count"]
+
+    if not dry_run:
+        collection = score_counts(shard_router)
+        if counts:
+            await collection.bulk_write([ReplaceOne({"_id": score}, {"count": count}, upsert=True)
+                                         for score, count in counts.items()], ordered=False)
+        await collection.delete_many({"_id": {"$nin": list(counts)}})
+    return {"users": sum(counts.values()), "scores": len(counts)}
+
+
+async def main(dry_run: bool):
+    from app import database
+
+    await database.connect_to_mongo()
+    try:
+        report = await rebuild(database.get_router(), dry_run=dry_run)
+        logging.info(f"{MIGRATION_ID}: done {report}")
+    finally:
+        await database.close_mongo_connection()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(main(args.dry_run))
@@ -0,0 +1,126 @@
+"""
+Converts every stored todo date field to a timezone-aware BSON datetime and every
+`days_active` entry to a canonical weekday name, in week order like the write path.
+
+The migration walks users in `_id` order in batches and records the last processed `_id`
+in the `migrations` collection, so an interrupted run resumes where it stopped.
+
+Usage:
+    python -m app.migrations.normalize_dates [--batch-size 500] [--restart]
+"""
+import argparse
+import asyncio
+import logging
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+from app.utils.dates import WEEKDAYS, as_utc_datetime, normalize_weekday
+
+MIGRATION_ID = "normalize_dates"
+DATE_FIELDS = ("created_date", "completed_date")
+
+
+def normalize_todo(todo: dict) -> dict:
+    """
+    Returns a copy of `todo` with canonical date and days_active values. Weekdays are
+    deduplicated and sorted in week order, as `normalize_days_active` does on writes.
+
+    Values that cannot be interpreted are left as they are so no data is lost; they keep
+    taking the slow fallback path in analytics until fixed by hand, after the weekdays.
+    """
+    todo = dict(todo)
+    for field in DATE_FIELDS:
+        value = todo.get(field)
+        if value is not None and not isinstance(value, datetime):
+            parsed = as_utc_datetime(value)
+            if parsed is not None:
+                todo[field] = parsed
+
+    days = []
+    for day in todo.get('days_active') or []:
+        try:
+            day = normalize_weekday(day)
+        except ValueError:
+            pass
+        if day not in days:
+            days.append(day)
+    days.sort(key=lambda day: WEEKDAYS.index(day) if day in WEEKDAYS else len(WEEKDAYS))
+    if 'days_active' in todo:
+        todo['days_active'] = days
+    return todo
+
+
+async def migrate(db, batch_size: int = 500, restart: bool = False) -> dict:
+    """
+    Runs the migration in batches of `batch_size` users.
+
+    Parameters:
+    - db: The Motor database.
+    - batch_size (int): Number of users read and written per round trip.
+    - restart (bool): Ignore the saved checkpoint and start from the first user.
+
+    Returns:
+    - dict: Counts of scanned and modified users.
+    """
+    checkpoint = None if restart else await db.migrations.find_one({"_id": MIGRATION_ID})
+    last_id = checkpoint.get("last_id") if checkpoint else None
+    scanned = modified = 0
+
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        users = await db.users.find(query, {"todos": 1}).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not users:
+            break
+
+        operations = []
+        for user in users:
+            todos = user.get('todos') or []
+            normalized = [normalize_todo(todo) for todo in todos]
+            if normalized != todos:
+                # Matching on the original array skips users whose todos changed since they
+                # were read; the write path already stores canonical values for those.
+                operations.append(UpdateOne(
+                    {"_id": user["_id"], "todos": todos},
+                    {"$set": {"todos": normalized}, "$inc": {"version": 1}},
+                ))
+
+        if operations:
+            result = await db.users.bulk_write(operations, ordered=False)
+            modified += result.modified_count
+
+        scanned += len(users)
+        last_id = users[-1]["_id"]
+        await db.migrations.update_one(
+            {"_id": MIGRATION_ID},
+            {"$set": {"last_id": last_id, "scanned": scanned}},
+            upsert=True,
+        )
+        logging.info(f"{MIGRATION_ID}: scanned {scanned} users, modified {modified}")
+
+    await db.migrations.update_one({"_id": MIGRATION_ID}, {"$set": {"completed": True}}, upsert=True)
+    return {"scanned": scanned, "modified": modified}
+
+
+async def main(batch_size: int, restart: bool):
+    from app import database
+
+    await database.connect_to_mongo()
+    try:
+        result = {"scanned": 0, "modified": 0}
+        for db in database.get_router().databases():
+            shard_result = await migrate(db, batch_size=batch_size, restart=restart)
+            for key, value in shard_result.items():
+                result[key] += value
+        logging.info(f"{MIGRATION_ID}: done {result}")
+    finally:
+        await database.close_mongo_connection()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--restart", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size, args.restart))
@@ -0,0 +1,171 @@
+"""
+Moves users onto the shard the hash ring assigns them after shards are added, and backfills
+the username/email directory the router uses for logins and uniqueness checks.
+
+Run it with MONGODB_SHARDS set to the new shard list and MONGODB_SHARDS_PREVIOUS to the old
+one, in the application as well, so requests for a user that has not been moved yet still
+find them on their old shard. Each batch is copied to its target shard first and then
+deleted from the source guarded by the user's `version`; a user written to in between is
+copied again, and one that was also written on the target is reported as a conflict and
+left on both shards. Once the run reports no conflicts, MONGODB_SHARDS_PREVIOUS can be
+removed. Running it again only touches users that are still misplaced.
+
+Usage:
+    python -m app.migrations.rebalance_shards [--batch-size 500] [--dry-run]
+"""
+import argparse
+import asyncio
+import logging
+
+from pymongo import DeleteOne, ReplaceOne
+from pymongo.errors import BulkWriteError
+
+from app.utils.sharding import ShardRouter
+
+MIGRATION_ID = "rebalance_shards"
+MAX_ATTEMPTS = 3
+
+
+def _version_guard(user: dict) -> dict:
+    version = user.get("version") or 0
+    return {"_id": user["_id"], "version": version if version else {"$in": [0, None]}}
+
+
+async def backfill_directory(shard_router: ShardRouter, batch_size: int = 500, dry_run: bool = False) -> dict:
+    """
+    Adds missing directory entries for every user's username and email.
+
+    Parameters:
+    - shard_router (ShardRouter): The router whose shards and directory are used.
+    - batch_size (int): Number of users read and entries written per round trip.
+    - dry_run (bool): Only count, do not write.
+
+    Returns:
+    - dict: Counts of added entries and of values already held by another user.
+    """
+    report = {"directory_added": 0, "directory_conflicts": 0}
+    if not shard_router.sharded:
+        return report
+
+    for db in shard_router.databases():
+        last_id = None
+        while True:
+            query = {} if last_id is None else {"_id": {"$gt": last_id}}
+            users = await db.users.find(query, {"id": 1, "username": 1, "email": 1}) \
+                .sort("_id", 1).limit(batch_size).to_list(batch_size)
+            if not users:
+                break
+            last_id = users[-1]["_id"]
+
+            entries = {f"{field}:{user[field]}": str(user["id"])
+                       for user in users for field in ("username", "email") if user.get(field)}
+            existing = await shard_router.directory.find({"_id": {"$in": list(entries)}}).to_list(None)
+            for entry in existing:
+                if entry["user_id"] != entries.pop(entry["_id"]):
+                    report["directory_conflicts"] += 1
+                    logging.warning(f"{MIGRATION_ID}: {entry['_id']} is held by user {entry['user_id']}")
+            if not entries or dry_run:
+                report["directory_added"] += len(entries)
+                continue
+
+            try:
+                await shard_router.directory.insert_many(
+                    [{"_id": key, "user_id": user_id} for key, user_id in entries.items()], ordered=False)
+                report["directory_added"] += len(entries)
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                report["directory_added"] += len(entries) - len(errors)
+                report["directory_conflicts"] += len(errors)
+    return report
+
+
+async def _settle(source, target, user_id: str, copied: dict) -> str:
+    """
+    Finishes moving a user whose guarded delete did not match.
+
+    Returns:
+    - str: "moved" if the user is now only on the target, otherwise "conflict".
+    """
+    for _ in range(MAX_ATTEMPTS):
+        current = await source.users.find_one({"id": user_id})
+        if current is None:
+            return "moved"
+        on_target = await target.users.find_one({"id": user_id}, {"version": 1})
+        if on_target and (on_target.get("version") or 0) != (copied.get("version") or 0):
+            break
+        await target.users.replace_one({"id": user_id}, current, upsert=True)
+        result = await source.users.delete_one(_version_guard(current))
+        if result.deleted_count:
+            return "moved"
+        copied = current
+    logging.warning(f"{MIGRATION_ID}: user {user_id} was written on both shards during the move")
+    return "conflict"
+
+
+async def rebalance(shard_router: ShardRouter, batch_size: int = 500, dry_run: bool = False) -> dict:
+    """
+    Moves every user that is not on the shard the ring assigns them.
+
+    Parameters:
+    - shard_router (ShardRouter): The router for the new shard list.
+    - batch_size (int): Number of users read, copied and deleted per round trip.
+    - dry_run (bool): Only count the users that would move.
+
+    Returns:
+    - dict: Counts of scanned, moved and conflicting users, and the directory backfill counts.
+    """
+    report = {"scanned": 0, "moved": 0, "conflicts": 0}
+    report.update(await backfill_directory(shard_router, batch_size, dry_run))
+
+    for name, source in shard_router.shards.items():
+        last_id = None
+        while True:
+            query = {} if last_id is None else {"_id": {"$gt": last_id}}
+            users = await source.users.find(query).sort("_id", 1).limit(batch_size).to_list(batch_size)
+            if not users:
+                break
+            last_id = users[-1]["_id"]
+            report["scanned"] += len(users)
+
+            moving = {}
+            for user in users:
+                target = shard_router.shard_name(str(user["id"]))
+                if target != name:
+                    moving.setdefault(target, []).append(user)
+            if dry_run:
+                report["moved"] += sum(len(batch) for batch in moving.values())
+                continue
+
+            for target_name, batch in moving.items():
+                target = shard_router.shards[target_name]
+                await target.users.bulk_write(
+                    [ReplaceOne({"id": user["id"]}, user, upsert=True) for user in batch], ordered=False)
+                await source.users.bulk_write([DeleteOne(_version_guard(user)) for user in batch], ordered=False)
+
+                remaining = {doc["id"] for doc in await source.users.find(
+                    {"id": {"$in": [user["id"] for user in batch]}}, {"id": 1}).to_list(None)}
+                for user in batch:
+                    outcome = await _settle(source, target, user["id"], user) if user["id"] in remaining else "moved"
+                    report["moved" if outcome == "moved" else "conflicts"] += 1
+            logging.info(f"{MIGRATION_ID}: {report}")
+    return report
+
+
+async def main(batch_size: int, dry_run: bool):
+    from app import database
+
+    await database.connect_to_mongo()
+    try:
+        report = await rebalance(database.get_router(), batch_size=batch_size, dry_run=dry_run)
+        logging.info(f"{MIGRATION_ID}: done {report}")
+    finally:
+        await database.close_mongo_connection()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size, args.dry_run))
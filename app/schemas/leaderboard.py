@@ -0,0 +1,18 @@
+from pydantic import BaseModel
+from typing import List, Literal, Optional
+from .user import TreeDisplay
+
+
+class LeaderboardEntry(BaseModel):
+    rank: int
+    id: str
+    username: str
+    name: str
+    completed_todos: int
+    trees: List[TreeDisplay]
+
+
+class LeaderboardResponse(BaseModel):
+    scope: Literal["global", "friends"]
+    entries: List[LeaderboardEntry]
+    user: Optional[LeaderboardEntry] = None
@@ -8,6 +8,8 @@ from typing import Any
 
 from pydantic_core import core_schema
 
+from app.utils.dates import to_utc, normalize_days_active
+
 class PyObjectId(str):
     @classmethod
     def __get_pydantic_core_schema__(
@@ -55,6 +57,14 @@ class TodoCreate(BaseModel):
     completed: Optional[bool] = False
     completed_date: Optional[datetime] = None
 
+    @validator('days_active', pre=True)
+    def validate_days_active(cls, v):
+        return normalize_days_active(v)
+
+    @validator('completed_date')
+    def validate_completed_date(cls, v):
+        return to_utc(v) if v is not None else v
+
     
 class TodoUpdate(BaseModel):
     title: Optional[str]
@@ -63,6 +73,14 @@ class TodoUpdate(BaseModel):
     completed: Optional[bool] = False  
     completed_date: Optional[datetime] = None  
 
+    @validator('days_active', pre=True)
+    def validate_days_active(cls, v):
+        return normalize_days_active(v) if v is not None else v
+
+    @validator('completed_date')
+    def validate_completed_date(cls, v):
+        return to_utc(v) if v is not None else v
+
 
 class TodoDisplay(BaseModel):
     id: PyObjectId
@@ -73,6 +91,18 @@ class TodoDisplay(BaseModel):
     completed: Optional[bool] = False
     completed_date: Optional[datetime] = None
 
+    @validator('created_date', 'completed_date')
+    def validate_dates(cls, v):
+        return to_utc(v) if v is not None else v
+
+
+class TodoInput(TodoDisplay):
+    """A complete todo sent by a client or an import, with days_active in canonical form."""
+
+    @validator('days_active', pre=True)
+    def validate_days_active(cls, v):
+        return normalize_days_active(v)
+
 
 
 class TodoBase(BaseModel):
@@ -0,0 +1,199 @@
+"""
+On-disk encoding of embedded todos.
+
+Two layouts can be stored in `user['todos']`:
+
+- version 1 (legacy): the `TodoDisplay` field names, a hex string `id` and `days_active`
+  as a list of weekday names.
+- version 2 (compact): single letter keys, a binary ObjectId `_i`, `days_active` as a
+  7-bit mask (Monday = bit 0) and default values omitted.
+
+The user document's `schema_version` says which layout its todos use. `decode_todo`
+accepts either, so everything built from a decoded todo (including `TodoDisplay`)
+is unaffected by the layout.
+"""
+import os
+
+from bson import ObjectId
+
+from app.utils.dates import WEEKDAYS, as_utc_datetime, normalize_weekday
+
+LEGACY_SCHEMA_VERSION = 1
+SCHEMA_VERSION = 2
+
+# Opt-in: new users and users touched by a todo write are stored compactly.
+COMPACT_ENABLED = os.getenv("TODO_STORAGE_COMPACT", "0").lower() in ("1", "true", "yes")
+
+COMPACT_KEYS = {
+    "id": "_i",
+    "title": "t",
+    "description": "d",
+    "days_active": "m",
+    "created_date": "c",
+    "completed": "x",
+    "completed_date": "f",
+}
+FIELD_NAMES = {key: field for field, key in COMPACT_KEYS.items()}
+
+
+def encode_days(days) -> int:
+    """
+    Pack weekday names into a 7-bit mask.
+
+    Raises:
+    - ValueError: If a value is not a weekday.
+    """
+    mask = 0
+    for day in days or []:
+        mask |= 1 << WEEKDAYS.index(normalize_weekday(day))
+    return mask
+
+
+def decode_days(mask: int) -> list:
+    return [day for bit, day in enumerate(WEEKDAYS) if mask & (1 << bit)]
+
+
+def encode_id(todo_id):
+    if isinstance(todo_id, ObjectId):
+        return todo_id
+    if ObjectId.is_valid(todo_id):
+        return ObjectId(todo_id)
+    return todo_id
+
+
+def encode_value(field: str, value):
+    """
+    Encode a single todo field value for the compact layout.
+    """
+    if field == "id":
+        return encode_id(value)
+    if field == "days_active":
+        return encode_days(value)
+    if field in ("created_date", "completed_date") and value is not None:
+        return as_utc_datetime(value)
+    return value
+
+
+def encode_todo(todo: dict) -> dict:
+    """
+    Encode a todo dict (legacy field names) into the compact layout.
+
+    Raises:
+    - ValueError: If `days_active` holds a value that is not a weekday.
+    """
+    doc = {}
+    for field, key in COMPACT_KEYS.items():
+        value = todo.get(field)
+        if value is None or (field == "completed" and not value):
+            continue
+        value = encode_value(field, value)
+        if field == "days_active" and not value:
+            continue
+        doc[key] = value
+    return doc
+
+
+def is_compact_todo(doc: dict) -> bool:
+    return "_i" in doc
+
+
+def decode_todo(doc: dict) -> dict:
+    """
+    Return a todo with the legacy field names, whichever layout `doc` is stored in.
+    """
+    if "_i" not in doc:
+        return doc
+    get = doc.get
+    return {
+        "id": str(doc["_i"]),
+        "title": get("t"),
+        "description": get("d"),
+        "days_active": decode_days(get("m", 0)),
+        "created_date": get("c"),
+        "completed": get("x", False),
+        "completed_date": get("f"),
+    }
+
+
+def decode_todos(todos) -> list:
+    return [decode_todo(todo) for todo in todos or []]
+
+
+def decode_user(user: dict) -> dict:
+    """
+    Replace the stored todos of a user document with decoded ones, in place.
+    """
+    if user and user.get("todos"):
+        user["todos"] = decode_todos(user["todos"])
+    return user
+
+
+def todo_elem_match(todo_id: str) -> dict:
+    """
+    An `$elemMatch` projection that selects one todo regardless of its layout.
+    """
+    conditions = [{"id": todo_id}]
+    if ObjectId.is_valid(todo_id):
+        conditions.append({"_i": ObjectId(todo_id)})
+    return {"todos": {"$elemMatch": {"$or": conditions}}}
+
+
+def todo_field_expr(field: str, var: str = "$$todo") -> dict:
+    """
+    An aggregation expression reading a todo field from an array element in either layout.
+    """
+    default = False if field == "completed" else None
+    return {"$ifNull": [f"{var}.{field}", {"$ifNull": [f"{var}.{COMPACT_KEYS[field]}", default]}]}
+
+
+def todo_day_expr(day: str, var: str = "$$todo") -> dict:
+    """
+    An aggregation expression that is true when a todo is active on `day`, in either layout.
+    """
+    bit = 1 << WEEKDAYS.index(day)
+    mask = {"$ifNull": [f"{var}.{COMPACT_KEYS['days_active']}", 0]}
+    return {"$or": [
+        {"$in": [day, {"$ifNull": [f"{var}.days_active", []]}]},
+        {"$eq": [{"$mod": [{"$trunc": {"$divide": [mask, bit]}}, 2]}, 1]},
+    ]}
+
+
+class TodoStorage:
+    """
+    Key paths and encoders for one todo layout, used to build Mongo queries and updates.
+    """
+
+    def __init__(self, compact: bool):
+        self.compact = compact
+        self.schema_version = SCHEMA_VERSION if compact else LEGACY_SCHEMA_VERSION
+
+    def key(self, field: str) -> str:
+        return COMPACT_KEYS[field] if self.compact else field
+
+    def path(self, field: str, position: str = "$") -> str:
+        return f"todos.{position}.{self.key(field)}"
+
+    def value(self, field: str, value):
+        return encode_value(field, value) if self.compact else value
+
+    def element(self, todo_id) -> dict:
+        """A condition matching one array element, e.g. for `$pull`."""
+        return {self.key("id"): self.value("id", todo_id)}
+
+    def match(self, todo_id) -> dict:
+        """A query condition matching users holding the todo."""
+        return {f"todos.{self.key('id')}": self.value("id", todo_id)}
+
+    def set_fields(self, fields: dict, position: str = "$") -> dict:
+        return {self.path(field, position): self.value(field, value) for field, value in fields.items()}
+
+    def encode(self, todo: dict) -> dict:
+        return encode_todo(todo) if self.compact else todo
+
+
+LEGACY = TodoStorage(False)
+COMPACT = TodoStorage(True)
+
+
+def storage_for(user: dict) -> TodoStorage:
+    return COMPACT if user.get("schema_version") == SCHEMA_VERSION else LEGACY
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr, Field
-from typing import List, Optional
-from .todo import TodoDisplay
+from typing import List, Literal, Optional
+from .todo import TodoDisplay, TodoInput
 from bson import ObjectId
 
 from typing import Any
@@ -50,7 +50,7 @@ class UserUpdate(BaseModel):
     username: Optional[str] = Field(default=None)
     email: Optional[EmailStr] = Field(default=None)
     name: Optional[str] = Field(default=None)
-    todos: Optional[List[TodoDisplay]] = Field(default=None)
+    todos: Optional[List[TodoInput]] = Field(default=None)
     trees: Optional[List[TreeDisplay]] = Field(default=None)
 
 class UserResponse(BaseModel):
@@ -75,6 +75,8 @@ class UserDisplay(BaseModel):
     todos: List[TodoDisplay]
     completed_todos: int
     trees: List[TreeDisplay]
+    friends: List[str] = []
+    version: int = 0
 
 class UserModel(BaseModel):
     id: PyObjectId
@@ -86,6 +88,9 @@ class UserModel(BaseModel):
     completed_todos: int = 0
     trees: List[TreeDisplay] = Field(default_factory=lambda: [TreeDisplay(name="Uncaria", stage=1)])
     average_completion_time: Optional[float] = None
+    friends: List[str] = []
+    schema_version: int = 1
+    version: int = 0
     class Config:
         json_encoders = {
             ObjectId: lambda oid: str(oid),
@@ -96,3 +101,9 @@ class UserModel(BaseModel):
 class UserAuthenticate(BaseModel):
     username: str
     password: str
+
+
+class PatchOperation(BaseModel):
+    op: Literal["add", "remove", "replace", "test"]
+    path: str
+    value: Any = None
@@ -0,0 +1,149 @@
+import asyncio
+import math
+import os
+import time
+from typing import Dict
+
+from fastapi import HTTPException
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, default))
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, default))
+
+
+class AdmissionLimiter:
+    """
+    Bounds the number of requests of one route class that run concurrently.
+
+    Requests beyond `max_concurrency` wait on a semaphore for at most `queue_timeout`
+    seconds, and no more than `max_queue` of them may wait at once. Once either budget
+    is exhausted the request is shed with a 503 and a Retry-After header instead of
+    queueing behind work it cannot overtake.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _reject(self):
+        retry_after = max(1, math.ceil(self.queue_timeout))
+        raise HTTPException(
+            status_code=503,
+            detail=f"Server busy ({self.name}), retry later",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+    async def acquire(self):
+        """
+        Waits for a slot within the queue budget.
+
+        Raises:
+        - HTTPException: 503 if the wait queue is full or the queue-time budget runs out.
+        """
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            self.rejected_queue_full += 1
+            self._reject()
+
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+            self.admitted += 1
+            self.in_flight += 1
+            return
+
+        start = time.perf_counter()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected_timeout += 1
+            self._reject()
+        finally:
+            self.waiting -= 1
+
+        waited = time.perf_counter() - start
+        self.total_wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        self.admitted += 1
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "queue_timeout": self.queue_timeout,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "avg_wait_seconds": self.total_wait_seconds / self.admitted if self.admitted else 0.0,
+            "max_wait_seconds": self.max_wait_seconds,
+        }
+
+
+# Route classes. "expensive" covers the bcrypt-bound routes (/token and POST /users/),
+# "default" everything else that opts in. Each is tunable through ADMISSION_<CLASS>_* env vars.
+ROUTE_CLASS_DEFAULTS = {
+    "expensive": {"max_concurrency": 4, "max_queue": 16, "queue_timeout": 2.0},
+    "default": {"max_concurrency": 256, "max_queue": 1024, "queue_timeout": 5.0},
+}
+
+limiters: Dict[str, AdmissionLimiter] = {}
+
+
+def get_limiter(route_class: str) -> AdmissionLimiter:
+    """
+    Returns the limiter for a route class, creating it from the environment on first use.
+    """
+    limiter = limiters.get(route_class)
+    if limiter is None:
+        defaults = ROUTE_CLASS_DEFAULTS.get(route_class, ROUTE_CLASS_DEFAULTS["default"])
+        prefix = f"ADMISSION_{route_class.upper()}_"
+        limiter = AdmissionLimiter(
+            route_class,
+            max_concurrency=_env_int(prefix + "CONCURRENCY", defaults["max_concurrency"]),
+            max_queue=_env_int(prefix + "MAX_QUEUE", defaults["max_queue"]),
+            queue_timeout=_env_float(prefix + "QUEUE_TIMEOUT", defaults["queue_timeout"]),
+        )
+        limiters[route_class] = limiter
+    return limiter
+
+
+def admission(route_class: str):
+    """
+    Builds a FastAPI dependency that holds a slot of `route_class` for the duration of the request.
+
+    Usage:
+        @router.post("/token", dependencies=[Depends(admission("expensive"))])
+    """
+    async def _admit():
+        limiter = get_limiter(route_class)
+        await limiter.acquire()
+        try:
+            yield
+        finally:
+            limiter.release()
+
+    return _admit
+
+
+def admission_stats() -> dict:
+    return {name: limiter.stats() for name, limiter in limiters.items()}
@@ -1,21 +1,7 @@
-from datetime import datetime
 from typing import List
 
+from app.utils.dates import as_utc_datetime
 
-def parse_datetime(date_str: str) -> datetime:
-    """
-    Convert a datetime string in ISO format to a datetime object.
-
-    Parameters:
-    - date_str (str): The datetime string in ISO 8601 format ('YYYY-MM-DDTHH:MM:SS').
-
-    Returns:
-    - datetime: The corresponding datetime object, or None if the string cannot be parsed.
-    """
-    try:
-        return datetime.strptime(date_str, '%Y-%m-%dT%H:%M:%S')  
-    except ValueError:
-        return None
 
 def calculate_avg_completion_time(todos: List[dict]) -> int:
     """
@@ -34,13 +20,8 @@ def calculate_avg_completion_time(todos: List[dict]) -> int:
     
     for todo in todos:
         if todo.get('completed') and todo.get('completed_date') and todo.get('created_date'):
-            created_date = todo['created_date']
-            completed_date = todo['completed_date']
-
-            if isinstance(created_date, str):
-                created_date = parse_datetime(created_date)
-            if isinstance(completed_date, str):
-                completed_date = parse_datetime(completed_date)
+            created_date = as_utc_datetime(todo['created_date'])
+            completed_date = as_utc_datetime(todo['completed_date'])
 
             if created_date and completed_date:
                 completion_time = completed_date - created_date
@@ -65,13 +46,8 @@ def calculate_completion_time(todo: dict) -> int:
            Returns None if the task is incomplete or if dates are not valid.
     """
     if todo.get('completed') and todo.get('completed_date') and todo.get('created_date'):
-        created_date = todo['created_date']
-        completed_date = todo['completed_date']
-
-        if isinstance(created_date, str):
-            created_date = parse_datetime(created_date)
-        if isinstance(completed_date, str):
-            completed_date = parse_datetime(completed_date)
+        created_date = as_utc_datetime(todo['created_date'])
+        completed_date = as_utc_datetime(todo['completed_date'])
 
         if created_date and completed_date:
             completion_time = completed_date - created_date
@@ -0,0 +1,61 @@
+"""
+Request authentication from the bearer tokens issued by POST /token.
+
+Admin routes additionally require the token's username to be listed in `ADMIN_USERNAMES`
+(comma-separated). With no admins configured, admin routes are closed to everyone.
+"""
+import os
+
+from fastapi import Depends, HTTPException
+from fastapi.security import OAuth2PasswordBearer
+from jose import JWTError, jwt
+
+from app.utils.user_utils import ALGORITHM, SECRET_KEY
+
+ADMIN_USERNAMES = {name.strip() for name in os.getenv("ADMIN_USERNAMES", "").split(",") if name.strip()}
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+
+
+async def get_token_claims(token: str = Depends(oauth2_scheme)) -> dict:
+    """
+    Decodes and validates the bearer token.
+
+    Returns:
+    - dict: The token claims, with the username in `sub` and the user id in `uid`.
+
+    Raises:
+    - HTTPException: If the token is invalid or expired.
+    """
+    try:
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        claims = None
+    if not claims or not claims.get("sub"):
+        raise HTTPException(status_code=401, detail="Could not validate credentials",
+                            headers={"WWW-Authenticate": "Bearer"})
+    return claims
+
+
+def is_admin(claims: dict) -> bool:
+    return claims.get("sub") in ADMIN_USERNAMES
+
+
+async def require_admin(claims: dict = Depends(get_token_claims)) -> dict:
+    """
+    Raises:
+    - HTTPException: If the authenticated user is not an admin.
+    """
+    if not is_admin(claims):
+        raise HTTPException(status_code=403, detail="Admin privileges required")
+    return claims
+
+
+async def require_owner_or_admin(user_id: str, claims: dict = Depends(get_token_claims)) -> dict:
+    """
+    Raises:
+    - HTTPException: If the authenticated user is neither the user in the path nor an admin.
+    """
+    if claims.get("uid") != user_id and not is_admin(claims):
+        raise HTTPException(status_code=403, detail="Not allowed to access this user")
+    return claims
@@ -0,0 +1,91 @@
+from datetime import date, datetime, timezone
+from typing import Optional
+
+WEEKDAYS = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+_WEEKDAY_ALIASES = {}
+for _index, _name in enumerate(WEEKDAYS):
+    for _alias in (_name, _name[:3], _name[:2], str(_index)):
+        _WEEKDAY_ALIASES[_alias.lower()] = _name
+_WEEKDAY_ALIASES["tues"] = "Tuesday"
+_WEEKDAY_ALIASES["thur"] = _WEEKDAY_ALIASES["thurs"] = "Thursday"
+
+
+def parse_datetime(date_str: str) -> Optional[datetime]:
+    """
+    Convert an ISO 8601 string to a timezone-aware UTC datetime.
+
+    Accepts fractional seconds, a trailing 'Z' and explicit offsets. Naive values are taken as UTC,
+    which is how BSON datetimes are stored.
+
+    Parameters:
+    - date_str (str): The datetime string in ISO 8601 format.
+
+    Returns:
+    - datetime: The corresponding UTC datetime, or None if the string cannot be parsed.
+    """
+    try:
+        value = datetime.fromisoformat(date_str)
+    except (TypeError, ValueError):
+        return None
+    return to_utc(value)
+
+
+def to_utc(value: datetime) -> datetime:
+    """
+    Return `value` as a timezone-aware UTC datetime, treating naive values as UTC.
+    """
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    if value.utcoffset():
+        return value.astimezone(timezone.utc)
+    return value
+
+
+def as_utc_datetime(value) -> Optional[datetime]:
+    """
+    Coerce a stored date field to a UTC datetime.
+
+    Canonical (migrated) values are returned without parsing; strings and plain dates from
+    unmigrated documents are converted on the fly.
+
+    Parameters:
+    - value: A datetime, date, ISO 8601 string or None.
+
+    Returns:
+    - datetime: The UTC datetime, or None if the value is missing or unparseable.
+    """
+    if isinstance(value, datetime):
+        return to_utc(value)
+    if isinstance(value, str):
+        return parse_datetime(value)
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day, tzinfo=timezone.utc)
+    return None
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def normalize_weekday(value) -> str:
+    """
+    Map a weekday given as a name, abbreviation, index (Monday=0) or date to its canonical name.
+
+    Raises:
+    - ValueError: If the value does not denote a weekday.
+    """
+    if isinstance(value, date):
+        return WEEKDAYS[value.weekday()]
+    name = _WEEKDAY_ALIASES.get(str(value).strip().rstrip(".").lower())
+    if name is None:
+        raise ValueError(f"Invalid weekday: {value!r}")
+    return name
+
+
+def normalize_days_active(values) -> list:
+    """
+    Canonicalize a days_active collection: weekday names, deduplicated, in week order.
+    """
+    days = {normalize_weekday(value) for value in values or []}
+    return [day for day in WEEKDAYS if day in days]
@@ -0,0 +1,281 @@
+"""
+Translates RFC 6902 JSON Patch documents on a user into a single targeted Mongo update.
+
+Supported paths:
+
+- `/username`, `/email`, `/name`: replace, test
+- `/trees/-`: add a tree
+- `/trees/{index}` and `/trees/{index}/{field}`: replace, test
+- `/todos/-`: add a todo (validated like `TodoCreate`, given a new id and created_date)
+- `/todos/{id}`: remove, test
+- `/todos/{id or index}/{field}`: add, replace, remove (optional fields only), test
+- `/version`: test
+
+`test` operations become conditions of the update filter, so they are checked atomically
+with the write against the document as it was before the patch. A `test` of a path that an
+earlier operation in the same patch changes is therefore rejected rather than evaluated
+against the wrong value. `move` and `copy` are not supported.
+"""
+from typing import List
+
+from bson import ObjectId
+from pydantic import TypeAdapter, ValidationError
+
+from app.schemas.todo import TodoCreate, TodoDisplay
+from app.schemas.todo_storage import TodoStorage
+from app.schemas.user import PatchOperation, TreeDisplay, UserUpdate
+from app.utils import outbox
+from app.utils.dates import normalize_days_active, to_utc, utcnow
+
+USER_FIELDS = ("username", "email", "name")
+TODO_FIELDS = ("title", "description", "days_active", "completed", "completed_date")
+OPTIONAL_TODO_FIELDS = ("description", "completed_date")
+
+_tree_field_adapters = {name: TypeAdapter(field.annotation) for name, field in TreeDisplay.model_fields.items()}
+_todo_field_adapters = {name: TypeAdapter(TodoDisplay.model_fields[name].annotation) for name in TODO_FIELDS}
+
+
+class PatchError(ValueError):
+    pass
+
+
+def parse_pointer(path: str) -> List[str]:
+    """
+    Split a JSON Pointer (RFC 6901) into unescaped reference tokens.
+    """
+    if not path.startswith("/"):
+        raise PatchError(f"Invalid JSON Pointer: {path!r}")
+    return [token.replace("~1", "/").replace("~0", "~") for token in path[1:].split("/")]
+
+
+def _index(token: str) -> int:
+    if not token.isdigit() or (len(token) > 1 and token.startswith("0")):
+        raise PatchError(f"Invalid array index: {token!r}")
+    return int(token)
+
+
+def _validate(adapter: TypeAdapter, value, path: str):
+    try:
+        return adapter.validate_python(value)
+    except ValidationError as e:
+        raise PatchError(f"Invalid value for {path}: {e.errors()[0]['msg']}")
+
+
+def _todo_value(field: str, value, path: str):
+    value = _validate(_todo_field_adapters[field], value, path)
+    if field == "days_active":
+        try:
+            value = normalize_days_active(value)
+        except ValueError as e:
+            raise PatchError(str(e))
+    elif field == "completed_date" and value is not None:
+        value = to_utc(value)
+    return value
+
+
+def _pattern(tokens: List[str]) -> List[str]:
+    """
+    The tokens of a path with array positions that may refer to any element replaced by `*`:
+    appended elements, and todo indexes, which can alias a todo addressed by id.
+    """
+    tokens = list(tokens)
+    if len(tokens) >= 2 and tokens[0] in ("todos", "trees"):
+        ref = tokens[1]
+        if ref == "-" or (tokens[0] == "todos" and ref.isdigit() and not ObjectId.is_valid(ref)):
+            tokens[1] = "*"
+    return tokens
+
+
+def _overlaps(a: List[str], b: List[str]) -> bool:
+    """Whether one path may be the same as, or inside, the other."""
+    return all(x == y or "*" in (x, y) for x, y in zip(a, b))
+
+
+class PatchTranslation:
+    """
+    The Mongo filter conditions, update document and array filters of a translated patch.
+    """
+
+    def __init__(self, storage: TodoStorage):
+        self.storage = storage
+        self.conditions = []
+        self.set = {}
+        self.unset = {}
+        self.push = {}
+        self.pull_ids = []
+        self.array_filters = []
+        self.added_todos = []
+        self._todo_refs = {}
+        self._changed = []
+        self._completions = {}
+
+    def update(self) -> dict:
+        update = {"$inc": {"version": 1}}
+        if self.set:
+            update["$set"] = self.set
+        if self.unset:
+            update["$unset"] = self.unset
+        if self.push:
+            update["$push"] = {field: {"$each": values} for field, values in self.push.items()}
+        if self.pull_ids:
+            id_key = self.storage.key("id")
+            update["$pull"] = {"todos": {id_key: {"$in": self.pull_ids}}}
+        events = self.events()
+        if events:
+            outbox.record(update, *events)
+        return update
+
+    def events(self) -> list:
+        """Outbox events for the todos whose completion the patch sets."""
+        return [outbox.completion_event(ref, fields.get("completed"), fields.get("completed_date"))
+                for ref, fields in self._completions.items()]
+
+    def _todo_position(self, ref: str) -> str:
+        """
+        Path prefix of a todo addressed by array index or by id. Ids go through array filters,
+        which stay correct when the array is reordered concurrently.
+        """
+        if ref.isdigit() and not ObjectId.is_valid(ref):
+            index = _index(ref)
+            self.conditions.append({f"todos.{index}": {"$exists": True}})
+            return f"todos.{index}"
+        if ref not in self._todo_refs:
+            name = f"t{len(self._todo_refs)}"
+            self._todo_refs[ref] = name
+            element = self.storage.element(ref)
+            self.array_filters.append({f"{name}.{key}": value for key, value in element.items()})
+            self.conditions.append({"todos": {"$elemMatch": element}})
+        return f"todos.$[{self._todo_refs[ref]}]"
+
+    def _todo_test(self, ref: str, field: str, value):
+        key = self.storage.key(field)
+        value = self.storage.value(field, value)
+        if self.storage.compact and field in ("completed", "days_active") and not value:
+            # the compact layout omits these fields when they hold their default
+            value = {"$in": [value, None]}
+        if ref.isdigit() and not ObjectId.is_valid(ref):
+            self.conditions.append({f"todos.{_index(ref)}.{key}": value})
+        else:
+            self.conditions.append({"todos": {"$elemMatch": {**self.storage.element(ref), key: value}}})
+
+    def apply(self, operation: PatchOperation):
+        tokens = parse_pointer(operation.path)
+        op, value, path = operation.op, operation.value, operation.path
+        root = tokens[0]
+
+        pattern = _pattern(tokens)
+        if op == "test":
+            if any(_overlaps(changed, pattern) for changed in self._changed):
+                raise PatchError(f"test of {path} follows an operation that changes it")
+        else:
+            self._changed.append(pattern)
+
+        if root == "version" and len(tokens) == 1 and op == "test":
+            self.conditions.append({"version": value} if value else {"version": {"$in": [0, None]}})
+
+        elif root in USER_FIELDS and len(tokens) == 1:
+            if op not in ("replace", "test"):
+                raise PatchError(f"{op} is not allowed on {path}")
+            try:
+                value = UserUpdate(**{root: value}).dict()[root]
+            except ValidationError as e:
+                raise PatchError(f"Invalid value for {path}: {e.errors()[0]['msg']}")
+            if value is None:
+                raise PatchError(f"{path} cannot be null")
+            if op == "test":
+                self.conditions.append({root: value})
+            else:
+                self.set[root] = value
+
+        elif root == "trees" and len(tokens) >= 2:
+            if tokens[1] == "-" and len(tokens) == 2 and op == "add":
+                tree = _validate(TypeAdapter(TreeDisplay), value, path).dict()
+                self.push.setdefault("trees", []).append(tree)
+                return
+            index = _index(tokens[1])
+            if len(tokens) == 2:
+                target, value = f"trees.{index}", _validate(TypeAdapter(TreeDisplay), value, path).dict()
+            elif len(tokens) == 3 and tokens[2] in _tree_field_adapters:
+                target, value = f"trees.{index}.{tokens[2]}", _validate(_tree_field_adapters[tokens[2]], value, path)
+            else:
+                raise PatchError(f"Unsupported path: {path}")
+            if op == "test":
+                self.conditions.append({target: value})
+            elif op == "replace":
+                self.conditions.append({f"trees.{index}": {"$exists": True}})
+                self.set[target] = value
+            else:
+                raise PatchError(f"{op} is not allowed on {path}")
+
+        elif root == "todos" and len(tokens) >= 2:
+            ref = tokens[1]
+            if ref == "-" and len(tokens) == 2:
+                if op != "add":
+                    raise PatchError(f"{op} is not allowed on {path}")
+                try:
+                    todo = TodoCreate(**(value or {})).dict()
+                except ValidationError as e:
+                    raise PatchError(f"Invalid todo: {e.errors()[0]['msg']}")
+                todo["id"] = str(ObjectId())
+                todo["created_date"] = utcnow()
+                if todo["completed"]:
+                    self._completions[todo["id"]] = {"completed": True, "completed_date": todo["completed_date"]}
+                self.added_todos.append(todo)
+                self.push.setdefault("todos", []).append(self.storage.encode(todo))
+            elif len(tokens) == 2:
+                if op == "remove":
+                    if ref.isdigit() and not ObjectId.is_valid(ref):
+                        raise PatchError("Todos can only be removed by id")
+                    self.conditions.append({"todos": {"$elemMatch": self.storage.element(ref)}})
+                    self.pull_ids.append(self.storage.value("id", ref))
+                elif op == "test":
+                    for field, field_value in (value or {}).items():
+                        if field not in TODO_FIELDS:
+                            raise PatchError(f"Unsupported todo field: {field}")
+                        self._todo_test(ref, field, _todo_value(field, field_value, path))
+                else:
+                    raise PatchError(f"{op} is not allowed on {path}; patch individual fields")
+            elif len(tokens) == 3 and tokens[2] in TODO_FIELDS:
+                field = tokens[2]
+                if op == "remove":
+                    if field not in OPTIONAL_TODO_FIELDS:
+                        raise PatchError(f"{path} cannot be removed")
+                    value = None
+                else:
+                    value = _todo_value(field, value, path)
+                if op == "test":
+                    self._todo_test(ref, field, value)
+                else:
+                    if field in ("completed", "completed_date"):
+                        self._completions.setdefault(ref, {})[field] = value
+                    target = f"{self._todo_position(ref)}.{self.storage.key(field)}"
+                    if value is None and self.storage.compact:
+                        # the compact layout omits empty fields
+                        self.unset[target] = ""
+                    else:
+                        self.set[target] = self.storage.value(field, value)
+            else:
+                raise PatchError(f"Unsupported path: {path}")
+
+        else:
+            raise PatchError(f"Unsupported path: {path}")
+
+
+def translate_patch(operations: List[PatchOperation], storage: TodoStorage) -> PatchTranslation:
+    """
+    Translate a JSON Patch document into a Mongo update for a user.
+
+    Parameters:
+    - operations (List[PatchOperation]): The patch operations, applied in order.
+    - storage (TodoStorage): The todo layout of the user being patched.
+
+    Returns:
+    - PatchTranslation: Filter conditions, update document and array filters.
+
+    Raises:
+    - PatchError: If an operation, path or value is not supported or invalid.
+    """
+    translation = PatchTranslation(storage)
+    for operation in operations:
+        translation.apply(operation)
+    return translation
@@ -0,0 +1,201 @@
+"""
+The completed-todos leaderboard.
+
+The top `LEADERBOARD_SIZE` users are kept in memory. They are loaded from every shard through a
+descending index on `completed_todos` and then kept current from the outbox worker's updates.
+`completed_todos` only grows, so a user can only enter the top through an update the worker
+reports. Updates applied by a worker in another process show up when the cache is reloaded,
+every `LEADERBOARD_TTL` seconds.
+
+A user's global rank is one plus the number of users with more completed todos. It is read
+from a histogram of users per `completed_todos` value, kept in the `leaderboard_counts`
+collection on the first shard. The outbox worker and the importer update the histogram with
+each change they make, and it is cached and reloaded along with the top. A rank lookup
+therefore sums the cached counts of the higher values instead of counting users. Users with
+no completed todos are not counted, since every user with a count of zero ranks behind all of
+them. `python -m app.migrations.leaderboard_counts` rebuilds the histogram from the users.
+"""
+import asyncio
+import bisect
+import os
+import time
+from typing import Dict, List, Optional
+
+from pymongo import UpdateOne
+
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", "100"))
+LEADERBOARD_TTL = float(os.getenv("LEADERBOARD_TTL", "60"))
+MAX_FRIENDS = int(os.getenv("MAX_FRIENDS", "1000"))
+
+ENTRY_PROJECTION = {"_id": 0, "id": 1, "username": 1, "name": 1, "completed_todos": 1, "trees": 1}
+INDEX = [("completed_todos", -1), ("id", 1)]
+COUNTS_COLLECTION = "leaderboard_counts"
+
+
+def make_entry(user: dict) -> dict:
+    return {
+        "id": str(user["id"]),
+        "username": user.get("username"),
+        "name": user.get("name"),
+        "completed_todos": user.get("completed_todos") or 0,
+        "trees": user.get("trees") or [],
+    }
+
+
+async def ensure_indexes(shard_router):
+    """Create the index the top is loaded through on every shard. Called at startup."""
+    for db in shard_router.databases():
+        await db.users.create_index(INDEX)
+
+
+def score_counts(shard_router):
+    """The histogram collection: one `{"_id": completed_todos, "count": users}` document per value."""
+    return shard_router.default[COUNTS_COLLECTION]
+
+
+async def count_scores(shard_router, changes: Dict[int, int]):
+    """
+    Apply changes to the histogram.
+
+    Parameters:
+    - shard_router (ShardRouter): The shards; the histogram lives on the first one.
+    - changes (Dict[int, int]): Change in the number of users per `completed_todos` value.
+    """
+    operations = [UpdateOne({"_id": score}, {"$inc": {"count": delta}}, upsert=True)
+                  for score, delta in changes.items() if score > 0 and delta]
+    if operations:
+        await score_counts(shard_router).bulk_write(operations, ordered=False)
+
+
+def sort_key(entry: dict) -> tuple:
+    return -entry["completed_todos"], entry["id"]
+
+
+def ranked(entries: List[dict]) -> List[dict]:
+    """
+    Number sorted entries with competition ranks: users with equal counts share a rank and
+    the next rank skips accordingly (1, 2, 2, 4).
+    """
+    result = []
+    for index, entry in enumerate(entries):
+        if result and result[-1]["completed_todos"] == entry["completed_todos"]:
+            rank = result[-1]["rank"]
+        else:
+            rank = index + 1
+        result.append(dict(entry, rank=rank))
+    return result
+
+
+class TopK:
+    """
+    The `size` best entries, sorted by descending completed todos and then id.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.entries = []
+
+    def replace(self, entries: List[dict]):
+        self.entries = sorted(entries, key=sort_key)[:self.size]
+
+    def observe(self, entry: dict):
+        self.entries = [current for current in self.entries if current["id"] != entry["id"]]
+        if len(self.entries) < self.size or sort_key(entry) < sort_key(self.entries[-1]):
+            bisect.insort(self.entries, entry, key=sort_key)
+            del self.entries[self.size:]
+
+
+class Leaderboard:
+    """
+    The cached global top of the leaderboard.
+
+    Parameters:
+    - size (int): Number of users kept in memory.
+    - ttl (float): Seconds after which the cache is reloaded from the shards.
+    """
+
+    def __init__(self, size: int = LEADERBOARD_SIZE, ttl: float = LEADERBOARD_TTL):
+        self.top_k = TopK(size)
+        self.ttl = ttl
+        self.counts = {}
+        self.loaded_at = None
+        self._loading = None
+
+    @property
+    def size(self) -> int:
+        return self.top_k.size
+
+    async def _top_of(self, db) -> list:
+        return await db.users.find({}, ENTRY_PROJECTION).sort(INDEX).limit(self.size).to_list(self.size)
+
+    async def load(self, shard_router):
+        counts = score_counts(shard_router).find({"count": {"$gt": 0}}).to_list(None)
+        *results, counts = await asyncio.gather(*(self._top_of(db) for db in shard_router.databases()), counts)
+        self.top_k.replace([make_entry(user) for users in results for user in users])
+        self.counts = {count["_id"]: count["count"] for count in counts}
+        self.loaded_at = time.monotonic()
+
+    async def refresh(self, shard_router):
+        """Reload the cache if it is stale. Concurrent callers share one reload."""
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl:
+            if self._loading is None or self._loading.done():
+                self._loading = asyncio.ensure_future(self.load(shard_router))
+            await asyncio.shield(self._loading)
+
+    async def top(self, shard_router, limit: Optional[int] = None) -> List[dict]:
+        """The ranked top entries."""
+        await self.refresh(shard_router)
+        return ranked(self.top_k.entries)[:limit]
+
+    def observe(self, user: dict, previous: Optional[dict] = None):
+        """
+        Record a user's new counters, as reported by the outbox worker, along with the user as
+        it was before the change.
+        """
+        if self.loaded_at is None:
+            return
+        self.top_k.observe(make_entry(user))
+        if previous is not None:
+            for score, delta in ((previous.get("completed_todos") or 0, -1), (user.get("completed_todos") or 0, 1)):
+                if score > 0:
+                    self.counts[score] = self.counts.get(score, 0) + delta
+
+    async def rank(self, shard_router, user: dict) -> dict:
+        """
+        The ranked entry for any user, from the cache if they are in the top and otherwise
+        from the histogram. Costs one addition per distinct higher `completed_todos` value.
+        """
+        await self.refresh(shard_router)
+        entry = make_entry(user)
+        cached = next((item for item in ranked(self.top_k.entries) if item["id"] == entry["id"]), None)
+        if cached is not None and cached["completed_todos"] == entry["completed_todos"]:
+            return dict(entry, rank=cached["rank"])
+
+        ahead = sum(count for score, count in self.counts.items() if score > entry["completed_todos"])
+        return dict(entry, rank=ahead + 1)
+
+
+async def fetch_entries(shard_router, user_ids: List[str]) -> List[dict]:
+    """
+    Load leaderboard entries for specific users, with one query per shard.
+    """
+    by_shard = {}
+    for user_id in user_ids:
+        by_shard.setdefault(shard_router.shard_name(user_id), []).append(user_id)
+    results = await asyncio.gather(*(
+        shard_router.shards[name].users.find({"id": {"$in": ids}}, ENTRY_PROJECTION).to_list(None)
+        for name, ids in by_shard.items()
+    ))
+    users = [user for shard_users in results for user in shard_users]
+
+    missing = set(user_ids) - {str(user["id"]) for user in users}
+    if missing and shard_router.previous_ring is not None:
+        for user_id in missing:
+            db = await shard_router.locate(user_id)
+            user = await db.users.find_one({"id": user_id}, ENTRY_PROJECTION)
+            if user:
+                users.append(user)
+    return sorted((make_entry(user) for user in users), key=sort_key)
+
+
+leaderboard = Leaderboard()
@@ -0,0 +1,160 @@
+"""
+Read coalescing for Mongo `find_one` calls.
+
+Every request gets a `RequestDatabase` wrapping the shared Motor database. Its `find_one`:
+
+- memoizes results for the rest of the request (DataLoader style), so repeated identical
+  reads in one handler cost one round trip;
+- deduplicates in-flight reads across requests (singleflight), so concurrent identical
+  reads, e.g. a client fanning out several calls for the same user, share one round trip.
+
+Reads are keyed on (database, collection, filter, projection), so reads sent to different
+shard databases are never merged. Any write through the wrapper clears the request's memo
+and makes its later reads bypass singleflight, so a request always reads its own writes.
+
+A read stores its result in the memo as is, so the common single read per document costs no
+copy. Memo hits and coalesced callers receive private copies. The first caller's result is the
+memoized one, so a handler that mutates a result in place sees that change if it reads the
+same document again without writing.
+"""
+import asyncio
+import os
+
+import bson
+from bson.codec_options import CodecOptions
+
+COALESCING_ENABLED = os.getenv("READ_COALESCING", "1").lower() in ("1", "true", "yes")
+
+WRITE_METHODS = {
+    "insert_one", "insert_many", "update_one", "update_many", "replace_one", "delete_one",
+    "delete_many", "bulk_write", "find_one_and_update", "find_one_and_replace", "find_one_and_delete",
+}
+
+# Copies go through BSON, which is much faster than copy.deepcopy for large documents.
+_CODEC_OPTIONS = CodecOptions(tz_aware=True)
+
+
+def _encode(document):
+    return None if document is None else bson.encode(document)
+
+
+def _decode(data):
+    return None if data is None else bson.decode(data, codec_options=_CODEC_OPTIONS)
+
+
+read_stats = {"find_one": 0, "memo_hits": 0, "coalesced": 0, "executed": 0}
+
+
+def coalescing_stats() -> dict:
+    calls = read_stats["find_one"]
+    saved = read_stats["memo_hits"] + read_stats["coalesced"]
+    return {**read_stats, "enabled": COALESCING_ENABLED, "coalescing_rate": saved / calls if calls else 0.0}
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time; concurrent callers with the same key await
+    the running call and receive a copy of its result.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, fn):
+        call = self._calls.get(key)
+        if call is not None:
+            future = call[0]
+            call[1] += 1
+            read_stats["coalesced"] += 1
+            try:
+                return _decode(_encode(await asyncio.shield(future)))
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+            # The leading request was cancelled; read on our own.
+            return await fn()
+
+        future = asyncio.get_running_loop().create_future()
+        call = self._calls[key] = [future, 0]
+        read_stats["executed"] += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            self._calls.pop(key, None)
+        future.set_result(result)
+        return _decode(_encode(result)) if call[1] else result
+
+
+inflight = SingleFlight()
+
+
+class RequestCollection:
+    def __init__(self, database: "RequestDatabase", name: str):
+        self._database = database
+        self._name = name
+        self._collection = database._db[name]
+
+    async def find_one(self, filter=None, projection=None, *args, **kwargs):
+        if args or kwargs:
+            return await self._collection.find_one(filter, projection, *args, **kwargs)
+
+        read_stats["find_one"] += 1
+        key = (id(self._database._db), self._name, bson.encode(filter or {}), bson.encode(projection or {}))
+        memo = self._database._memo
+        if key in memo:
+            read_stats["memo_hits"] += 1
+            return _decode(_encode(memo[key]))
+
+        read = lambda: self._collection.find_one(filter, projection)
+        if self._database._wrote:
+            read_stats["executed"] += 1
+            result = await read()
+        else:
+            result = await inflight.do(key, read)
+        memo[key] = result
+        return result
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if name not in WRITE_METHODS:
+            return attribute
+
+        def write(*args, **kwargs):
+            self._database._memo.clear()
+            self._database._wrote = True
+            return attribute(*args, **kwargs)
+
+        return write
+
+
+class RequestDatabase:
+    """
+    A per-request view of the database that coalesces `find_one` reads.
+    """
+
+    def __init__(self, db):
+        self._db = db
+        self._memo = {}
+        self._wrote = False
+
+    def __getattr__(self, name):
+        return RequestCollection(self, name)
+
+    def __getitem__(self, name):
+        return RequestCollection(self, name)
+
+
+def request_database(db):
+    """
+    Wrap `db` for one request, or return it unchanged when coalescing is disabled.
+    """
+    if db is None or not COALESCING_ENABLED:
+        return db
+    return RequestDatabase(db)
@@ -0,0 +1,302 @@
+"""
+Domain events recorded with the writes that cause them, and the worker that applies their
+side effects off the request path.
+
+Mutations push their events onto the user's `outbox` array in the same update as the primary
+write, so an event exists if and only if the write happened. The worker finds users with
+pending events and, in one update per user, applies the derived changes (average completion
+time, `completed_todos` and the tree stage) and pulls the events it handled. That update only
+matches while the events are still there and the counters it read are unchanged, so an event
+is applied exactly once even when several workers race or a batch is retried.
+
+The worker runs in the API process by default (`OUTBOX_WORKER=inline`). To run it on its own,
+set `OUTBOX_WORKER=off` for the API and start:
+
+    python -m app.utils.outbox
+"""
+import asyncio
+import logging
+import os
+import random
+from datetime import datetime
+from typing import Optional
+
+from app.schemas.todo_storage import decode_todos
+from app.utils.analytics import calculate_avg_completion_time
+from app.utils.dates import utcnow
+from app.utils.leaderboard import count_scores
+
+OUTBOX_WORKER = os.getenv("OUTBOX_WORKER", "inline")
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "4"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1.0"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+
+TODO_COMPLETED = "todo_completed"
+TODO_REOPENED = "todo_reopened"
+TODO_RESET = "todo_reset"
+TODO_DELETED = "todo_deleted"
+
+TREE_NAME = "Uncaria"
+TODOS_PER_STAGE = 4
+
+PROJECTION = {"id": 1, "username": 1, "name": 1, "todos": 1, "trees": 1, "completed_todos": 1,
+              "average_completion_time": 1, "outbox": 1}
+
+worker = None
+_listeners = []
+
+
+def make_event(event_type: str, todo_id: str, at: Optional[datetime] = None) -> dict:
+    """
+    Build an outbox event.
+
+    Parameters:
+    - event_type (str): One of the TODO_* event types.
+    - todo_id (str): The todo the event is about.
+    - at (datetime, optional): The completion time the event refers to. It is part of the
+      idempotency key, so completing the same todo on two days gives two events.
+
+    Returns:
+    - dict: The event, ready to be pushed with `record`.
+    """
+    return {
+        "key": f"{event_type}:{todo_id}:{at.isoformat() if at else ''}",
+        "type": event_type,
+        "todo_id": str(todo_id),
+        "at": at,
+        "created": utcnow(),
+        "attempts": 0,
+    }
+
+
+def completion_event(todo_id: str, completed: Optional[bool] = None, at: Optional[datetime] = None) -> dict:
+    """
+    The event for a write that sets a todo's completion outside the /complete route, e.g. an
+    edit, a patch or a replaced todo list: reopened if it sets `completed` to false, otherwise
+    completed at `at`.
+    """
+    return make_event(TODO_REOPENED if completed is False else TODO_COMPLETED, todo_id, at)
+
+
+def record(update: dict, *events: dict) -> dict:
+    """Add `events` to a user update so they are written atomically with it."""
+    update["$push"] = dict(update.get("$push", {}), outbox={"$each": list(events)})
+    return update
+
+
+def notify():
+    """Wake the in-process worker after a write that recorded events."""
+    if worker is not None:
+        worker.wakeup.set()
+
+
+def subscribe(listener):
+    """
+    Call `listener(user, previous)` with each user whose `completed_todos` or tree stage a
+    worker in this process changed, with the new values applied, and the user as it was
+    before, e.g. to keep in-memory views current.
+    """
+    _listeners.append(listener)
+
+
+def _applied(user: dict, fields: dict) -> dict:
+    user = dict(user, trees=[dict(tree) for tree in user.get("trees") or []])
+    for field, value in fields.items():
+        if field.startswith("trees."):
+            user["trees"][int(field.split(".")[1])]["stage"] = value
+        else:
+            user[field] = value
+    return user
+
+
+def derive(user: dict, events: list) -> tuple:
+    """
+    Compute the derived update for a user's pending events.
+
+    Returns:
+    - tuple: The `$set` fields and the conditions the update must be guarded by.
+    """
+    fields, guard = {}, {}
+    avg_time_hours = calculate_avg_completion_time(decode_todos(user.get("todos")))
+    if avg_time_hours is not None and avg_time_hours != user.get("average_completion_time"):
+        fields["average_completion_time"] = avg_time_hours
+
+    resets = sum(1 for event in events if event["type"] == TODO_RESET)
+    trees = user.get("trees") or []
+    tree_index = next((index for index, tree in enumerate(trees) if tree["name"] == TREE_NAME), None)
+    if resets and tree_index is not None:
+        old_count = user.get("completed_todos", 0)
+        new_count = old_count + resets
+        stage = trees[tree_index]["stage"]
+        fields["completed_todos"] = new_count
+        fields[f"trees.{tree_index}.stage"] = stage + new_count // TODOS_PER_STAGE - old_count // TODOS_PER_STAGE
+        guard["completed_todos"] = user.get("completed_todos")
+        guard[f"trees.{tree_index}.stage"] = stage
+    return fields, guard
+
+
+class OutboxWorker:
+    """
+    Consumes outbox events in batches from every shard.
+
+    Parameters:
+    - shard_router (ShardRouter): The shards to consume from.
+    - concurrency (int): Users processed at the same time.
+    - batch_size (int): Users with pending events read per round trip and shard.
+    - poll_interval (float): Seconds to wait for new events when there is no work.
+    - max_attempts (int): Failed deliveries after which an event is left for inspection.
+    """
+
+    def __init__(self, shard_router, concurrency: int = OUTBOX_CONCURRENCY, batch_size: int = OUTBOX_BATCH_SIZE,
+                 poll_interval: float = OUTBOX_POLL_INTERVAL, max_attempts: int = OUTBOX_MAX_ATTEMPTS):
+        self.router = shard_router
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.stats = {"processed": 0, "conflicts": 0, "failed": 0, "batches": 0}
+        self.wakeup = asyncio.Event()
+        self._task = None
+
+    def _pending(self, event: dict) -> bool:
+        return event.get("attempts", 0) < self.max_attempts
+
+    async def ensure_indexes(self):
+        for db in self.router.databases():
+            await db.users.create_index("outbox.attempts", sparse=True)
+
+    async def process_user(self, db, user: dict) -> int:
+        """
+        Apply and remove a user's pending events.
+
+        Returns:
+        - int: The number of events this call applied.
+        """
+        keys = [event["key"] for event in user.get("outbox") or [] if self._pending(event)]
+        for attempt in range(self.max_attempts):
+            events = [event for event in user.get("outbox") or [] if event["key"] in keys and self._pending(event)]
+            if not events:
+                return 0
+            keys = [event["key"] for event in events]
+            try:
+                fields, guard = derive(user, events)
+            except Exception:
+                logging.exception(f"outbox: failed to apply {keys} for user {user.get('id')}")
+                self.stats["failed"] += len(keys)
+                for key in keys:
+                    await db.users.update_one({"_id": user["_id"], "outbox.key": key},
+                                              {"$inc": {"outbox.$.attempts": 1}})
+                return 0
+
+            update = {"$pull": {"outbox": {"key": {"$in": keys}}}}
+            if fields:
+                # Only changes clients can see move the version their If-Match headers compare against.
+                update["$set"] = fields
+                update["$inc"] = {"version": 1}
+            result = await db.users.update_one({"_id": user["_id"], "outbox.key": {"$all": keys}, **guard}, update)
+            if result.modified_count:
+                self.stats["processed"] += len(keys)
+                if "completed_todos" in fields:
+                    try:
+                        await count_scores(self.router, {user.get("completed_todos") or 0: -1,
+                                                         fields["completed_todos"]: 1})
+                    except Exception:
+                        logging.exception(f"outbox: failed to update leaderboard counts for user {user.get('id')}")
+                    updated = _applied(user, fields)
+                    for listener in _listeners:
+                        listener(updated, user)
+                return len(keys)
+
+            # Another worker or a request changed the user since it was read; re-read and retry.
+            self.stats["conflicts"] += 1
+            await asyncio.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+            user = await db.users.find_one({"_id": user["_id"]}, PROJECTION)
+            if user is None:
+                return 0
+        return 0
+
+    async def run_once(self) -> int:
+        """
+        Process one batch of users from each shard.
+
+        Returns:
+        - int: The number of events applied.
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def bounded(db, user):
+            async with semaphore:
+                return await self.process_user(db, user)
+
+        applied = 0
+        for db in self.router.databases():
+            users = await db.users.find({"outbox.attempts": {"$lt": self.max_attempts}}, PROJECTION) \
+                .limit(self.batch_size).to_list(self.batch_size)
+            if users:
+                self.stats["batches"] += 1
+                applied += sum(await asyncio.gather(*(bounded(db, user) for user in users)))
+        return applied
+
+    async def run(self):
+        await self.ensure_indexes()
+        while True:
+            self.wakeup.clear()
+            try:
+                applied = await self.run_once()
+            except Exception:
+                logging.exception("outbox: batch failed")
+                applied = 0
+            if applied:
+                await asyncio.sleep(0)
+                continue
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def start_worker(shard_router):
+    """Start the in-process worker unless it runs as a separate process."""
+    global worker
+    if OUTBOX_WORKER == "inline" and worker is None:
+        worker = OutboxWorker(shard_router)
+        worker.start()
+
+
+async def stop_worker():
+    global worker
+    if worker is not None:
+        await worker.stop()
+        worker = None
+
+
+def outbox_stats() -> dict:
+    return {"mode": OUTBOX_WORKER, **(worker.stats if worker is not None else {})}
+
+
+async def main():
+    from app import database
+
+    await database.connect_to_mongo()
+    try:
+        await OutboxWorker(database.get_router()).run()
+    finally:
+        await database.close_mongo_connection()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,153 @@
+"""
+Hash-based placement of users across several Mongo databases.
+
+Users are placed on a consistent-hash ring keyed on their `id`, so adding a shard only moves
+the users that land on its ring positions. Logins and uniqueness checks, which look users
+up by `username` or `email`, go through a small directory collection kept on the first
+shard. With a single shard the router is a pass-through and no directory is used.
+
+While a rebalance is in progress (a previous shard list is configured), a user whose
+placement changed is looked up on the new shard first and on the old one if they have not
+been moved yet.
+"""
+import bisect
+import hashlib
+from typing import Dict, List, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+DIRECTORY_COLLECTION = "user_directory"
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    A consistent-hash ring with `vnodes` virtual nodes per shard.
+    """
+
+    def __init__(self, names: List[str], vnodes: int = 64):
+        points = sorted((_hash(f"{name}#{index}"), name) for name in names for index in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._names = [name for _, name in points]
+
+    def lookup(self, key: str) -> str:
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._names[index]
+
+
+class ShardRouter:
+    """
+    Resolves the database holding a user.
+
+    Parameters:
+    - shards (Dict[str, Database]): Shard name to database, in configuration order. The first
+      shard also holds the user directory.
+    - previous (List[str], optional): Shard names before the current rebalance, if one is running.
+    - vnodes (int): Virtual nodes per shard on the ring.
+    """
+
+    def __init__(self, shards: Dict[str, object], previous: Optional[List[str]] = None, vnodes: int = 64):
+        if not shards:
+            raise ValueError("At least one shard is required")
+        self.shards = dict(shards)
+        self.names = list(self.shards)
+        self.ring = HashRing(self.names, vnodes)
+        self.previous_ring = None
+        if previous and set(previous) != set(self.names):
+            unknown = set(previous) - set(self.names)
+            if unknown:
+                raise ValueError(f"Previous shards {sorted(unknown)} are not configured")
+            self.previous_ring = HashRing(previous, vnodes)
+
+    @property
+    def sharded(self) -> bool:
+        return len(self.shards) > 1
+
+    @property
+    def default(self):
+        return self.shards[self.names[0]]
+
+    @property
+    def directory(self):
+        return self.default[DIRECTORY_COLLECTION]
+
+    def databases(self) -> list:
+        return list(self.shards.values())
+
+    def shard_name(self, user_id: str) -> str:
+        if not self.sharded:
+            return self.names[0]
+        return self.ring.lookup(str(user_id))
+
+    def database_for(self, user_id: str):
+        """The database a user belongs on under the current topology."""
+        return self.shards[self.shard_name(user_id)]
+
+    async def locate(self, user_id: str):
+        """
+        The database currently holding a user. Only costs a round trip during a rebalance,
+        for users whose placement changed.
+        """
+        target = self.shard_name(user_id)
+        if self.previous_ring is None:
+            return self.shards[target]
+        previous = self.previous_ring.lookup(str(user_id))
+        if previous == target:
+            return self.shards[target]
+        if await self.shards[target].users.find_one({"id": user_id}, {"_id": 1}):
+            return self.shards[target]
+        return self.shards[previous]
+
+    async def lookup(self, field: str, value: str) -> Optional[str]:
+        """The id of the user whose `field` (username or email) is `value`, via the directory."""
+        entry = await self.directory.find_one({"_id": f"{field}:{value}"})
+        return entry["user_id"] if entry else None
+
+    async def locate_username(self, username: str):
+        """
+        The database holding the user with `username`, or None if there is no such user.
+        """
+        if not self.sharded:
+            return self.default
+        user_id = await self.lookup("username", username)
+        return await self.locate(user_id) if user_id else None
+
+    async def claim(self, field: str, value: str, user_id: str) -> bool:
+        """
+        Reserve a unique `field` value for a user in the directory.
+
+        Returns:
+        - bool: False if another user already holds the value.
+        """
+        if not self.sharded:
+            return True
+        try:
+            await self.directory.insert_one({"_id": f"{field}:{value}", "user_id": user_id})
+        except DuplicateKeyError:
+            entry = await self.directory.find_one({"_id": f"{field}:{value}"})
+            return bool(entry) and entry["user_id"] == user_id
+        return True
+
+    async def release(self, field: str, value: str, user_id: str):
+        if self.sharded:
+            await self.directory.delete_one({"_id": f"{field}:{value}", "user_id": user_id})
+
+
+def parse_shards(spec: str) -> List[tuple]:
+    """
+    Parse a shard list of the form `name=mongodb://host:port/database;name2=...`.
+
+    Returns:
+    - List[tuple]: (name, url, database name) for each shard; the database defaults to todo_list_db.
+    """
+    shards = []
+    for entry in filter(None, (part.strip() for part in spec.split(";"))):
+        name, _, url = entry.partition("=")
+        if not url:
+            raise ValueError(f"Invalid shard entry: {entry!r}")
+        database = url.split("://", 1)[-1].partition("/")[2].split("?")[0] or "todo_list_db"
+        shards.append((name.strip(), url, database))
+    return shards
@@ -0,0 +1,97 @@
+from datetime import datetime
+from typing import Optional
+
+from app.schemas.todo_storage import todo_day_expr, todo_field_expr
+from app.utils.dates import to_utc
+
+SORT_FIELDS = ("created_date", "completed_date", "title")
+
+
+def _date_range(conditions: list, field: str, after: Optional[datetime], before: Optional[datetime]):
+    value = todo_field_expr(field)
+    if after is not None:
+        conditions.append({"$gte": [value, to_utc(after)]})
+    if before is not None:
+        # null sorts below every date, so exclude todos without the date explicitly
+        conditions.append({"$gt": [value, None]})
+        conditions.append({"$lt": [value, to_utc(before)]})
+
+
+def _page(todos: str, offset: int, limit: Optional[int]) -> dict:
+    page = todos
+    if offset or limit is not None:
+        count = limit if limit is not None else {"$max": [{"$size": todos}, 1]}
+        page = {"$slice": [todos, offset, count]}
+    return {"total": {"$size": todos}, "todos": page}
+
+
+def build_todo_page_pipeline(
+    user_id: str,
+    completed: Optional[bool] = None,
+    day: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    completed_after: Optional[datetime] = None,
+    completed_before: Optional[datetime] = None,
+    sort: Optional[str] = None,
+    offset: int = 0,
+    limit: Optional[int] = None,
+) -> list:
+    """
+    Build an aggregation that filters, sorts and pages a user's embedded todos in the database.
+
+    The pipeline returns a single document `{"total": <matching todos>, "todos": [<page>]}`,
+    or nothing if the user does not exist. Fields are read with layout-agnostic expressions,
+    so legacy and compact todos are handled alike.
+
+    Parameters:
+    - user_id (str): The unique identifier for the user.
+    - completed (bool, optional): Keep only completed (True) or open (False) todos.
+    - day (str, optional): Keep only todos active on this canonical weekday name.
+    - created_after, created_before, completed_after, completed_before (datetime, optional):
+      Half-open date ranges [after, before).
+    - sort (str, optional): One of SORT_FIELDS, prefixed with "-" for descending order.
+    - offset (int): Number of matching todos to skip.
+    - limit (int, optional): Maximum number of todos to return.
+
+    Returns:
+    - list: The aggregation pipeline.
+    """
+    conditions = []
+    if completed is not None:
+        conditions.append({"$eq": [todo_field_expr("completed"), completed]})
+    if day is not None:
+        conditions.append(todo_day_expr(day))
+    _date_range(conditions, "created_date", created_after, created_before)
+    _date_range(conditions, "completed_date", completed_after, completed_before)
+
+    todos = {"$ifNull": ["$todos", []]}
+    if conditions:
+        todos = {"$filter": {"input": todos, "as": "todo", "cond": {"$and": conditions}}}
+
+    if not sort:
+        return [
+            {"$match": {"id": user_id}},
+            {"$project": {
+                "_id": 0,
+                "result": {"$let": {
+                    "vars": {"matching": todos},
+                    "in": _page("$$matching", offset, limit),
+                }},
+            }},
+            {"$replaceRoot": {"newRoot": "$result"}},
+        ]
+
+    # Sort by unwinding the matching todos rather than with $sortArray, which needs MongoDB 5.2.
+    # Ties keep their stored order.
+    field = sort.lstrip("-")
+    direction = -1 if sort.startswith("-") else 1
+    return [
+        {"$match": {"id": user_id}},
+        {"$project": {"_id": 0, "id": 1, "todos": todos}},
+        {"$unwind": {"path": "$todos", "includeArrayIndex": "position", "preserveNullAndEmptyArrays": True}},
+        {"$addFields": {"key": todo_field_expr(field, "$todos")}},
+        {"$sort": {"key": direction, "position": 1}},
+        {"$group": {"_id": "$id", "todos": {"$push": "$todos"}}},
+        {"$project": {"_id": 0, **_page("$todos", offset, limit)}},
+    ]
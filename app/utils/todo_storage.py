@@ -0,0 +1,75 @@
+import logging
+from typing import Optional
+
+from app.schemas.todo_storage import (
+    COMPACT, COMPACT_ENABLED, SCHEMA_VERSION, TodoStorage, decode_todos, encode_todo, storage_for,
+)
+
+
+async def compact_user_todos(db, user_id: str, todos: Optional[list] = None) -> bool:
+    """
+    Rewrite a user's todos in the compact layout.
+
+    The write only applies if the todos are still the ones that were read, so a concurrent
+    change is never overwritten; the user is simply converted on a later write.
+
+    Parameters:
+    - db: The Motor database.
+    - user_id (str): The unique identifier for the user.
+    - todos (list, optional): The stored todos, if the caller already read them.
+
+    Returns:
+    - bool: True if the user's todos are stored compactly after the call.
+    """
+    if todos is None:
+        user = await db.users.find_one({"id": user_id}, {"todos": 1, "schema_version": 1})
+        if not user:
+            return False
+        if user.get("schema_version") == SCHEMA_VERSION:
+            return True
+        todos = user.get("todos", [])
+
+    try:
+        encoded = [encode_todo(todo) for todo in decode_todos(todos)]
+    except ValueError as e:
+        logging.info(f"Keeping legacy todo layout for user {user_id}: {e}")
+        return False
+
+    result = await db.users.update_one(
+        {"id": user_id, "schema_version": {"$ne": SCHEMA_VERSION}, "todos": todos or {"$in": [None, []]}},
+        {"$set": {"todos": encoded, "schema_version": SCHEMA_VERSION}, "$inc": {"version": 1}},
+    )
+    return result.modified_count == 1
+
+
+async def resolve_todo_storage(db, user_id: str, user: Optional[dict] = None,
+                               convert: bool = True) -> Optional[TodoStorage]:
+    """
+    Work out which todo layout to write for a user, converting the user first when the
+    compact layout is enabled (migrate-on-write).
+
+    Parameters:
+    - db: The Motor database.
+    - user_id (str): The unique identifier for the user.
+    - user (dict, optional): The user document if already read; must include `todos` for the
+      conversion to avoid a round trip.
+    - convert (bool): Whether to convert the user. The conversion increments the user's
+      version, so writes conditional on a version pass False and keep the current layout.
+
+    Returns:
+    - Optional[TodoStorage]: The layout to use, or None if the user does not exist.
+    """
+    if user is None:
+        user = await db.users.find_one({"id": user_id}, {"schema_version": 1})
+        if not user:
+            return None
+
+    storage = storage_for(user)
+    if convert and COMPACT_ENABLED and not storage.compact:
+        if await compact_user_todos(db, user_id, user.get("todos")):
+            return COMPACT
+        user = await db.users.find_one({"id": user_id}, {"schema_version": 1})
+        if not user:
+            return None
+        return storage_for(user)
+    return storage
@@ -0,0 +1,462 @@
+"""
+Streaming export and bulk import of users and their todos.
+
+Exports are produced record by record from Motor cursors. The NDJSON format holds one
+`{"type": "user", ...}` line per user followed by one `{"type": "todo", "user_id": ..., ...}`
+line per todo; the CSV format holds one row per todo. Imports read NDJSON incrementally and
+write in unordered batches, so neither side holds more than one user document or one batch
+in memory.
+
+Usage:
+    python -m app.utils.transfer export [--include-credentials] > backup.ndjson
+    python -m app.utils.transfer import backup.ndjson [--batch-size 1000]
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import logging
+import sys
+from collections import Counter, OrderedDict
+from datetime import datetime
+from typing import AsyncIterator, Callable, Optional
+
+from bson import ObjectId
+from pydantic import ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.schemas.todo import TodoInput
+from app.schemas.todo_storage import COMPACT, COMPACT_ENABLED, LEGACY, decode_todos, storage_for
+from app.schemas.user import UserModel
+from app.utils.leaderboard import MAX_FRIENDS, count_scores
+
+USER_FIELDS = ("id", "username", "email", "name", "completed_todos", "trees", "average_completion_time", "friends")
+CSV_COLUMNS = ("user_id", "id", "title", "description", "days_active", "created_date", "completed", "completed_date")
+MAX_REPORTED_ERRORS = 1000
+KNOWN_USERS_CACHE_SIZE = 10000
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _user_projection(include_credentials: bool) -> dict:
+    projection = {field: 1 for field in USER_FIELDS}
+    projection.update({"todos": 1, "_id": 0})
+    if include_credentials:
+        projection["hashed_password"] = 1
+    return projection
+
+
+def user_records(user: dict):
+    """
+    Yield the export records of one user document: the user itself, then each decoded todo.
+    """
+    todos = user.pop("todos", None) or []
+    yield {"type": "user", **user}
+    user_id = str(user["id"])
+    for todo in decode_todos(todos):
+        yield {"type": "todo", "user_id": user_id, **todo}
+
+
+def to_ndjson(record: dict) -> str:
+    return json.dumps(record, default=_json_default) + "\n"
+
+
+def _csv_row(record: dict) -> str:
+    buffer = io.StringIO()
+    value = lambda v: v.isoformat() if isinstance(v, datetime) else ("" if v is None else v)
+    csv.writer(buffer).writerow([
+        record["user_id"], record["id"], record["title"], value(record.get("description")),
+        ";".join(record.get("days_active") or []), value(record.get("created_date")),
+        bool(record.get("completed")), value(record.get("completed_date")),
+    ])
+    return buffer.getvalue()
+
+
+async def export_lines(cursor, fmt: str = "ndjson") -> AsyncIterator[str]:
+    """
+    Serialize the users yielded by a Motor cursor.
+
+    Parameters:
+    - cursor: A Motor cursor over user documents.
+    - fmt (str): "ndjson" for users and todos, or "csv" for one row per todo.
+
+    Yields:
+    - str: One serialized line at a time.
+    """
+    if fmt == "csv":
+        yield ",".join(CSV_COLUMNS) + "\r\n"
+    async for user in cursor:
+        for record in user_records(user):
+            if fmt == "csv":
+                if record["type"] == "todo":
+                    yield _csv_row(record)
+            else:
+                yield to_ndjson(record)
+
+
+def export_user_cursor(db, user_id: str, include_credentials: bool = False):
+    return db.users.find({"id": user_id}, _user_projection(include_credentials))
+
+
+async def export_all_cursor(shard_router, include_credentials: bool = False, batch_size: int = 100):
+    """
+    Yield every user from every shard, one shard after the other.
+    """
+    for db in shard_router.databases():
+        cursor = db.users.find({}, _user_projection(include_credentials)).sort("_id", 1).batch_size(batch_size)
+        async for user in cursor:
+            yield user
+
+
+class BulkImporter:
+    """
+    Validates NDJSON export records and writes them in unordered batches.
+
+    User records become `insert_many` batches and todo records become `$push` updates
+    grouped per user in a `bulk_write`, one of each per shard. A batch of users is always
+    flushed before the todos that follow it, so a todo may reference a user imported earlier
+    in the same file. The shard and todo layout of recently seen users are cached, up to
+    KNOWN_USERS_CACHE_SIZE users, and looked up once per batch for the others. Todos a user
+    already has are skipped, so an import can be repeated. Errors are collected per line
+    instead of aborting the import.
+    """
+
+    def __init__(self, shard_router, batch_size: int = 1000, on_progress: Optional[Callable[[dict], None]] = None):
+        self.router = shard_router
+        self.batch_size = batch_size
+        self.on_progress = on_progress
+        self.users = []
+        self.todos = []
+        self.known_users = OrderedDict()
+        self.stats = {"lines": 0, "users_inserted": 0, "todos_inserted": 0, "todos_skipped": 0, "errors": 0}
+        self.errors = []
+
+    def _error(self, line: int, message: str):
+        self.stats["errors"] += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    async def add_line(self, line_number: int, line: str):
+        line = line.strip()
+        if not line:
+            return
+        self.stats["lines"] += 1
+        try:
+            record = json.loads(line)
+            record_type = record.pop("type", None)
+            if record_type == "user":
+                self._add_user(line_number, record)
+            elif record_type == "todo":
+                self._add_todo(line_number, record)
+            else:
+                raise ValueError(f"Unknown record type: {record_type!r}")
+        except (ValueError, ValidationError) as e:
+            self._error(line_number, str(e))
+            return
+
+        if len(self.users) >= self.batch_size:
+            await self.flush_users()
+        if len(self.todos) >= self.batch_size:
+            await self.flush()
+
+    def _add_user(self, line_number: int, record: dict):
+        record.setdefault("todos", [])
+        if record["todos"]:
+            raise ValueError("Embedded todos are not supported; use todo records")
+        if len(record.get("friends") or []) > MAX_FRIENDS:
+            raise ValueError(f"Users can have at most {MAX_FRIENDS} friends")
+        user = UserModel(**record).dict(by_alias=True)
+        user["id"] = str(user["id"])
+        user["schema_version"] = (COMPACT if COMPACT_ENABLED else LEGACY).schema_version
+        self.users.append((line_number, user))
+
+    def _add_todo(self, line_number: int, record: dict):
+        user_id = record.pop("user_id", None)
+        if not user_id:
+            raise ValueError("Todo record without user_id")
+        todo = TodoInput(**record).dict()
+        todo["id"] = str(todo["id"])
+        self.todos.append((line_number, str(user_id), todo))
+
+    async def _claim_directory(self, batch: list) -> tuple:
+        """
+        Reserve usernames and emails in the shard directory in one unordered insert;
+        users with a taken value are reported and dropped from the batch.
+
+        Returns:
+        - tuple: The remaining batch, and the directory entries claimed for each of its lines.
+        """
+        entries = [({"_id": f"{field}:{user[field]}", "user_id": user["id"]}, line_number)
+                   for line_number, user in batch for field in ("username", "email")]
+        rejected, failed = {}, set()
+        try:
+            await self.router.directory.insert_many([dict(entry) for entry, _ in entries], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                entry, line_number = entries[error["index"]]
+                failed.add(error["index"])
+                rejected.setdefault(line_number, entry["_id"].split(":", 1)[0])
+
+        claims = {}
+        for index, (entry, line_number) in enumerate(entries):
+            if index not in failed:
+                claims.setdefault(line_number, []).append(entry)
+        await self._release_claims(claims, rejected)
+        for line_number, field in rejected.items():
+            self._error(line_number, f"User with this {field} already exists")
+        return [(line_number, user) for line_number, user in batch if line_number not in rejected], claims
+
+    async def _release_claims(self, claims: dict, line_numbers):
+        """Delete the directory entries claimed for users that were not inserted."""
+        entries = [entry for line_number in line_numbers for entry in claims.pop(line_number, [])]
+        if entries:
+            await self.router.directory.delete_many({"$or": entries})
+
+    async def _insert_users(self, db, batch: list) -> list:
+        """
+        Insert a batch of users into one shard.
+
+        Returns:
+        - list: The line numbers of the users that were not inserted.
+        """
+        fields = ("id",) if self.router.sharded else ("id", "username", "email")
+        existing = await db.users.find(
+            {"$or": [{field: {"$in": [user[field] for _, user in batch]}} for field in fields]},
+            {field: 1 for field in fields},
+        ).to_list(None)
+        taken = {(key, doc.get(key)) for doc in existing for key in fields}
+
+        documents, lines, skipped = [], [], []
+        for line_number, user in batch:
+            clash = next((key for key in fields if (key, user[key]) in taken), None)
+            if clash:
+                self._error(line_number, f"User with this {clash} already exists")
+                skipped.append(line_number)
+                continue
+            taken.update((key, user[key]) for key in fields)
+            documents.append(user)
+            lines.append(line_number)
+
+        if not documents:
+            return skipped
+        failed = set()
+        try:
+            await db.users.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                failed.add(error["index"])
+                self._error(lines[error["index"]], error.get("errmsg", "Insert failed"))
+        inserted = [user for index, user in enumerate(documents) if index not in failed]
+        for user in inserted:
+            self._remember(user, db)
+        self.stats["users_inserted"] += len(inserted)
+        await count_scores(self.router, Counter(user.get("completed_todos") or 0 for user in inserted))
+        return skipped + [lines[index] for index in failed]
+
+    async def flush_users(self):
+        if not self.users:
+            return
+        batch, self.users = self.users, []
+        claims = {}
+        if self.router.sharded:
+            batch, claims = await self._claim_directory(batch)
+
+        by_shard = {}
+        for line_number, user in batch:
+            by_shard.setdefault(self.router.shard_name(user["id"]), []).append((line_number, user))
+        pending = list(by_shard)
+        not_inserted = []
+        try:
+            while pending:
+                name = pending.pop(0)
+                not_inserted.extend(await self._insert_users(self.router.shards[name], by_shard[name]))
+        finally:
+            # Shards not attempted because an earlier insert raised never received their users.
+            not_inserted.extend(line_number for name in pending for line_number, _ in by_shard[name])
+            await self._release_claims(claims, not_inserted)
+        self._progress()
+
+    def _remember(self, user: dict, db):
+        self.known_users[user["id"]] = (storage_for(user), db)
+        self.known_users.move_to_end(user["id"])
+        while len(self.known_users) > KNOWN_USERS_CACHE_SIZE:
+            self.known_users.popitem(last=False)
+
+    async def _resolve(self, db, user_ids: set, resolved: dict):
+        async for user in db.users.find({"id": {"$in": list(user_ids)}}, {"id": 1, "schema_version": 1}):
+            self._remember(user, db)
+            resolved[user["id"]] = self.known_users[user["id"]]
+
+    async def _push_todos(self, db, batch: list):
+        """
+        Append todos to their users on one shard, skipping todos whose id the user already has,
+        so importing the same file twice does not duplicate todos.
+        """
+        existing = {}
+        async for user in db.users.find({"id": {"$in": list({user_id for _, user_id, _, _ in batch})}},
+                                        {"id": 1, "todos.id": 1, "todos._i": 1}):
+            existing[user["id"]] = {str(todo.get("id", todo.get("_i"))) for todo in user.get("todos") or []}
+
+        grouped, counts, first_lines = {}, {}, {}
+        for line_number, user_id, todo, storage in batch:
+            seen = existing.setdefault(user_id, set())
+            if todo["id"] in seen:
+                self.stats["todos_skipped"] += 1
+                continue
+            try:
+                encoded = storage.encode(todo)
+            except ValueError as e:
+                self._error(line_number, str(e))
+                continue
+            seen.add(todo["id"])
+            grouped.setdefault(user_id, []).append(encoded)
+            counts[user_id] = counts.get(user_id, 0) + 1
+            first_lines.setdefault(user_id, line_number)
+        if not grouped:
+            return
+
+        operations = [UpdateOne({"id": user_id}, {"$push": {"todos": {"$each": todos}}, "$inc": {"version": 1}})
+                      for user_id, todos in grouped.items()]
+        user_ids = list(grouped)
+        inserted = sum(counts.values())
+        try:
+            await db.users.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                user_id = user_ids[error["index"]]
+                inserted -= counts[user_id]
+                self._error(first_lines[user_id], f"Todos for user {user_id} not written: {error.get('errmsg')}")
+        self.stats["todos_inserted"] += inserted
+
+    async def flush(self):
+        await self.flush_users()
+        if not self.todos:
+            return
+        batch, self.todos = self.todos, []
+
+        # Resolve the batch's users once, so evictions from the bounded cache cannot drop them midway.
+        resolved, missing = {}, {}
+        for user_id in {user_id for _, user_id, _ in batch}:
+            known = self.known_users.get(user_id)
+            if known is not None:
+                self.known_users.move_to_end(user_id)
+                resolved[user_id] = known
+            else:
+                missing.setdefault(self.router.shard_name(user_id), set()).add(user_id)
+        for name, user_ids in missing.items():
+            await self._resolve(self.router.shards[name], user_ids, resolved)
+        if self.router.previous_ring is not None:
+            # Like ShardRouter.locate: users the rebalance has not moved yet are on their old shard.
+            previous = {}
+            for user_ids in missing.values():
+                for user_id in user_ids - resolved.keys():
+                    previous.setdefault(self.router.previous_ring.lookup(user_id), set()).add(user_id)
+            for name, user_ids in previous.items():
+                await self._resolve(self.router.shards[name], user_ids, resolved)
+
+        by_shard = {}
+        for line_number, user_id, todo in batch:
+            known = resolved.get(user_id)
+            if known is None:
+                self._error(line_number, f"User {user_id} not found")
+                continue
+            storage, db = known
+            by_shard.setdefault(id(db), (db, []))[1].append((line_number, user_id, todo, storage))
+        for db, shard_batch in by_shard.values():
+            await self._push_todos(db, shard_batch)
+        self._progress()
+
+    def _progress(self):
+        if self.on_progress:
+            self.on_progress(dict(self.stats))
+
+    def report(self) -> dict:
+        return {**self.stats, "error_details": self.errors}
+
+
+async def import_lines(shard_router, lines: AsyncIterator[str], batch_size: int = 1000,
+                       on_progress: Optional[Callable[[dict], None]] = None) -> dict:
+    """
+    Import NDJSON export lines.
+
+    Parameters:
+    - shard_router (ShardRouter): Places each user on its shard.
+    - lines: An async iterator of NDJSON lines.
+    - batch_size (int): Number of users or todos written per round trip.
+    - on_progress (callable, optional): Called with the running counters after every batch.
+
+    Returns:
+    - dict: Line, insert and error counts, plus up to 1000 per-line errors.
+    """
+    importer = BulkImporter(shard_router, batch_size=batch_size, on_progress=on_progress)
+    line_number = 0
+    async for line in lines:
+        line_number += 1
+        await importer.add_line(line_number, line)
+    await importer.flush()
+    return importer.report()
+
+
+async def iter_upload_lines(upload, chunk_size: int = 1 << 16) -> AsyncIterator[str]:
+    """
+    Split an uploaded file into lines while reading it in chunks.
+    """
+    pending = b""
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            break
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8")
+    if pending:
+        yield pending.decode("utf-8")
+
+
+async def _iter_file_lines(path: str) -> AsyncIterator[str]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            yield line
+
+
+async def main(args):
+    from app import database
+
+    await database.connect_to_mongo()
+    shard_router = database.get_router()
+    try:
+        if args.command == "export":
+            async for line in export_lines(export_all_cursor(shard_router, args.include_credentials), args.format):
+                sys.stdout.write(line)
+        else:
+            report = await import_lines(
+                shard_router, _iter_file_lines(args.path), batch_size=args.batch_size,
+                on_progress=lambda stats: logging.info(f"import: {stats}"),
+            )
+            for error in report["error_details"]:
+                logging.warning(f"line {error['line']}: {error['error']}")
+            logging.info(f"import: done {dict((k, v) for k, v in report.items() if k != 'error_details')}")
+    finally:
+        await database.close_mongo_connection()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Export or import users and todos")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export")
+    export_parser.add_argument("--format", choices=("ndjson", "csv"), default="ndjson")
+    export_parser.add_argument("--include-credentials", action="store_true")
+    import_parser = commands.add_parser("import")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--batch-size", type=int, default=1000)
+    asyncio.run(main(parser.parse_args()))
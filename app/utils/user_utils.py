@@ -2,6 +2,7 @@ from datetime import datetime, timedelta
 from jose import jwt
 from passlib.context import CryptContext
 from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.concurrency import run_in_threadpool
 
 SECRET_KEY = "SUPERKEY"  
 ALGORITHM = "HS256"
@@ -47,7 +48,7 @@ async def authenticate_user(db: AsyncIOMotorClient, username: str, password: str
     dict: User information if authentication is successful, None otherwise.
     """
     user = await db['users'].find_one({"username": username})  
-    if user and pwd_context.verify(password, user['hashed_password']):
+    if user and await run_in_threadpool(pwd_context.verify, password, user['hashed_password']):
         return user
     return None
 
@@ -0,0 +1,17 @@
+import pytest
+
+
+@pytest.fixture
+def client(shard_router):
+    """A test client whose routes use the `shard_router` fixture of the requesting module."""
+    from fastapi.testclient import TestClient
+
+    from app.database import get_shard_router
+    from app.main import app
+
+    async def override():
+        return shard_router
+
+    app.dependency_overrides[get_shard_router] = override
+    yield TestClient(app)
+    app.dependency_overrides.pop(get_shard_router, None)
@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.utils.admission import AdmissionLimiter
+
+
+@pytest.mark.asyncio
+async def test_limiter_sheds_after_queue_timeout():
+    limiter = AdmissionLimiter("test", max_concurrency=1, max_queue=4, queue_timeout=0.05)
+    await limiter.acquire()
+    with pytest.raises(HTTPException) as exc:
+        await limiter.acquire()
+    limiter.release()
+
+    assert exc.value.status_code == 503
+    assert exc.value.headers["Retry-After"] == "1"
+    assert limiter.stats()["rejected_timeout"] == 1
+    assert limiter.stats()["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_limiter_sheds_when_queue_full():
+    limiter = AdmissionLimiter("test", max_concurrency=1, max_queue=0, queue_timeout=1)
+    await limiter.acquire()
+    with pytest.raises(HTTPException):
+        await limiter.acquire()
+
+    assert limiter.stats()["rejected_queue_full"] == 1
+
+
+@pytest.mark.asyncio
+async def test_limiter_admits_waiter_on_release():
+    limiter = AdmissionLimiter("test", max_concurrency=1, max_queue=1, queue_timeout=1)
+    await limiter.acquire()
+    waiter = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+    limiter.release()
+    await waiter
+
+    assert limiter.stats()["admitted"] == 2
+    assert limiter.stats()["in_flight"] == 1
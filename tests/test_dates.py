@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.loadtest.stand_in import StandInDatabase
+from app.migrations.normalize_dates import normalize_todo
+from app.utils.analytics import calculate_avg_completion_time
+from app.utils.dates import normalize_days_active, parse_datetime
+from app.utils.sharding import ShardRouter
+
+
+def test_parse_datetime_accepts_fractions_and_offsets():
+    assert parse_datetime("2024-05-01T10:00:00") == datetime(2024, 5, 1, 10, tzinfo=timezone.utc)
+    assert parse_datetime("2024-05-01T10:00:00.250Z") == datetime(2024, 5, 1, 10, 0, 0, 250000, tzinfo=timezone.utc)
+    assert parse_datetime("2024-05-01T12:00:00+02:00") == datetime(2024, 5, 1, 10, tzinfo=timezone.utc)
+    assert parse_datetime("not a date") is None
+
+
+def test_avg_completion_time_mixes_legacy_and_canonical_dates():
+    created = datetime(2024, 5, 1, tzinfo=timezone.utc)
+    todos = [
+        {"completed": True, "created_date": created, "completed_date": created + timedelta(hours=2)},
+        {"completed": True, "created_date": "2024-05-01T00:00:00.5", "completed_date": "2024-05-01T04:00:00.5+00:00"},
+        {"completed": True, "created_date": datetime(2024, 5, 1), "completed_date": created + timedelta(hours=6)},
+    ]
+    assert calculate_avg_completion_time(todos) == 4
+
+
+def test_normalize_days_active():
+    assert normalize_days_active(["fri", "Monday", "mon", "0"]) == ["Monday", "Friday"]
+    with pytest.raises(ValueError):
+        normalize_days_active(["someday"])
+
+
+def test_normalize_todo_keeps_unknown_values():
+    todo = normalize_todo({"id": "1", "created_date": "2024-05-01T00:00:00Z", "days_active": ["someday", "fri", "tue", "Friday"]})
+    assert todo["created_date"] == datetime(2024, 5, 1, tzinfo=timezone.utc)
+    assert todo["days_active"] == ["Tuesday", "Friday", "someday"]
+
+
+@pytest.fixture
+def shard_router():
+    return ShardRouter({"s0": StandInDatabase()})
+
+
+def test_replacing_todos_normalizes_or_rejects_weekdays(client):
+    user_id = client.post("/users/", json={"username": "wk", "name": "W", "email": "wk@example.com",
+                                           "password": "pw"}).json()["id"]
+    todo = {"id": "a" * 24, "title": "t", "description": None, "days_active": ["fri", "mon"]}
+
+    response = client.put(f"/users/{user_id}", json={"todos": [todo]})
+    assert response.status_code == 200
+    assert response.json()["todos"][0]["days_active"] == ["Monday", "Friday"]
+    response = client.put(f"/users/{user_id}", json={"todos": [dict(todo, days_active=["mon", "someday"])]})
+    assert response.status_code == 422
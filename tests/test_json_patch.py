@@ -0,0 +1,114 @@
+import pytest
+from bson import ObjectId
+
+from app.loadtest.stand_in import StandInDatabase
+from app.schemas.todo_storage import COMPACT, LEGACY
+from app.schemas.user import PatchOperation
+from app.utils.json_patch import PatchError, translate_patch
+from app.utils.sharding import ShardRouter
+
+
+def _patch(*operations):
+    return [PatchOperation(**operation) for operation in operations]
+
+
+def test_targets_only_changed_paths():
+    todo_id = str(ObjectId())
+    translation = translate_patch(_patch(
+        {"op": "replace", "path": "/trees/0/stage", "value": 3},
+        {"op": "replace", "path": f"/todos/{todo_id}/days_active", "value": ["mon", "wed"]},
+        {"op": "test", "path": "/version", "value": 4},
+    ), LEGACY)
+    assert translation.update() == {
+        "$inc": {"version": 1},
+        "$set": {"trees.0.stage": 3, "todos.$[t0].days_active": ["Monday", "Wednesday"]},
+    }
+    assert translation.array_filters == [{"t0.id": todo_id}]
+    assert {"version": 4} in translation.conditions
+
+
+def test_compact_layout_paths():
+    todo_id = str(ObjectId())
+    translation = translate_patch(_patch(
+        {"op": "add", "path": f"/todos/{todo_id}/days_active", "value": ["Tuesday"]},
+        {"op": "remove", "path": f"/todos/{todo_id}/description"},
+        {"op": "remove", "path": f"/todos/{str(ObjectId())}"},
+    ), COMPACT)
+    update = translation.update()
+    assert update["$set"] == {"todos.$[t0].m": 2}
+    assert update["$unset"] == {"todos.$[t0].d": ""}
+    assert translation.array_filters == [{"t0._i": ObjectId(todo_id)}]
+    assert len(update["$pull"]["todos"]["_i"]["$in"]) == 1
+
+
+@pytest.mark.parametrize("operation", [
+    {"op": "remove", "path": "/name"},
+    {"op": "replace", "path": "/hashed_password", "value": "x"},
+    {"op": "replace", "path": "/trees/0/stage", "value": "high"},
+    {"op": "remove", "path": "/todos/0"},
+    {"op": "replace", "path": "/todos/0/days_active", "value": ["someday"]},
+])
+def test_rejects_unsupported_or_invalid_operations(operation):
+    with pytest.raises(PatchError):
+        translate_patch(_patch(operation), LEGACY)
+
+
+@pytest.mark.parametrize("operations", [
+    [{"op": "replace", "path": "/name", "value": "B"}, {"op": "test", "path": "/name", "value": "B"}],
+    [{"op": "test", "path": "/name", "value": "A"}, {"op": "replace", "path": "/name", "value": "B"},
+     {"op": "test", "path": "/name", "value": "A"}],
+    [{"op": "remove", "path": f"/todos/{'a' * 24}"}, {"op": "test", "path": "/todos/0/title", "value": "x"}],
+    [{"op": "replace", "path": "/trees/0/stage", "value": 2}, {"op": "test", "path": "/trees/0", "value": {"name": "Uncaria", "stage": 2}}],
+])
+def test_rejects_a_test_after_a_change_to_the_same_path(operations):
+    with pytest.raises(PatchError):
+        translate_patch(_patch(*operations), LEGACY)
+
+
+def test_tests_of_other_paths_may_follow_changes():
+    translation = translate_patch(_patch(
+        {"op": "replace", "path": "/name", "value": "B"},
+        {"op": "test", "path": "/email", "value": "a@example.com"},
+        {"op": "replace", "path": "/trees/0/stage", "value": 2},
+        {"op": "test", "path": "/trees/1/stage", "value": 1},
+    ), LEGACY)
+    assert {"email": "a@example.com"} in translation.conditions
+    assert {"trees.1.stage": 1} in translation.conditions
+
+
+@pytest.fixture
+def shard_router():
+    return ShardRouter({"s0": StandInDatabase()})
+
+
+def test_get_user_sends_the_version_to_patch_against(client):
+    created = client.post("/users/", json={"username": "pat", "name": "P", "email": "pat@example.com", "password": "pw"})
+    path = f"/users/{created.json()['id']}"
+
+    fetched = client.get(path, headers={"Origin": "http://localhost:3000"})
+    assert fetched.headers["ETag"] == '"0"' and fetched.json()["version"] == 0
+    assert "etag" in fetched.headers["Access-Control-Expose-Headers"].lower()
+
+    patched = client.patch(path, json=[{"op": "replace", "path": "/name", "value": "Q"}],
+                           headers={"If-Match": fetched.headers["ETag"]})
+    assert patched.status_code == 200 and patched.json()["version"] == 1
+    stale = client.patch(path, json=[{"op": "replace", "path": "/name", "value": "R"}],
+                         headers={"If-Match": fetched.headers["ETag"]})
+    assert stale.status_code == 412
+
+
+@pytest.mark.asyncio
+async def test_tests_of_default_values_match_compact_todos(client, shard_router):
+    user_id = client.post("/users/", json={"username": "cmp", "name": "C", "email": "cmp@example.com",
+                                           "password": "pw"}).json()["id"]
+    todo_id = str(ObjectId())
+    todo = {"id": todo_id, "title": "t", "description": None, "days_active": [], "completed": False}
+    await shard_router.database_for(user_id).users.update_one(
+        {"id": user_id}, {"$set": {"schema_version": 2, "todos": [COMPACT.encode(todo)]}})
+
+    response = client.patch(f"/users/{user_id}", json=[
+        {"op": "test", "path": f"/todos/{todo_id}/completed", "value": False},
+        {"op": "test", "path": "/todos/0/days_active", "value": []},
+        {"op": "replace", "path": f"/todos/{todo_id}/title", "value": "u"},
+    ])
+    assert response.status_code == 200 and response.json()["todos"][0]["title"] == "u"
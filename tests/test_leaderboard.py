@@ -0,0 +1,111 @@
+import pytest
+
+from app.loadtest.stand_in import StandInDatabase
+from app.migrations.leaderboard_counts import rebuild
+from app.utils.leaderboard import Leaderboard, TopK, count_scores, fetch_entries, make_entry, ranked
+from app.utils.sharding import ShardRouter
+
+
+def _player(index: int, completed_todos: int) -> dict:
+    return {"id": f"u{index:03d}", "username": f"user{index}", "name": f"User {index}",
+            "completed_todos": completed_todos, "trees": [{"name": "Uncaria", "stage": 1 + completed_todos // 4}]}
+
+
+@pytest.fixture
+def shard_router():
+    return ShardRouter({"s0": StandInDatabase(), "s1": StandInDatabase()})
+
+
+async def _seed(shard_router, counts: list):
+    for index, count in enumerate(counts):
+        user = _player(index, count)
+        await shard_router.database_for(user["id"]).users.insert_one(user)
+    await rebuild(shard_router)
+
+
+def test_ranked_shares_ranks_between_ties():
+    entries = [make_entry(_player(index, count)) for index, count in enumerate([9, 5, 5, 1])]
+    assert [entry["rank"] for entry in ranked(entries)] == [1, 2, 2, 4]
+
+
+def test_top_k_admits_users_that_overtake_the_last_entry():
+    top = TopK(2)
+    top.replace([make_entry(_player(index, count)) for index, count in enumerate([5, 3, 1])])
+    top.observe(make_entry(_player(2, 2)))
+    assert [entry["id"] for entry in top.entries] == ["u000", "u001"]
+    top.observe(make_entry(_player(2, 6)))
+    assert [(entry["id"], entry["completed_todos"]) for entry in top.entries] == [("u002", 6), ("u000", 5)]
+
+
+@pytest.mark.asyncio
+async def test_top_merges_shards_and_rank_counts_users_ahead(shard_router):
+    counts = [index % 17 for index in range(60)]
+    await _seed(shard_router, counts)
+    board = Leaderboard(size=5, ttl=60)
+
+    top = await board.top(shard_router, 3)
+    assert [entry["completed_todos"] for entry in top] == [16, 16, 16]
+    outside = await board.rank(shard_router, _player(3, counts[3]))
+    assert outside["rank"] == 1 + sum(1 for count in counts if count > 3)
+
+    board.observe(_player(3, 20), _player(3, counts[3]))
+    leader = (await board.top(shard_router, 1))[0]
+    assert leader["id"] == "u003" and leader["rank"] == 1
+    behind = await board.rank(shard_router, _player(5, counts[5]))
+    assert behind["rank"] == 2 + sum(1 for count in counts if count > 5)
+
+
+@pytest.mark.asyncio
+async def test_rank_reads_the_histogram_after_a_reload(shard_router):
+    await _seed(shard_router, [4, 8, 2, 6])
+    board = Leaderboard(size=1, ttl=-1)
+    assert (await board.rank(shard_router, _player(2, 2)))["rank"] == 4
+
+    await count_scores(shard_router, {2: -1, 9: 1})
+    assert (await board.rank(shard_router, _player(0, 4)))["rank"] == 4
+    assert board.counts == {4: 1, 6: 1, 8: 1, 9: 1}
+
+
+@pytest.mark.asyncio
+async def test_fetch_entries_reads_friends_from_their_shards(shard_router):
+    await _seed(shard_router, [4, 8, 2, 6])
+
+    entries = await fetch_entries(shard_router, ["u000", "u001", "u003"])
+    assert [entry["id"] for entry in entries] == ["u001", "u003", "u000"]
+
+
+@pytest.fixture
+def board(monkeypatch):
+    board = Leaderboard(size=5, ttl=60)
+    monkeypatch.setattr("app.api.leaderboard.leaderboard", board)
+    return board
+
+
+@pytest.mark.asyncio
+async def test_leaderboard_route_ranks_globally_and_among_friends(client, shard_router, board):
+    await _seed(shard_router, [4, 8, 2, 6])
+    assert client.put("/users/u002/friends/u000").json() == ["u000"]
+    assert client.put("/users/u002/friends/u000").json() == ["u000"]
+
+    response = client.get("/leaderboard", params={"limit": 2, "user_id": "u002"}).json()
+    assert [entry["id"] for entry in response["entries"]] == ["u001", "u003"]
+    assert response["user"]["rank"] == 4
+
+    response = client.get("/leaderboard", params={"scope": "friends", "user_id": "u002"}).json()
+    assert [(entry["id"], entry["rank"]) for entry in response["entries"]] == [("u000", 1), ("u002", 2)]
+    assert client.get("/leaderboard", params={"scope": "friends"}).status_code == 400
+    assert client.get("/leaderboard", params={"user_id": "missing"}).status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_friend_routes_validate_and_cap_friends(client, shard_router, monkeypatch):
+    await _seed(shard_router, [1, 1, 1])
+    monkeypatch.setattr("app.api.users.MAX_FRIENDS", 1)
+
+    assert client.put("/users/u000/friends/u000").status_code == 400
+    assert client.put("/users/u000/friends/missing").status_code == 404
+    assert client.put("/users/missing/friends/u000").status_code == 404
+    assert client.put("/users/u000/friends/u001").json() == ["u001"]
+    assert client.put("/users/u000/friends/u002").status_code == 400
+    assert client.delete("/users/u000/friends/u001").json() == []
+    assert client.put("/users/u000/friends/u002").json() == ["u002"]
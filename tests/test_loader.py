@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from app.utils.loader import RequestDatabase, read_stats
+
+
+class _Collection:
+    def __init__(self, document):
+        self.reads = 0
+        self.document = document
+
+    async def find_one(self, filter=None, projection=None):
+        self.reads += 1
+        await asyncio.sleep(0.01)
+        return dict(self.document, todos=[dict(todo) for todo in self.document["todos"]])
+
+    async def update_one(self, filter, update):
+        self.document = dict(self.document, name="updated")
+
+
+class _Database(dict):
+    pass
+
+
+def _document(**fields) -> dict:
+    return dict({"id": "u000", "name": "User", "todos": []}, **fields)
+
+
+@pytest.fixture
+def collection():
+    return _Collection(_document(todos=[{"id": "t1"}]))
+
+
+@pytest.fixture
+def db(collection):
+    return _Database(users=collection)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_reads_share_one_round_trip(db, collection):
+    coalesced = read_stats["coalesced"]
+    results = await asyncio.gather(*(RequestDatabase(db).users.find_one({"id": "u000"}) for _ in range(5)))
+
+    assert collection.reads == 1
+    assert read_stats["coalesced"] - coalesced == 4
+    results[0]["todos"].append({"id": "t2"})
+    assert all(len(result["todos"]) == 1 for result in results[1:])
+
+
+@pytest.mark.asyncio
+async def test_request_memo_is_cleared_by_writes(db, collection):
+    request_db = RequestDatabase(db)
+    await request_db.users.find_one({"id": "u000"})
+    await request_db.users.find_one({"id": "u000"})
+    await request_db.users.update_one({"id": "u000"}, {"$set": {"name": "updated"}})
+    user = await request_db.users.find_one({"id": "u000"})
+
+    assert collection.reads == 2
+    assert user["name"] == "updated"
+
+
+@pytest.mark.asyncio
+async def test_identical_reads_on_different_shards_are_not_merged():
+    shards = [_Collection(_document(name=f"on shard {index}")) for index in range(2)]
+    results = await asyncio.gather(*(RequestDatabase(_Database(users=collection)).users.find_one({"id": "u000"})
+                                     for collection in shards))
+
+    assert [collection.reads for collection in shards] == [1, 1]
+    assert [result["name"] for result in results] == ["on shard 0", "on shard 1"]
+
+
+@pytest.mark.asyncio
+async def test_memo_keeps_the_first_result_and_copies_it_on_hits(db, collection):
+    request_db = RequestDatabase(db)
+    first = await request_db.users.find_one({"id": "u000"})
+    second = await request_db.users.find_one({"id": "u000"})
+    second["todos"].append({"id": "t2"})
+
+    assert collection.reads == 1
+    assert request_db._memo[next(iter(request_db._memo))] is first
+    assert second is not first and len(first["todos"]) == 1
@@ -0,0 +1,76 @@
+import statistics
+
+import pytest
+
+from app.loadtest.population import PopulationConfig, generate_users, seed
+from app.loadtest.runner import CountingDatabase, format_report, parse_mix, percentile, run
+from app.loadtest.stand_in import StandInDatabase
+from app.utils.sharding import ShardRouter
+
+
+def test_population_is_deterministic_and_skewed():
+    config = PopulationConfig(users=300, todos_mean=20, todos_max=120, completion_ratio=0.4, seed=7)
+    users = list(generate_users(config))
+    counts = [len(user["todos"]) for user in users]
+
+    assert counts == [len(user["todos"]) for user in generate_users(config)]
+    assert max(counts) <= 120 and statistics.median(counts) < statistics.mean(counts)
+    assert 15 < statistics.mean(counts) < 25
+
+    todos = [todo for user in users for todo in user["todos"]]
+    completed = sum(1 for todo in todos if todo.get("completed", todo.get("x")))
+    assert 0.35 < completed / len(todos) < 0.45
+
+
+def test_parse_mix():
+    assert parse_mix("login=1, list=2.5") == {"login": 1.0, "list": 2.5}
+    with pytest.raises(ValueError):
+        parse_mix("login")
+
+
+def test_percentile_uses_nearest_rank():
+    values = list(range(1, 101))
+    assert [percentile(values, f) for f in (0.0, 0.5, 0.9, 0.99, 1.0)] == [1, 50, 90, 99, 100]
+    assert percentile([1, 2, 3, 4], 0.5) == 2
+    assert percentile([5], 0.99) == 5
+    assert percentile([], 0.5) == 0.0
+
+
+@pytest.mark.asyncio
+async def test_seed_refuses_databases_not_named_for_load_tests():
+    db = StandInDatabase("todo_list_db")
+    await db.users.insert_one({"id": "real"})
+
+    with pytest.raises(ValueError):
+        await seed(db, PopulationConfig(users=2))
+    assert await db.users.count_documents({}) == 1
+
+    await seed(db, PopulationConfig(users=2), reset=True)
+    assert await db.users.count_documents({"id": "real"}) == 0
+
+
+@pytest.mark.asyncio
+async def test_run_reports_every_route():
+    from app.database import get_shard_router
+    from app.main import app
+
+    db = StandInDatabase("loadtest_db")
+    population = await seed(db, PopulationConfig(users=5, todos_mean=3))
+    shard_router = ShardRouter({"loadtest": CountingDatabase(db)})
+
+    async def override():
+        return shard_router
+
+    app.dependency_overrides[get_shard_router] = override
+    try:
+        report = await run(app, population, {"list": 1, "reset": 1}, concurrency=2, total_requests=20)
+    finally:
+        app.dependency_overrides.pop(get_shard_router, None)
+
+    assert set(report["routes"]) == {"list", "reset"}
+    assert sum(stats["requests"] for stats in report["routes"].values()) == 20
+    for stats in report["routes"].values():
+        assert stats["errors"] == 0
+        assert stats["p50_ms"] <= stats["p90_ms"] <= stats["p99_ms"] <= stats["max_ms"]
+        assert stats["mongo_round_trips_per_request"] >= 1
+    assert format_report(report).splitlines()[0].startswith("20 requests in ")
@@ -0,0 +1,126 @@
+from datetime import timedelta
+
+import pytest
+import pytest_asyncio
+
+from app.loadtest.stand_in import StandInDatabase
+from app.migrations.leaderboard_counts import rebuild
+from app.utils import outbox
+from app.utils.dates import utcnow
+from app.utils.sharding import ShardRouter
+
+
+@pytest.fixture
+def db():
+    return StandInDatabase()
+
+
+@pytest.fixture
+def worker(db):
+    return outbox.OutboxWorker(ShardRouter({"s0": db}))
+
+
+@pytest_asyncio.fixture
+async def user(db):
+    todo = {"id": "t1", "title": "a", "created_date": utcnow() - timedelta(days=2), "completed": False,
+            "completed_date": None, "days_active": []}
+    user = {"id": "u1", "todos": [todo], "completed_todos": 3, "trees": [{"name": "Uncaria", "stage": 1}],
+            "average_completion_time": None, "version": 0}
+    await db.users.insert_one(user)
+    return user
+
+
+@pytest.fixture
+def shard_router():
+    return ShardRouter({"s0": StandInDatabase(), "s1": StandInDatabase()})
+
+
+def _resets(count: int) -> list:
+    now = utcnow()
+    return [outbox.make_event(outbox.TODO_RESET, f"t{index}", now - timedelta(days=1, minutes=index))
+            for index in range(count)]
+
+
+async def _record(db, user, update, *events):
+    await db.users.update_one({"id": user["id"]}, outbox.record(update, *events))
+
+
+@pytest.mark.asyncio
+async def test_worker_applies_resets_once_and_clears_the_outbox(db, worker, user):
+    await _record(db, user, {"$inc": {"version": 1}}, *_resets(2))
+
+    assert await worker.run_once() == 2
+    assert await worker.run_once() == 0
+    stored = await db.users.find_one({"id": user["id"]})
+    assert stored["completed_todos"] == 5
+    assert stored["trees"][0]["stage"] == 2
+    assert stored["outbox"] == []
+
+
+@pytest.mark.asyncio
+async def test_racing_deliveries_apply_an_event_once(db, worker, user):
+    await _record(db, user, {"$inc": {"version": 1}}, *_resets(1))
+    snapshot = await db.users.find_one({"id": user["id"]}, outbox.PROJECTION)
+
+    assert await worker.process_user(db, snapshot) == 1
+    assert await worker.process_user(db, snapshot) == 0
+    assert (await db.users.find_one({"id": user["id"]}))["completed_todos"] == 4
+    assert worker.stats["conflicts"] == 1
+
+
+@pytest.mark.asyncio
+async def test_completion_event_updates_average_completion_time(db, worker, user):
+    completed_date = utcnow().replace(microsecond=0)
+    await _record(db, user, {"$set": {"todos.0.completed": True, "todos.0.completed_date": completed_date}},
+                  outbox.make_event(outbox.TODO_COMPLETED, "t1", completed_date))
+
+    await worker.run_once()
+    stored = await db.users.find_one({"id": user["id"]})
+    assert 47 < stored["average_completion_time"] < 49
+    assert stored["completed_todos"] == 3
+
+
+@pytest.mark.asyncio
+async def test_worker_moves_the_user_in_the_leaderboard_histogram(db, worker, user, monkeypatch):
+    observed = []
+    monkeypatch.setattr(outbox, "_listeners", [lambda updated, previous: observed.append((updated, previous))])
+    await rebuild(worker.router)
+    await _record(db, user, {"$inc": {"version": 1}}, *_resets(2))
+
+    await worker.run_once()
+    counts = {count["_id"]: count["count"] for count in await db.leaderboard_counts.find({}).to_list(None)}
+    assert counts == {3: 0, 5: 1}
+    assert [(updated["completed_todos"], previous["completed_todos"]) for updated, previous in observed] == [(5, 3)]
+
+
+@pytest.mark.asyncio
+async def test_completion_changes_outside_complete_record_events(client, shard_router):
+    user_id = client.post("/users/", json={"username": "ev", "name": "E", "email": "ev@example.com",
+                                           "password": "pw"}).json()["id"]
+    todo = client.post(f"/users/{user_id}/todos", json={"title": "t"}).json()
+    users = shard_router.database_for(user_id).users
+
+    async def pending():
+        stored = await users.find_one({"id": user_id})
+        await users.update_one({"id": user_id}, {"$set": {"outbox": []}})
+        return [event["type"] for event in stored.get("outbox") or []]
+
+    assert await pending() == []
+    client.put(f"/users/{user_id}/todos/{todo['id']}", json={"title": None, "description": None, "days_active": None,
+                                                            "completed": True, "completed_date": "2024-05-06T10:00:00Z"})
+    assert await pending() == [outbox.TODO_COMPLETED]
+    client.patch(f"/users/{user_id}", json=[{"op": "replace", "path": f"/todos/{todo['id']}/completed", "value": False}])
+    assert await pending() == [outbox.TODO_REOPENED]
+    client.put(f"/users/{user_id}", json={"todos": [dict(todo, completed=True, completed_date="2024-05-06T10:00:00Z")]})
+    assert await pending() == [outbox.TODO_COMPLETED]
+    client.put(f"/users/{user_id}", json={"todos": []})
+    assert await pending() == [outbox.TODO_DELETED]
+
+
+@pytest.mark.asyncio
+async def test_events_without_visible_changes_keep_the_version(db, worker, user):
+    await _record(db, user, {"$inc": {"version": 1}}, outbox.make_event(outbox.TODO_DELETED, "t9"))
+
+    assert await worker.run_once() == 1
+    stored = await db.users.find_one({"id": user["id"]})
+    assert stored["version"] == 1 and stored["outbox"] == []
@@ -0,0 +1,120 @@
+import json
+from collections import Counter
+
+import pytest
+
+from app.loadtest.stand_in import StandInDatabase
+from app.migrations.rebalance_shards import rebalance
+from app.utils.sharding import HashRing, ShardRouter, parse_shards
+from app.utils.transfer import import_lines
+
+
+async def _lines(lines):
+    for line in lines:
+        yield line
+
+
+def _user(index: int, **fields) -> dict:
+    """A stored user with the unique fields the directory claims."""
+    return dict({"id": f"u{index:03d}", "username": f"user{index}", "email": f"user{index}@example.com",
+                 "name": f"User {index}", "hashed_password": "x", "version": 0}, **fields)
+
+
+def _record(user: dict) -> str:
+    return json.dumps(dict(user, type="user", todos=[]))
+
+
+@pytest.fixture
+def shards():
+    return {"s0": StandInDatabase(), "s1": StandInDatabase()}
+
+
+@pytest.fixture
+def shard_router(shards):
+    return ShardRouter(shards)
+
+
+def test_ring_spreads_users_and_adding_a_shard_moves_only_its_share():
+    keys = [f"user-{index}" for index in range(3000)]
+    before = HashRing(["s0", "s1"])
+    after = HashRing(["s0", "s1", "s2"])
+
+    counts = Counter(after.lookup(key) for key in keys)
+    assert all(700 < count < 1300 for count in counts.values())
+    moved = [key for key in keys if before.lookup(key) != after.lookup(key)]
+    assert all(after.lookup(key) == "s2" for key in moved)
+    assert len(moved) < 1500
+
+
+def test_parse_shards_defaults_database_name():
+    assert parse_shards("a=mongodb://h1:27017/app; b=mongodb://h2:27017") == [
+        ("a", "mongodb://h1:27017/app", "app"),
+        ("b", "mongodb://h2:27017", "todo_list_db"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_claim_rejects_a_value_held_by_another_user(shard_router):
+    assert await shard_router.claim("username", "alice", "u1")
+    assert await shard_router.claim("username", "alice", "u1")
+    assert not await shard_router.claim("username", "alice", "u2")
+    await shard_router.release("username", "alice", "u2")
+    assert await shard_router.lookup("username", "alice") == "u1"
+
+
+@pytest.mark.asyncio
+async def test_import_places_users_on_their_shards(shards, shard_router):
+    lines = [_record(_user(index, id=f"{index:024x}")) for index in range(20)]
+    lines.append(_record(_user(0, id=f"{99:024x}", email="other@example.com")))
+
+    report = await import_lines(shard_router, _lines(lines), batch_size=8)
+    placed = {name: await db.users.count_documents({}) for name, db in shards.items()}
+
+    assert report["users_inserted"] == 20 and report["errors"] == 1
+    assert sum(placed.values()) == 20 and all(placed.values())
+
+
+@pytest.mark.asyncio
+async def test_rebalance_moves_users_and_locate_follows_them(shards):
+    for index in range(50):
+        await shards["s0"].users.insert_one(_user(index, version=index % 3))
+    router = ShardRouter(shards, previous=["s0"])
+    moving = [f"u{index:03d}" for index in range(50) if router.shard_name(f"u{index:03d}") == "s1"]
+    assert await router.locate(moving[0]) is shards["s0"]
+
+    report = await rebalance(router, batch_size=7)
+
+    assert await router.locate(moving[0]) is shards["s1"]
+    assert report["moved"] == len(moving) and report["conflicts"] == 0
+    assert report["directory_added"] == 100
+    assert {name: await db.users.count_documents({}) for name, db in shards.items()} == {
+        "s0": 50 - len(moving), "s1": len(moving)}
+    assert await router.lookup("email", "user3@example.com") == "u003"
+
+
+@pytest.mark.asyncio
+async def test_import_releases_claims_of_users_it_does_not_insert(shard_router):
+    first = _user(0, id=f"{1:024x}")
+    same_id = _user(1, id=f"{1:024x}")
+    taken_email = _user(2, id=f"{2:024x}", email=first["email"])
+
+    report = await import_lines(shard_router, _lines([_record(user) for user in (first, same_id, taken_email)]))
+
+    assert report["users_inserted"] == 1 and report["errors"] == 2
+    entries = await shard_router.directory.find({}).to_list(None)
+    assert sorted(entry["_id"] for entry in entries) == ["email:user0@example.com", "username:user0"]
+    assert {entry["user_id"] for entry in entries} == {first["id"]}
+
+
+@pytest.mark.asyncio
+async def test_failed_signup_releases_its_directory_claims(client, shard_router, monkeypatch):
+    import app.api.users as users_api
+
+    def fail(password):
+        raise RuntimeError("hashing failed")
+
+    monkeypatch.setattr(users_api, "get_password_hash", fail)
+    with pytest.raises(RuntimeError):
+        client.post("/users/", json={"username": "alice", "name": "A", "email": "a@example.com", "password": "pw"})
+
+    assert await shard_router.directory.find({}).to_list(None) == []
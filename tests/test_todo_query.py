@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta, timezone
+
+import mongomock
+import pytest
+from bson import ObjectId
+
+from app.loadtest.stand_in import StandInDatabase
+from app.schemas.todo_storage import encode_todo
+from app.utils.sharding import ShardRouter
+from app.utils.todo_query import build_todo_page_pipeline
+
+NOW = datetime(2024, 5, 6, tzinfo=timezone.utc)
+
+
+def _todo(title, days, completed):
+    return {"id": str(ObjectId()), "title": title, "description": None, "days_active": days,
+            "created_date": NOW, "completed": completed,
+            "completed_date": NOW + timedelta(hours=1) if completed else None}
+
+
+def _users():
+    todos = [_todo("a", ["Monday"], True), _todo("b", ["Tuesday"], False), _todo("c", ["Monday"], False)]
+    users = mongomock.MongoClient(tz_aware=True).db.users
+    users.insert_many([
+        {"id": "legacy", "todos": todos},
+        {"id": "compact", "schema_version": 2, "todos": [encode_todo(todo) for todo in todos]},
+    ])
+    return users
+
+
+def _titles(result):
+    return [todo.get("title", todo.get("t")) for todo in result["todos"]]
+
+
+def test_filters_both_layouts():
+    users = _users()
+    for user_id in ("legacy", "compact"):
+        [result] = users.aggregate(build_todo_page_pipeline(user_id, day="Monday", completed=False))
+        assert result["total"] == 1 and _titles(result) == ["c"]
+        [result] = users.aggregate(build_todo_page_pipeline(user_id, completed_before=NOW + timedelta(days=1)))
+        assert _titles(result) == ["a"]
+
+
+def test_pages_after_filtering():
+    [result] = _users().aggregate(build_todo_page_pipeline("legacy", offset=1, limit=1))
+    assert result["total"] == 3 and _titles(result) == ["b"]
+
+
+def test_unknown_user_returns_nothing():
+    assert list(_users().aggregate(build_todo_page_pipeline("missing", limit=1))) == []
+
+
+def test_sorts_both_layouts_before_paging():
+    users = _users()
+    for user_id in ("legacy", "compact"):
+        [result] = users.aggregate(build_todo_page_pipeline(user_id, sort="-title", limit=2))
+        assert result["total"] == 3 and _titles(result) == ["c", "b"]
+        [result] = users.aggregate(build_todo_page_pipeline(user_id, sort="completed_date", completed=False))
+        assert _titles(result) == ["b", "c"]
+
+
+def test_sorted_pages_of_a_user_without_todos_are_empty():
+    users = _users()
+    users.insert_one({"id": "empty", "todos": []})
+    [result] = users.aggregate(build_todo_page_pipeline("empty", sort="title"))
+    assert result == {"total": 0, "todos": []}
+    assert list(users.aggregate(build_todo_page_pipeline("missing", sort="title"))) == []
+
+
+@pytest.fixture
+def shard_router():
+    return ShardRouter({"s0": StandInDatabase()})
+
+
+def test_sorted_listing_and_invalid_day_over_http(client):
+    user_id = client.post("/users/", json={"username": "sol", "name": "S", "email": "s@example.com",
+                                           "password": "pw"}).json()["id"]
+    for title in ("b", "c", "a"):
+        client.post(f"/users/{user_id}/todos", json={"title": title, "days_active": ["Monday"]})
+
+    response = client.get(f"/users/{user_id}/todos", params={"sort": "title", "offset": 1, "limit": 5})
+    assert [todo["title"] for todo in response.json()] == ["b", "c"]
+    assert response.headers["X-Total-Count"] == "3"
+    assert client.get(f"/users/{user_id}/todos", params={"day": "someday"}).status_code == 422
@@ -0,0 +1,81 @@
+from datetime import datetime, timezone
+
+import bson
+import pytest
+from bson import ObjectId
+
+from app.loadtest.stand_in import StandInDatabase
+from app.migrations.compact_todos import migrate
+from app.schemas.todo import TodoDisplay
+from app.schemas.todo_storage import COMPACT, LEGACY, decode_todo, encode_todo
+from app.utils.todo_storage import compact_user_todos, resolve_todo_storage
+
+
+def _legacy_todo():
+    return {
+        "id": str(ObjectId()),
+        "title": "Water the tree",
+        "description": "Every morning",
+        "days_active": ["Monday", "Wednesday", "Sunday"],
+        "created_date": datetime(2024, 5, 1, 8, tzinfo=timezone.utc),
+        "completed": True,
+        "completed_date": datetime(2024, 5, 1, 9, tzinfo=timezone.utc),
+    }
+
+
+def test_compact_round_trip_keeps_display_output():
+    todo = _legacy_todo()
+    encoded = encode_todo(todo)
+    assert encoded["m"] == 0b1000101
+    assert isinstance(encoded["_i"], ObjectId)
+    assert TodoDisplay(**decode_todo(encoded)) == TodoDisplay(**todo)
+    assert len(bson.encode(encoded)) < len(bson.encode(todo))
+
+
+def test_compact_omits_defaults():
+    todo = {"id": str(ObjectId()), "title": "t", "description": None, "days_active": [],
+            "completed": False, "completed_date": None}
+    assert set(encode_todo(todo)) == {"_i", "t"}
+    assert decode_todo(encode_todo(todo))["completed"] is False
+
+
+def test_storage_paths():
+    todo_id = str(ObjectId())
+    assert LEGACY.match(todo_id) == {"todos.id": todo_id}
+    assert COMPACT.match(todo_id) == {"todos._i": ObjectId(todo_id)}
+    assert COMPACT.set_fields({"completed": True}) == {"todos.$.x": True}
+    assert COMPACT.set_fields({"days_active": ["Tue"]}) == {"todos.$.m": 2}
+
+
+@pytest.mark.asyncio
+async def test_compaction_skips_users_whose_todos_do_not_validate():
+    db = StandInDatabase()
+    await db.users.insert_many([
+        {"id": "ok", "todos": [_legacy_todo()]},
+        {"id": "bad-id", "todos": [dict(_legacy_todo(), id="todo-1")]},
+        {"id": "no-description", "todos": [{key: value for key, value in _legacy_todo().items()
+                                             if key != "description"}]},
+    ])
+
+    report = await migrate(db)
+
+    assert report["converted"] == 1 and report["skipped"] == 2
+    assert (await db.users.find_one({"id": "ok"}))["schema_version"] == 2
+
+
+@pytest.mark.asyncio
+async def test_conversions_bump_the_version(monkeypatch):
+    db = StandInDatabase()
+    await db.users.insert_many([
+        {"id": "on-write", "version": 3, "todos": [_legacy_todo()]},
+        {"id": "if-match", "version": 3, "todos": [_legacy_todo()]},
+        {"id": "migrated", "version": 3, "todos": [_legacy_todo()]},
+    ])
+    monkeypatch.setattr("app.utils.todo_storage.COMPACT_ENABLED", True)
+
+    assert await compact_user_todos(db, "on-write")
+    assert not (await resolve_todo_storage(db, "if-match", convert=False)).compact
+    await migrate(db)
+
+    versions = {user["id"]: user["version"] async for user in db.users.find({}, {"id": 1, "version": 1})}
+    assert versions == {"on-write": 4, "if-match": 4, "migrated": 4}
@@ -0,0 +1,191 @@
+import csv
+import io
+import json
+from datetime import datetime, timezone
+
+import pytest
+import pytest_asyncio
+from bson import ObjectId
+
+from app.loadtest.stand_in import StandInDatabase
+from app.utils import auth, transfer
+from app.utils.sharding import ShardRouter
+from app.utils.transfer import BulkImporter, import_lines
+from app.utils.user_utils import create_access_token
+
+CREATED = datetime(2024, 5, 6, tzinfo=timezone.utc)
+
+
+def _todo(title: str) -> dict:
+    return {"id": str(ObjectId()), "title": title, "description": None, "days_active": ["Monday"],
+            "created_date": CREATED, "completed": False, "completed_date": None}
+
+
+def _user(index: int, **fields) -> dict:
+    user = {"id": f"{index:024x}", "username": f"user{index}", "name": f"User {index}",
+            "email": f"user{index}@example.com", "hashed_password": "x", "todos": [],
+            "trees": [{"name": "Uncaria", "stage": 1}], "completed_todos": 0, "version": 0}
+    user.update(fields)
+    return user
+
+
+def _headers(user: dict) -> dict:
+    token = create_access_token({"sub": user["username"], "uid": user["id"]})
+    return {"Authorization": f"Bearer {token}"}
+
+
+async def _lines(text: str):
+    for line in text.splitlines():
+        yield line
+
+
+@pytest.fixture
+def shard_router():
+    return ShardRouter({"s0": StandInDatabase(), "s1": StandInDatabase()})
+
+
+@pytest.fixture
+def target():
+    return ShardRouter({"s0": StandInDatabase(), "s1": StandInDatabase()})
+
+
+@pytest_asyncio.fixture
+async def users(shard_router):
+    stored = [_user(index, todos=[_todo(f"t{index}a"), _todo(f"t{index}b")])
+              for index in range(2)]
+    for user in stored:
+        await shard_router.database_for(user["id"]).users.insert_one(dict(user))
+    return stored
+
+
+@pytest.fixture
+def admin(monkeypatch):
+    user = _user(9)
+    monkeypatch.setattr(auth, "ADMIN_USERNAMES", {user["username"]})
+    return user
+
+
+def test_admin_routes_require_an_admin_token(client, users):
+    assert client.get("/admin/export").status_code == 401
+    assert client.get("/admin/export", headers={"Authorization": "Bearer nope"}).status_code == 401
+    assert client.get("/admin/export", headers=_headers(users[0])).status_code == 403
+    response = client.post("/admin/import", headers=_headers(users[0]),
+                           files={"file": ("users.ndjson", b"", "application/x-ndjson")})
+    assert response.status_code == 403
+
+
+def test_admin_export_includes_credentials_only_when_asked(client, admin, users):
+    plain = client.get("/admin/export", headers=_headers(admin))
+    assert plain.status_code == 200 and "hashed_password" not in plain.text
+    full = client.get("/admin/export", params={"include_credentials": True}, headers=_headers(admin))
+    assert full.text.count("hashed_password") == 2
+
+
+def test_user_export_is_limited_to_its_owner(client, admin, users):
+    path = f"/users/{users[0]['id']}/export"
+    assert client.get(path).status_code == 401
+    assert client.get(path, headers=_headers(users[1])).status_code == 403
+    own = client.get(path, params={"include_credentials": True}, headers=_headers(users[0]))
+    assert own.status_code == 200 and "hashed_password" not in own.text
+    assert client.get(path, headers=_headers(admin)).status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_ndjson_round_trip_restores_users_todos_and_logins(client, admin, users, target):
+    exported = client.get("/admin/export", params={"include_credentials": True}, headers=_headers(admin)).text
+
+    report = await import_lines(target, _lines(exported))
+
+    assert report["users_inserted"] == 2 and report["todos_inserted"] == 4 and report["errors"] == 0
+    for user in users:
+        restored = await target.database_for(user["id"]).users.find_one({"id": user["id"]})
+        assert restored["hashed_password"] == user["hashed_password"]
+        assert [todo.get("title", todo.get("t")) for todo in restored["todos"]] == [
+            todo["title"] for todo in user["todos"]]
+
+
+@pytest.mark.asyncio
+async def test_importing_twice_does_not_duplicate_todos(client, admin, users, target):
+    exported = client.get("/admin/export", params={"include_credentials": True}, headers=_headers(admin)).text
+    await import_lines(target, _lines(exported))
+
+    report = await import_lines(target, _lines(exported))
+
+    assert report["todos_inserted"] == 0 and report["todos_skipped"] == 4
+    assert report["errors"] == 2
+    restored = await target.database_for(users[0]["id"]).users.find_one({"id": users[0]["id"]})
+    assert len(restored["todos"]) == 2
+
+
+def test_csv_export_has_one_row_per_todo(client, users):
+    response = client.get(f"/users/{users[0]['id']}/export", params={"format": "csv"},
+                          headers=_headers(users[0]))
+
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [(row["user_id"], row["title"], row["days_active"]) for row in rows] == [
+        (users[0]["id"], "t0a", "Monday"), (users[0]["id"], "t0b", "Monday")]
+
+
+@pytest.mark.asyncio
+async def test_import_reports_errors_per_record(target):
+    user = dict(_user(1), type="user", todos=[])
+    lines = [
+        json.dumps(user),
+        "{not json",
+        json.dumps({"type": "tree"}),
+        json.dumps({"type": "todo", "user_id": f"{2:024x}", **_todo("orphan")}, default=str),
+        json.dumps({"type": "todo", "user_id": user["id"], "id": str(ObjectId())}),
+        json.dumps({"type": "todo", "user_id": user["id"], **_todo("kept")}, default=str),
+    ]
+
+    report = await import_lines(target, _lines("\n".join(lines)))
+
+    assert report["users_inserted"] == 1 and report["todos_inserted"] == 1
+    assert [error["line"] for error in report["error_details"]] == [2, 3, 5, 4]
+
+
+@pytest.mark.asyncio
+async def test_importer_bounds_its_cache_of_known_users(target, monkeypatch):
+    monkeypatch.setattr(transfer, "KNOWN_USERS_CACHE_SIZE", 2)
+    importer = BulkImporter(target, batch_size=3)
+    line_number = 0
+    for index in range(5):
+        user = _user(index)
+        for record in (dict(user, type="user", todos=[]), {"type": "todo", "user_id": user["id"], **_todo("a")}):
+            line_number += 1
+            await importer.add_line(line_number, json.dumps(record, default=str))
+    await importer.flush()
+
+    assert importer.report()["todos_inserted"] == 5
+    assert len(importer.known_users) <= 2
+
+
+@pytest.mark.asyncio
+async def test_import_normalizes_weekdays_and_rejects_unknown_ones(target):
+    user = _user(1, schema_version=2)
+    await target.database_for(user["id"]).users.insert_one(user)
+    lines = [json.dumps({"type": "todo", "user_id": user["id"], **_todo("bad"), "days_active": ["someday"]},
+                        default=str),
+             json.dumps({"type": "todo", "user_id": user["id"], **_todo("good"), "days_active": ["fri", "mon"]},
+                        default=str)]
+
+    report = await import_lines(target, _lines("\n".join(lines)))
+
+    assert report["todos_inserted"] == 1 and [error["line"] for error in report["error_details"]] == [1]
+    stored = await target.database_for(user["id"]).users.find_one({"id": user["id"]})
+    assert stored["todos"][0]["m"] == 0b10001
+
+
+@pytest.mark.asyncio
+async def test_import_finds_users_a_rebalance_has_not_moved_yet():
+    shards = {"s0": StandInDatabase(), "s1": StandInDatabase()}
+    router = ShardRouter(shards, previous=["s0"])
+    user = next(_user(index) for index in range(50)
+                if router.shard_name(f"{index:024x}") == "s1")
+    await shards["s0"].users.insert_one(user)
+
+    report = await import_lines(router, _lines(json.dumps({"type": "todo", "user_id": user["id"], **_todo("a")},
+                                                          default=str)))
+
+    assert report["todos_inserted"] == 1 and report["errors"] == 0
+    assert len((await shards["s0"].users.find_one({"id": user["id"]}))["todos"]) == 1